@@ -0,0 +1,362 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Offline micro-benchmarks of the per-request hot path, nothing here talks to AWS. From backend/:
+#   python -m benchmarks.bench [--filter jwt] [--update-baseline] [--baseline FILE] [--threshold 1.25]
+# Each case is compared against the committed baseline and the run fails if any got slower than
+# the threshold allows, or has no baseline to compare with. Baselines only mean anything on the
+# machine (and Python) that saved them, so re-record it with --update-baseline when that changes.
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+PAGE_SIZE = 1000
+
+Setup = Callable[[], Callable[[], Any]]
+CASES: Dict[str, Setup] = {}
+
+def case(name: str):
+    def _deco(setup: Setup) -> Setup:
+        CASES[name] = setup
+        return setup
+    return _deco
+
+def _offline_environment():
+    # Read when the yellows modules are first imported, so set before any case runs
+    for name, value in (
+        ('AWS_REGION', 'eu-west-1'),
+        ('AWS_DEFAULT_REGION', 'eu-west-1'),
+        ('DDB_TABLE_NAME', 'bench'),
+        ('DOMAIN_NAME', 'bench.example.com'),
+        ('KMS_KEY_ARN', 'arn:aws:kms:eu-west-1:000000000000:key/bench'),
+        ('JWT_SECRET_ARN', 'bench-jwt'),
+        ('WARM_UP_ON_INIT', 'false'),
+        ('SECRETS_TTL_SECONDS', '1e9'),
+        ('REVOCATION_REFRESH_SECONDS', '1e9'),
+        ('LEADERBOARD_REFRESH_SECONDS', '1000000000'),
+        ('POWERTOOLS_TRACE_DISABLED', 'true'),
+        ('POWERTOOLS_METRICS_NAMESPACE', 'yellows-bench'),
+        ('POWERTOOLS_SERVICE_NAME', 'yellows-bench'),
+        ('LOG_LEVEL', 'WARNING'),
+    ):
+        os.environ.setdefault(name, value)
+
+# Stands in for KMS: data keys are handed out and unwrapped from memory, failing as KMS would
+# for blobs it never issued or a KeyId other than the one a blob was issued under
+class _LocalKms:
+    class exceptions:
+        class IncorrectKeyException(Exception):
+            pass
+
+        class InvalidCiphertextException(Exception):
+            pass
+
+    def __init__(self):
+        self._keys: Dict[bytes, Tuple[str, bytes]] = {}
+        self.decrypt_calls = 0
+
+    def generate_data_key(self, KeyId: str, KeySpec: str, EncryptionContext: dict) -> dict:
+        plaintext = os.urandom(32)
+        blob = os.urandom(64)
+        self._keys[blob] = (KeyId, plaintext)
+        return {'Plaintext': plaintext, 'CiphertextBlob': blob, 'KeyId': KeyId}
+
+    def decrypt(self, CiphertextBlob: bytes, EncryptionContext: dict, KeyId: Optional[str]=None) -> dict:
+        self.decrypt_calls += 1
+        if CiphertextBlob not in self._keys:
+            raise self.exceptions.InvalidCiphertextException()
+        key_id, plaintext = self._keys[CiphertextBlob]
+        if KeyId is not None and KeyId != key_id:
+            raise self.exceptions.IncorrectKeyException()
+        return {'Plaintext': plaintext, 'KeyId': key_id}
+
+def _without_metrics(f: Callable[[], Any]) -> Callable[[], Any]:
+    from yellows.powertools import metrics
+    # Nothing flushes them between calls here, and powertools prints them once 100 pile up
+    def _run():
+        try:
+            return f()
+        finally:
+            metrics.clear_metrics()
+    return _run
+
+# A throwaway JWT secret in the layout jwt_keys reads
+def _generate_secret(algorithm: str) -> dict:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+    if algorithm == 'RS256':
+        private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    elif algorithm == 'ES256':
+        private = ec.generate_private_key(ec.SECP256R1())
+    else:
+        private = ed25519.Ed25519PrivateKey.generate()
+    return {
+        'privateKey': private.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode(),
+        'publicKey': private.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo).decode(),
+    }
+
+_auth = None
+def _offline_auth():
+    global _auth
+    if _auth is None:
+        from yellows.auth import get_auth
+        from yellows.config import get_config
+        from yellows.models import Revocation
+        config = get_config()
+        config._secrets = {'JWT_SECRET_ARN': _generate_secret(os.environ.get('BENCH_JWT_ALGORITHM', 'RS256'))}
+        config._secrets_fetched_at = time.monotonic()
+        _auth = get_auth()
+        _auth.revocations._revocation = Revocation.create()
+        _auth.revocations._loaded_at = time.monotonic()
+    return _auth
+
+def _claims() -> dict:
+    return {
+        'iss': os.environ['DOMAIN_NAME'],
+        'sub': '1234@discord',
+        'exp': (datetime.utcnow() + timedelta(days=1)).isoformat(),
+        'scope': ['event-admin'],
+        'gen': 0,
+        'login_gen': 0,
+    }
+
+def _api_event(path: str, token: str, query: dict) -> dict:
+    headers = {'Cookie': 'yellows-auth={}'.format(token), 'Accept': 'application/json', 'Accept-Encoding': 'gzip'}
+    return {
+        'resource': path, 'path': path, 'httpMethod': 'GET',
+        'headers': headers, 'multiValueHeaders': {k: [v] for k, v in headers.items()},
+        'queryStringParameters': query, 'multiValueQueryStringParameters': {k: [v] for k, v in query.items()},
+        'pathParameters': None, 'stageVariables': None, 'body': None, 'isBase64Encoded': False,
+        'requestContext': {'requestId': 'bench', 'path': path, 'httpMethod': 'GET', 'stage': 'prod'},
+    }
+
+def _events(n: int):
+    from yellows.models import Event
+    starts_at = datetime(2030, 1, 1, 18, tzinfo=timezone.utc)
+    return [Event.create('event{}'.format(i), 'Event number {}'.format(i),
+                         starts_at + timedelta(days=i), starts_at + timedelta(days=i, hours=4)) for i in range(n)]
+
+def _users(n: int):
+    from yellows.models import User
+    users = [User.create('nick{}'.format(i), 'Full Name {}'.format(i)) for i in range(n)]
+    for i, user in enumerate(users):
+        user.event_count = i % 50
+        user.achievement_score = (i * 7919) % 10000
+    return users
+
+@case('jwt.encode')
+def _jwt_encode():
+    # The signing half of Auth._make_jwt_for_login, its revocation read is storage
+    keys = _offline_auth().keys()
+    claims = _claims()
+    return lambda: keys.encode(claims)
+
+@case('jwt.verify')
+def _jwt_verify():
+    auth = _offline_auth()
+    token = auth.keys().encode(_claims())
+    def _run():
+        auth._verified.clear()
+        return auth._verify_jwt(token)
+    return _without_metrics(_run)
+
+# Every signing algorithm the key set takes, each with throwaway keys, plus verifying straight
+# from the PEM the way every request did before keys were parsed once per secret version
+def _jwt_algorithm_cases(algorithm: str):
+    def _keys():
+        from yellows.jwt_keys import JwtKeySet
+        secret = _generate_secret(algorithm)
+        keys = JwtKeySet(secret)
+        return secret, keys, keys.encode(_claims())
+
+    @case('jwt_keys.{}.encode'.format(algorithm))
+    def _encode():
+        _, keys, _ = _keys()
+        claims = _claims()
+        return lambda: keys.encode(claims)
+
+    @case('jwt_keys.{}.verify'.format(algorithm))
+    def _verify():
+        _, keys, token = _keys()
+        return lambda: keys.decode(token)
+
+    @case('jwt_keys.{}.verify_pem'.format(algorithm))
+    def _verify_pem():
+        from authlib.jose import JsonWebToken
+        secret, _, token = _keys()
+        pem_jwt = JsonWebToken([algorithm])
+        return lambda: pem_jwt.decode(token, secret['publicKey'])
+
+from yellows.jwt_keys import ALGORITHMS  # reads no config, safe before _offline_environment
+for _algorithm in ALGORITHMS:
+    _jwt_algorithm_cases(_algorithm)
+
+@case('auth.check_auth')
+def _check_auth():
+    # Cookie parsing through to the stateless Principal, with the token already verified once
+    from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEvent
+    from yellows.auth import router
+    auth = _offline_auth()
+    token = auth.keys().encode(_claims())
+    router.current_event = APIGatewayProxyEvent(_api_event('/api/users', token, {}))
+    return _without_metrics(lambda: auth._check_auth(('event-admin',)))
+
+def _crypto():
+    from yellows.config import get_config
+    from yellows.crypto import get_crypto
+    get_config().__dict__['kms_client'] = _LocalKms()
+    return get_crypto()
+
+_next_token = {'pk': {'S': 'USER_nick999'}, 'sk': {'S': 'USER_nick999'}, 'type': {'S': 'USER'}, 'index_sort_order': {'N': '123'}}
+
+@case('crypto.encrypt_dict')
+def _encrypt_dict():
+    crypto = _crypto()
+    return lambda: crypto.encrypt_dict(_next_token)
+
+@case('crypto.decrypt_dict')
+def _decrypt_dict():
+    crypto = _crypto()
+    token = crypto.encrypt_dict(_next_token)
+    return lambda: crypto.decrypt_dict(token)
+
+@case('users.calculate_sort_order')
+def _sort_order():
+    from yellows.models import User
+    return lambda: User._calculate_sort_order(123456, 'somebody')
+
+@case('events.from_raw_data')
+def _from_raw_data():
+    from yellows.models import Event
+    raw = _events(1)[0].serialize()
+    return lambda: Event.from_raw_data(raw)
+
+@case('events.from_ddb')
+def _from_ddb():
+    from yellows.models import event_items
+    event = _events(1)[0]
+    # The layout from_ddb was written for stores datetimes as isoformat()
+    raw = event.serialize()
+    raw['StartsAt'] = {'S': event.starts_at.isoformat()}
+    raw['EndsAt'] = {'S': event.ends_at.isoformat()}
+    return lambda: event_items.Event.from_ddb(raw)
+
+@case('events.translate_raw')
+def _translate_raw_event():
+    from yellows.views.events import _translate_raw_event
+    raw = _events(1)[0].serialize()
+    return lambda: _translate_raw_event(raw)
+
+@case('users.translate_page')
+def _translate_users():
+    from yellows.views.users import _translate_user
+    users = _users(PAGE_SIZE)
+    return lambda: [_translate_user(user) for user in users]
+
+@case('events.translate_page')
+def _translate_events():
+    from yellows.views.events import _translate_event
+    events = _events(PAGE_SIZE)
+    return lambda: [_translate_event(event) for event in events]
+
+# A page of Query items as list views used to serve them (built into models, then translated)
+# against the compiled translators they use now
+@case('users.page_from_model')
+def _users_page_from_model():
+    from yellows.models import User
+    from yellows.views.users import _translate_user
+    raws = [user.serialize() for user in _users(PAGE_SIZE)]
+    return lambda: [_translate_user(User.from_raw_data(raw)) for raw in raws]
+
+@case('users.page_from_raw')
+def _users_page_from_raw():
+    from yellows.views.users import _translate_raw_user
+    raws = [user.serialize() for user in _users(PAGE_SIZE)]
+    return lambda: [_translate_raw_user(raw) for raw in raws]
+
+@case('events.page_from_model')
+def _events_page_from_model():
+    from yellows.models import Event
+    from yellows.views.events import _translate_event
+    raws = [event.serialize() for event in _events(PAGE_SIZE)]
+    return lambda: [_translate_event(Event.from_raw_data(raw)) for raw in raws]
+
+@case('events.page_from_raw')
+def _events_page_from_raw():
+    from yellows.views.events import _translate_raw_event
+    raws = [event.serialize() for event in _events(PAGE_SIZE)]
+    return lambda: [_translate_raw_event(raw) for raw in raws]
+
+@case('api.resolve')
+def _resolve():
+    # Routing, auth, the view and response encoding, served from an in-memory leaderboard
+    from yellows import api_handler
+    from yellows.leaderboard import Leaderboard, get_leaderboard_cache
+    users = _users(PAGE_SIZE)
+    cache = get_leaderboard_cache()
+    cache._board = Leaderboard(1, [(u.achievement_score, u.nick_name) for u in users], {u.nick_name: u.full_name for u in users})
+    cache._checked_at = time.monotonic()
+    token = _offline_auth().keys().encode(_claims())
+    event = _api_event('/api/users/leaderboard', token, {'max_items': '100'})
+    api_handler._include_router_for_path(event['path'])
+    def _run():
+        ret = api_handler.process_response(event, api_handler.app.resolve(event, None))
+        assert ret['statusCode'] == 200, ret
+        return ret
+    return _without_metrics(_run)
+
+def measure(f: Callable[[], Any], repeat: int) -> float:
+    timer = timeit.Timer(f)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+def run(names, repeat: int) -> Dict[str, float]:
+    return {name: measure(CASES[name](), repeat) for name in names}
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float) -> bool:
+    ok = True
+    print("{:<28}{:>12}{:>12}{:>8}".format('case', 'us/op', 'baseline', 'ratio'))
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            ok = False
+            print("{:<28}{:>12.2f}{:>12}{:>8}  NO BASELINE".format(name, seconds * 1e6, '-', '-'))
+            continue
+        ratio = seconds / base
+        regressed = ratio > threshold
+        ok = ok and not regressed
+        print("{:<28}{:>12.2f}{:>12.2f}{:>8.2f}{}".format(name, seconds * 1e6, base * 1e6, ratio, '  REGRESSED' if regressed else ''))
+    return ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench')
+    parser.add_argument('--filter', default='', help="only run cases whose name contains this")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help="record these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=1.25, help="slowdown ratio that fails the run")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    elif not args.update_baseline:
+        parser.error("no baseline at {}, record one with --update-baseline".format(args.baseline))
+
+    _offline_environment()
+    names = [name for name in CASES if args.filter in name]
+    results = run(names, args.repeat)
+    ok = compare(results, baseline, args.threshold)
+    if args.update_baseline:
+        # Keeps whatever cases this run filtered out
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'results': baseline}, f, indent=2, sort_keys=True)
+    sys.exit(0 if ok or args.update_baseline else 1)
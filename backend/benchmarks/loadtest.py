@@ -0,0 +1,389 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import copy
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from benchmarks.bench import _LocalKms, _api_event, _generate_secret, _offline_environment
+
+# Load replay against a synthetic single-table dataset:
+#   python -m benchmarks.loadtest --endpoint-url http://localhost:8000 --create-table --users 100000 \
+#       --events 10000 --bookings 2000000 --requests 20000 --concurrency 8
+# Generates the dataset through the models, then replays synthesized (or --events-file recorded) API
+# Gateway events against api_handler.lambda_handler. Each worker process stands in for one Lambda
+# container, so its first request is the cold one. --skip-generate replays against a dataset an
+# earlier run left behind, --in-memory runs everything against moto instead of DynamoDB Local.
+
+FIRST_NAMES = ('Alex', 'Sam', 'Jo', 'Chris', 'Pat', 'Robin', 'Charlie', 'Jamie', 'Morgan', 'Taylor',
+               'Ana', 'Zoë', 'Björn', 'Siobhán', 'Kai', 'Noor', 'Mateo', 'Yuki', 'Priya', 'Olu')
+LAST_NAMES = ('Smith', 'Jones', 'Williams', 'Brown', 'Taylor', 'Davies', 'Evans', 'Müller', 'García',
+              'Nakamura', 'Okafor', 'Kowalski', 'Ó Briain', 'Singh', 'Hughes', 'Dubois', 'Rossi', 'Kim')
+
+# Relative weight of each synthesized route in the replay
+ROUTE_MIX = {
+    'GET /api/events?window=upcoming': 20,
+    'GET /api/events/<short_name>': 15,
+    'GET /api/users': 10,
+    'GET /api/users/<nick_name>': 15,
+    'GET /api/users/<nick_name>/rank': 5,
+    'GET /api/users/leaderboard': 20,
+    'GET /api/users/search': 15,
+}
+
+WRITE_CHUNK_ITEMS = 500
+
+@dataclass
+class Dataset:
+    users: int
+    events: int
+    bookings: int
+    logins: int
+    seed: int
+
+    def nick_name(self, i: int) -> str:
+        return 'user{:06d}'.format(i)
+
+    def full_name(self, i: int) -> str:
+        return '{} {}'.format(FIRST_NAMES[i % len(FIRST_NAMES)], LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)])
+
+    def short_name(self, i: int) -> str:
+        return 'event{:05d}'.format(i)
+
+    def login_id(self, i: int) -> str:
+        return '{}@loadtest'.format(i)
+
+    # A few events draw most of the bookings, like the real thing
+    def event_weights(self) -> List[float]:
+        return [1.0 / (i + 1) ** 0.8 for i in range(self.events)]
+
+    def attendee_counts(self) -> List[int]:
+        weights = self.event_weights()
+        total = sum(weights)
+        return [min(self.users, round(self.bookings * w / total)) for w in weights]
+
+# Worker processes inherit all of this
+def _environment(args):
+    os.environ['DDB_TABLE_NAME'] = args.table
+    if args.endpoint_url:
+        os.environ['DDB_ENDPOINT_URL'] = args.endpoint_url
+    # Unlike the benchmarks, keep the deployed refresh intervals
+    os.environ.setdefault('REVOCATION_REFRESH_SECONDS', '60')
+    os.environ.setdefault('LEADERBOARD_REFRESH_SECONDS', '60')
+    _offline_environment()
+
+def create_table(table_name: str):
+    from yellows.config import get_config
+    client = get_config().dynamodb_client
+    key = lambda hash_key, range_key: [{'AttributeName': hash_key, 'KeyType': 'HASH'}, {'AttributeName': range_key, 'KeyType': 'RANGE'}]
+    # Matches the table in infra/lib/yellows-stack.ts
+    client.create_table(
+        TableName=table_name,
+        BillingMode='PAY_PER_REQUEST',
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': t} for name, t in (
+            ('PK', 'S'), ('SK', 'S'), ('Type', 'S'), ('IndexSortOrder', 'N'))],
+        KeySchema=key('PK', 'SK'),
+        GlobalSecondaryIndexes=[
+            {'IndexName': 'InvertedIndex', 'KeySchema': key('SK', 'PK'), 'Projection': {'ProjectionType': 'ALL'}},
+            {'IndexName': 'TypeIndexOrder', 'KeySchema': key('Type', 'IndexSortOrder'), 'Projection': {'ProjectionType': 'ALL'}},
+            {'IndexName': 'LeaderboardIndex', 'KeySchema': key('Type', 'IndexSortOrder'), 'Projection': {
+                'ProjectionType': 'INCLUDE',
+                'NonKeyAttributes': ['NickName', 'FullName', 'EventCount', 'AchievementScore', '__PDB_DISCRIM'],
+            }},
+        ],
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+
+def _write_items(items: list):
+    from yellows.models.base import BaseItem
+    with BaseItem.batch_write() as batch:
+        for item in items:
+            batch.save(item)
+    return len(items)
+
+def _chunks(items: Iterator, size: int) -> Iterator[list]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _write_all(items: Iterator, workers: int) -> int:
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for chunk in _chunks(items, WRITE_CHUNK_ITEMS):
+            pending.append(pool.submit(_write_items, chunk))
+            # Bookings are generated lazily, only keep a few chunks of them in memory
+            if len(pending) >= workers * 2:
+                written += pending.pop(0).result()
+        for future in pending:
+            written += future.result()
+    return written
+
+def generate(dataset: Dataset, workers: int):
+    from yellows.leaderboard import rebuild_snapshot
+    from yellows.models import Event, EventBooking, Login, Revocation, User
+
+    rng = random.Random(dataset.seed)
+    t_start = time.monotonic()
+    now = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    attendee_counts = dataset.attendee_counts()
+    events = []
+    for i, attendees in enumerate(attendee_counts):
+        starts_at = now + timedelta(days=rng.randint(-365, 365), hours=rng.choice((9, 12, 18, 19)))
+        event = Event.create(dataset.short_name(i), 'Event {}'.format(i), starts_at, starts_at + timedelta(hours=rng.randint(2, 8)))
+        event.attendee_count = attendees
+        event.yellow_count = rng.randint(0, attendees // 10 + 1)
+        events.append(event)
+    print("Writing {} events".format(len(events)), file=sys.stderr)
+    _write_all(iter(events), workers)
+
+    users = [User.create(dataset.nick_name(i), dataset.full_name(i)) for i in range(dataset.users)]
+    event_counts = [0] * dataset.users
+
+    def _bookings():
+        for event, attendees in zip(events, attendee_counts):
+            for user_id in rng.sample(range(dataset.users), attendees):
+                event_counts[user_id] += 1
+                booking = EventBooking.create(event, users[user_id], '18:00', '23:00')
+                booking.is_team_lead = rng.random() < 0.02
+                yield booking
+    print("Writing {} bookings".format(sum(attendee_counts)), file=sys.stderr)
+    _write_all(_bookings(), workers)
+
+    for user, event_count in zip(users, event_counts):
+        user.event_count = event_count
+        # Long tailed, most people have a handful of points and a few have thousands
+        user.achievement_score = min(int(rng.paretovariate(1.2) * 10) - 10, 100000)
+    print("Writing {} users".format(len(users)), file=sys.stderr)
+    _write_all(iter(users), workers)
+
+    logins = [Login.create(dataset.login_id(i)) for i in range(dataset.logins)]
+    _write_all(iter(logins), workers)
+    Revocation.create().save()
+    rebuild_snapshot()
+    print("Generated dataset in {:.1f}s".format(time.monotonic() - t_start), file=sys.stderr)
+
+def synthesize(dataset: Dataset, count: int, seed: int) -> List[Tuple[str, str, dict]]:
+    rng = random.Random(seed)
+    routes = list(ROUTE_MIX)
+    route_weights = [ROUTE_MIX[route] for route in routes]
+    event_weights = dataset.event_weights()
+    ret = []
+    for route in rng.choices(routes, route_weights, k=count):
+        nick = dataset.nick_name(rng.randrange(dataset.users))
+        short_name = dataset.short_name(rng.choices(range(dataset.events), event_weights)[0])
+        query: Dict[str, str] = {}
+        if route.startswith('GET /api/events?'):
+            path = '/api/events'
+            query = {'window': 'upcoming', 'max_items': '20'}
+        elif route == 'GET /api/events/<short_name>':
+            path = '/api/events/' + short_name
+        elif route == 'GET /api/users':
+            path = '/api/users'
+            query = {'max_items': '20'}
+        elif route == 'GET /api/users/<nick_name>':
+            path = '/api/users/' + nick
+        elif route == 'GET /api/users/<nick_name>/rank':
+            path = '/api/users/{}/rank'.format(nick)
+        elif route == 'GET /api/users/leaderboard':
+            path = '/api/users/leaderboard'
+            query = rng.choice(({}, {'around': nick, 'max_items': '20'}))
+        else:
+            # Typeahead, anything from a couple of letters of a name to a whole nick
+            name = rng.choice((nick, dataset.full_name(rng.randrange(dataset.users))))
+            path = '/api/users/search'
+            query = {'q': name[:rng.randint(2, len(name))]}
+        ret.append((route, path, query))
+    return ret
+
+def _recorded(path: str) -> List[Tuple[str, dict]]:
+    ret = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                ret.append(('{} {}'.format(event['httpMethod'], event.get('resource', event['path'])), event))
+    return ret
+
+class _Context:
+    function_name = 'yellows-loadtest'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:000000000000:function:yellows-loadtest'
+    aws_request_id = 'loadtest'
+
+def _with_cookie(event: dict, token: str) -> dict:
+    event = copy.deepcopy(event)
+    cookie = 'yellows-auth={}'.format(token)
+    event['headers'] = dict(event.get('headers') or {}, Cookie=cookie)
+    event['multiValueHeaders'] = dict(event.get('multiValueHeaders') or {}, Cookie=[cookie])
+    return event
+
+# One Lambda container: imports the handler (timed as init), then serves its share in order
+def _replay_worker(task: dict) -> dict:
+    # Powertools prints logs and EMF to stdout, keep it out of the report
+    sys.stdout = open(os.devnull, 'w')
+    t_start = time.perf_counter()
+    from yellows import api_handler
+    from yellows.auth import get_auth
+    from yellows.config import get_config
+    from yellows.dynamo_stats import get_dynamo_stats
+    from yellows.retry_stats import get_retry_stats
+    init_ms = (time.perf_counter() - t_start) * 1000.0
+
+    config = get_config()
+    config._secrets = {'JWT_SECRET_ARN': task['jwt_secret']}
+    config._secrets_fetched_at = time.monotonic()
+    config.__dict__['kms_client'] = _LocalKms()
+    # Reset by the handler at the start of each request
+    stats = get_dynamo_stats()
+    retries = get_retry_stats()
+    keys = get_auth().keys()
+    rng = random.Random(task['seed'])
+    results = []
+    for route, event in task['requests']:
+        claims = {
+            'iss': config.domain_name,
+            'sub': rng.choice(task['login_ids']),
+            'exp': (datetime.utcnow() + timedelta(days=1)).isoformat(),
+            'scope': [],
+            'gen': 0,
+            'login_gen': 0,
+        }
+        event = _with_cookie(event, keys.encode(claims))
+        t_request = time.perf_counter()
+        try:
+            status = api_handler.lambda_handler(event, _Context())['statusCode']
+        except Exception:
+            status = 'error'
+        results.append((route, status, (time.perf_counter() - t_request) * 1000.0,
+                        stats.calls, stats.read_units, stats.write_units, retries.retries, retries.throttles))
+    return {'init_ms': init_ms, 'results': results}
+
+def _percentile(sorted_values: List[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100.0))]
+
+def _summarize(rows: List[tuple]) -> dict:
+    latencies = sorted(row[2] for row in rows)
+    return {
+        'requests': len(rows),
+        'errors': sum(1 for row in rows if row[1] == 'error' or row[1] >= 500),
+        'p50_ms': _percentile(latencies, 50),
+        'p95_ms': _percentile(latencies, 95),
+        'p99_ms': _percentile(latencies, 99),
+        'ddb_calls': sum(row[3] for row in rows) / len(rows),
+        'rcu': sum(row[4] for row in rows) / len(rows),
+        'wcu': sum(row[5] for row in rows) / len(rows),
+        'retries': sum(row[6] for row in rows),
+        'throttles': sum(row[7] for row in rows),
+    }
+
+def replay(requests: List[Tuple[str, dict]], concurrency: int, jwt_secret: dict,
+           login_ids: List[str], seed: int, fork: bool) -> dict:
+    tasks = [{
+        'jwt_secret': jwt_secret, 'login_ids': login_ids, 'seed': seed + i,
+        'requests': requests[i::concurrency],
+    } for i in range(concurrency)]
+    # moto's tables only exist in this process, so in-memory workers have to be forked from it
+    context = multiprocessing.get_context('fork' if fork else 'spawn')
+    t_start = time.monotonic()
+    with context.Pool(concurrency) as pool:
+        workers = pool.map(_replay_worker, tasks)
+    elapsed = time.monotonic() - t_start
+
+    cold = [worker['results'][0] for worker in workers if worker['results']]
+    warm = [row for worker in workers for row in worker['results'][1:]]
+    by_route: Dict[str, List[tuple]] = {}
+    for row in warm:
+        by_route.setdefault(row[0], []).append(row)
+    return {
+        'requests': len(requests),
+        'concurrency': concurrency,
+        'elapsed_s': elapsed,
+        'requests_per_s': len(requests) / elapsed,
+        'cold': {
+            'init_ms': sorted(worker['init_ms'] for worker in workers),
+            'first_request': _summarize(cold) if cold else None,
+        },
+        'warm': _summarize(warm) if warm else None,
+        'routes': {route: _summarize(rows) for route, rows in sorted(by_route.items())},
+    }
+
+def _print_report(report: dict):
+    print("{requests} requests at concurrency {concurrency} in {elapsed_s:.1f}s ({requests_per_s:.1f}/s)".format(**report))
+    init = report['cold']['init_ms']
+    print("init: min {:.0f}ms, max {:.0f}ms".format(init[0], init[-1]))
+    header = "{:<36}{:>8}{:>7}{:>9}{:>9}{:>9}{:>7}{:>8}{:>8}{:>9}{:>10}".format(
+        '', 'count', 'errors', 'p50 ms', 'p95 ms', 'p99 ms', 'ddb', 'rcu', 'wcu', 'retries', 'throttles')
+    row = ("{:<36}{requests:>8}{errors:>7}{p50_ms:>9.1f}{p95_ms:>9.1f}{p99_ms:>9.1f}{ddb_calls:>7.1f}{rcu:>8.1f}{wcu:>8.1f}"
+           "{retries:>9}{throttles:>10}")
+    print(header)
+    for name, summary in [('cold (first request)', report['cold']['first_request']), ('warm', report['warm'])] \
+            + list(report['routes'].items()):
+        if summary is not None:
+            print(row.format(name, **summary))
+
+def _start_in_memory():
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise SystemExit("--in-memory needs moto installed")
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--endpoint-url', help="DynamoDB Local, e.g. http://localhost:8000")
+    target.add_argument('--in-memory', action='store_true', help="moto in this process, implies --create-table")
+    parser.add_argument('--table', default='yellows-loadtest')
+    parser.add_argument('--create-table', action='store_true')
+    parser.add_argument('--skip-generate', action='store_true', help="replay against the dataset in --manifest")
+    parser.add_argument('--manifest', default='loadtest-dataset.json')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--bookings', type=int, default=2000000)
+    parser.add_argument('--logins', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--write-workers', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--events-file', help="JSON lines of recorded API Gateway events to replay instead")
+    parser.add_argument('--report-json', help="also write the report here")
+    args = parser.parse_args()
+
+    _environment(args)
+    if args.in_memory:
+        _start_in_memory()
+    if args.skip_generate:
+        with open(args.manifest) as f:
+            dataset = Dataset(**json.load(f))
+    else:
+        dataset = Dataset(args.users, args.events, args.bookings, args.logins, args.seed)
+        if args.create_table or args.in_memory:
+            create_table(args.table)
+        generate(dataset, args.write_workers)
+        with open(args.manifest, 'w') as f:
+            json.dump(asdict(dataset), f)
+
+    if args.events_file:
+        requests = _recorded(args.events_file)
+    else:
+        requests = [(route, _api_event(path, '', query)) for route, path, query in synthesize(dataset, args.requests, args.seed)]
+    report = replay(requests, args.concurrency, _generate_secret('ES256'),
+                    [dataset.login_id(i) for i in range(dataset.logins)], args.seed, fork=args.in_memory)
+    _print_report(report)
+    if args.report_json:
+        with open(args.report_json, 'w') as f:
+            json.dump(report, f, indent=2)
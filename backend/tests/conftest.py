@@ -0,0 +1,48 @@
+import inspect
+import os
+import pytest
+
+# Read when the yellows modules are first imported, so set before any test imports them
+for name, value in (
+    ('AWS_REGION', 'eu-west-1'),
+    ('AWS_DEFAULT_REGION', 'eu-west-1'),
+    ('AWS_ACCESS_KEY_ID', 'testing'),
+    ('AWS_SECRET_ACCESS_KEY', 'testing'),
+    ('DDB_TABLE_NAME', 'test'),
+    ('DOMAIN_NAME', 'test.example.com'),
+    ('KMS_KEY_ARN', 'arn:aws:kms:eu-west-1:000000000000:key/test'),
+    ('WARM_UP_ON_INIT', 'false'),
+    ('POWERTOOLS_TRACE_DISABLED', 'true'),
+    ('POWERTOOLS_METRICS_NAMESPACE', 'yellows-test'),
+    ('POWERTOOLS_SERVICE_NAME', 'yellows-test'),
+):
+    os.environ.setdefault(name, value)
+
+# An empty data table in moto
+@pytest.fixture
+def table(monkeypatch):
+    moto = pytest.importorskip('moto')
+    from yellows.models import leaderboard
+    # moto holds binary values base64 encoded and counts that against the item limit, where
+    # DynamoDB counts the raw bytes, so chunks that fit DynamoDB are too big for it
+    monkeypatch.setattr(leaderboard, 'CHUNK_BYTES', (leaderboard.ITEM_LIMIT_BYTES - 8 * 1024) * 3 // 4)
+    with moto.mock_aws():
+        from yellows.config import get_config
+        from benchmarks.loadtest import create_table
+        create_table(get_config().get_dynamo_table_name())
+        yield
+
+# Calls a view straight past auth_required and annotate_operation, with the given query string
+# as the current request. Router.get doesn't return the view, so it's found in the router.
+@pytest.fixture
+def call_view(monkeypatch):
+    from aws_lambda_powertools.event_handler.api_gateway import BaseRouter
+    from aws_lambda_powertools.utilities.data_classes import APIGatewayProxyEvent
+
+    def _call(router, path: str, query: dict):
+        view = next(f for (rule, methods, *_), f in router._routes.items() if rule == path and 'GET' in methods)
+        event = APIGatewayProxyEvent({'httpMethod': 'GET', 'path': path, 'queryStringParameters': query})
+        # The resolver sets it on BaseRouter, so every router sees it
+        monkeypatch.setattr(BaseRouter, 'current_event', event, raising=False)
+        return inspect.unwrap(view)()
+    return _call
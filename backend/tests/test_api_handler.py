@@ -0,0 +1,31 @@
+import pytest
+
+from yellows import api_handler
+from yellows.responses import get_header
+
+class _Context:
+    function_name = 'yellows-test'
+    memory_limit_in_mb = 1024
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:000000000000:function:yellows-test'
+    aws_request_id = 'test'
+
+def test_get_header_ignores_case():
+    event = {'headers': {'X-Yellows-Profile': '1'}}
+    assert get_header(event, 'x-yellows-profile') == '1'
+    assert get_header(event, 'X-YELLOWS-PROFILE') == '1'
+    assert get_header({'headers': None}, 'cookie') is None
+
+# Metrics are intercepted, so there's nothing left for log_metrics to flush
+@pytest.mark.filterwarnings('ignore:No metrics to publish')
+def test_profiling_decision_failures_are_counted_as_faults(monkeypatch, caplog):
+    def _should_profile(event):
+        raise RuntimeError("auth unavailable")
+    monkeypatch.setattr(api_handler, '_should_profile', _should_profile)
+    added = {}
+    monkeypatch.setattr(api_handler.metrics, 'add_metric', lambda name, unit, value: added.__setitem__(name, value))
+    event = {'httpMethod': 'GET', 'path': '/api/users', 'headers': {}, 'requestContext': {'requestId': 'test'}}
+    with pytest.raises(RuntimeError):
+        api_handler.lambda_handler(event, _Context())
+    assert added['Fault'] == 1
+    assert 'Time' in added
+    assert 'Request timing' in caplog.messages
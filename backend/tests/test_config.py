@@ -0,0 +1,58 @@
+import json
+
+from botocore.validate import ParamValidationDecorator
+import pytest
+
+from yellows.config import SECRET_ENVVARS, Config
+
+class _SecretsManagerWithoutBatch:
+    def get_secret_value(self, SecretId: str) -> dict:
+        raise AssertionError("nothing should be fetched")
+
+ARN_PREFIX = 'arn:aws:secretsmanager:us-east-1:123456789012:secret:'
+
+# BatchGetSecretValue answers with the full ARN and name, whatever the id was asked by
+class _SecretsManager:
+    def batch_get_secret_value(self, SecretIdList: list) -> dict:
+        values = []
+        for name in ('discord', 'jwt'):
+            arn = ARN_PREFIX + name + '-Ab12Cd'
+            if any(secret_id in (arn, name, ARN_PREFIX + name) for secret_id in SecretIdList):
+                values.append({'ARN': arn, 'Name': name, 'SecretString': json.dumps({'name': name})})
+        return {'SecretValues': values}
+
+def test_no_secrets_configured_fetches_nothing(monkeypatch):
+    for envvar in SECRET_ENVVARS:
+        monkeypatch.delenv(envvar, raising=False)
+    config = Config()
+    config.__dict__['secrets_manager_client'] = _SecretsManagerWithoutBatch()
+    assert config._fetch_secret_strings([]) == {}
+    config.prefetch_secrets()
+    assert config._secrets == {}
+
+def test_only_the_direct_dynamodb_client_validates_parameters():
+    config = Config()
+    # meta.config doesn't show it, botocore only wraps the serializer of clients that validate
+    assert isinstance(config.dynamodb_client._serializer, ParamValidationDecorator)
+    assert not isinstance(config.pynamodb_client._serializer, ParamValidationDecorator)
+
+@pytest.mark.parametrize('discord_id,jwt_id', [
+    (ARN_PREFIX + 'discord-Ab12Cd', ARN_PREFIX + 'jwt-Ab12Cd'),
+    ('discord', ARN_PREFIX + 'jwt'),
+])
+def test_secrets_found_by_full_arn_name_or_partial_arn(monkeypatch, discord_id, jwt_id):
+    monkeypatch.setenv('DISCORD_OAUTH2_SECRET_ARN', discord_id)
+    monkeypatch.setenv('JWT_SECRET_ARN', jwt_id)
+    config = Config()
+    config.__dict__['secrets_manager_client'] = _SecretsManager()
+    config.prefetch_secrets()
+    assert config._secrets == {'DISCORD_OAUTH2_SECRET_ARN': {'name': 'discord'}, 'JWT_SECRET_ARN': {'name': 'jwt'}}
+
+def test_unmatched_secret_names_its_envvar(monkeypatch):
+    monkeypatch.setenv('DISCORD_OAUTH2_SECRET_ARN', 'discord')
+    # A partial ARN missing more than the random suffix
+    monkeypatch.setenv('JWT_SECRET_ARN', ARN_PREFIX + 'jw')
+    config = Config()
+    config.__dict__['secrets_manager_client'] = _SecretsManager()
+    with pytest.raises(RuntimeError, match='JWT_SECRET_ARN'):
+        config.prefetch_secrets()
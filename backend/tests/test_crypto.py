@@ -0,0 +1,74 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+import pytest
+
+from benchmarks.bench import _LocalKms
+from yellows.config import get_config
+from yellows.crypto import CryptoHelper
+
+OTHER_KEY_ARN = 'arn:aws:kms:eu-west-1:000000000000:key/other'
+PAGE_KEY = {'PK': {'S': 'USER_alice'}, 'SK': {'S': 'USER_alice'}}
+
+@pytest.fixture
+def kms(monkeypatch):
+    kms = _LocalKms()
+    monkeypatch.setitem(get_config().__dict__, 'kms_client', kms)
+    monkeypatch.delenv('PREVIOUS_KMS_KEY_ARNS', raising=False)
+    return kms
+
+def _flip(token: str, index: int) -> str:
+    b = bytearray(urlsafe_b64decode(token))
+    b[index] ^= 1
+    return urlsafe_b64encode(bytes(b)).decode('utf-8')
+
+def _minted_under(key_arn: str, kms, monkeypatch) -> str:
+    with monkeypatch.context() as m:
+        m.setenv('KMS_KEY_ARN', key_arn)
+        return CryptoHelper().encrypt_dict(PAGE_KEY)
+
+def test_round_trip(kms):
+    crypto = CryptoHelper()
+    assert crypto.decrypt_dict(crypto.encrypt_dict(PAGE_KEY)) == PAGE_KEY
+
+def test_another_container_unwraps_through_kms(kms):
+    token = CryptoHelper().encrypt_dict(PAGE_KEY)
+    assert CryptoHelper().decrypt_dict(token) == PAGE_KEY
+    assert kms.decrypt_calls == 1
+
+# Past the magic, as tokens without it are taken for the Encryption SDK's format
+@pytest.mark.parametrize('where', [2, 3, 10, -1])
+def test_tampered_token_is_rejected(kms, where):
+    crypto = CryptoHelper()
+    token = crypto.encrypt_dict(PAGE_KEY)
+    with pytest.raises(Exception):
+        crypto.decrypt_dict(_flip(token, where))
+
+@pytest.mark.parametrize('keep', [2, 5, 40, 80])
+def test_truncated_token_is_rejected(kms, keep):
+    crypto = CryptoHelper()
+    b = urlsafe_b64decode(crypto.encrypt_dict(PAGE_KEY))
+    with pytest.raises(Exception):
+        crypto.decrypt_dict(urlsafe_b64encode(b[:keep]).decode('utf-8'))
+
+def test_key_must_be_one_of_ours(kms, monkeypatch):
+    token = _minted_under(OTHER_KEY_ARN, kms, monkeypatch)
+    with pytest.raises(ValueError):
+        CryptoHelper().decrypt_dict(token)
+
+def test_previous_key_still_decodes_while_listed(kms, monkeypatch):
+    token = _minted_under(OTHER_KEY_ARN, kms, monkeypatch)
+    monkeypatch.setenv('PREVIOUS_KMS_KEY_ARNS', OTHER_KEY_ARN)
+    assert CryptoHelper().decrypt_dict(token) == PAGE_KEY
+
+def test_unknown_keys_are_unwrapped_at_a_limited_rate(kms, monkeypatch):
+    monkeypatch.setenv('TOKEN_KEY_UNWRAPS_PER_SECOND', '0')
+    crypto = CryptoHelper()
+    forged = [CryptoHelper().encrypt_dict(PAGE_KEY) for _ in range(20)]
+    results = []
+    for token in forged:
+        try:
+            results.append(crypto.decrypt_dict(token) == PAGE_KEY)
+        except ValueError:
+            results.append(False)
+    assert results == [True] * 16 + [False] * 4
+    assert kms.decrypt_calls == 16
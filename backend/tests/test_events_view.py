@@ -0,0 +1,35 @@
+import pytest
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError
+
+from yellows.views import events
+
+@pytest.mark.parametrize('query', [
+    {'window': 'upcoming', 'from': '2030-01-01T00:00:00'},
+    {'window': 'past', 'to': '2030-01-01T00:00:00'},
+])
+def test_window_conflicts_with_the_end_it_sets(call_view, query):
+    with pytest.raises(BadRequestError):
+        call_view(events.router, '/', query)
+
+@pytest.mark.parametrize('query', [
+    {'window': 'upcoming', 'to': '2099-01-01T00:00:00'},
+    {'window': 'past', 'from': '2000-01-01T00:00:00'},
+])
+def test_window_can_be_bounded_at_the_other_end(table, monkeypatch, call_view, query):
+    monkeypatch.setattr(events, '_upcoming_cache', None)
+    assert call_view(events.router, '/', query)['events'] == []
+
+def test_from_after_to_is_rejected(call_view):
+    with pytest.raises(BadRequestError):
+        call_view(events.router, '/', {'from': '2030-01-02T00:00:00', 'to': '2030-01-01T00:00:00'})
+
+# Windows that leave nothing between now and the other end
+@pytest.mark.parametrize('query', [
+    {'window': 'upcoming', 'to': '2000-01-01T00:00:00'},
+    {'window': 'past', 'from': '2099-01-01T00:00:00'},
+])
+def test_empty_window_is_an_empty_page_without_a_query(monkeypatch, call_view, query):
+    def list_starting_raw(*args, **kwargs):
+        raise AssertionError("an inverted range must not reach DynamoDB")
+    monkeypatch.setattr(events.Event, 'list_starting_raw', list_starting_raw)
+    assert call_view(events.router, '/', query) == {'events': [], 'next_token': None}
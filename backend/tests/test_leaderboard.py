@@ -0,0 +1,64 @@
+import os
+import random
+
+import pytest
+from pynamodb.exceptions import PutError
+
+from yellows import leaderboard
+from yellows.leaderboard import Leaderboard, LeaderboardCache, rebuild_snapshot
+from yellows.models import User
+from yellows.models import leaderboard as models
+from yellows.models.leaderboard import LeaderboardChunk, LeaderboardSnapshot
+
+def test_chunks_fill_the_item_limit_by_raw_size():
+    assert models.ITEM_LIMIT_BYTES - 8 * 1024 < models.CHUNK_BYTES < models.ITEM_LIMIT_BYTES
+
+def test_blob_round_trips_over_several_chunks(table):
+    blob = os.urandom(models.CHUNK_BYTES * 2 + 10)
+    assert LeaderboardChunk.write_blob(1, blob, build_id='b') == 3
+    assert LeaderboardChunk.read_blob(1, 3, build_id='b') == blob
+
+def test_snapshot_of_several_chunks_loads(table):
+    rng = random.Random(1)
+    entries = [(rng.randrange(100000), '{:032x}'.format(rng.getrandbits(128))) for _ in range(20000)]
+    board = Leaderboard(1, entries)
+    blob = board.to_blob()
+    assert len(blob) > models.CHUNK_BYTES
+
+    chunk_count = LeaderboardChunk.write_blob(1, blob, build_id='b')
+    LeaderboardSnapshot.create(1, chunk_count, len(board), build_id='b').save()
+    loaded = LeaderboardCache().current()
+
+    assert chunk_count > 1
+    assert loaded.generation == 1
+    assert loaded.nick_names() == board.nick_names()
+    score, nick = entries[0]
+    assert loaded.rank(nick) == board.rank(nick)
+    assert loaded.score_of(nick) == score
+
+def test_snapshot_from_before_build_ids_loads(table):
+    board = Leaderboard(1, [(5, 'alice'), (3, 'bob')])
+    chunk_count = LeaderboardChunk.write_blob(1, board.to_blob())
+    LeaderboardSnapshot.create(1, chunk_count, len(board)).save()
+    assert LeaderboardCache().current().nick_names() == ['alice', 'bob']
+
+def test_overlapping_rebuilds_leave_the_winner_readable(table, monkeypatch):
+    User.create('alice', 'Alice').save()
+    rebuild_snapshot()
+    build = leaderboard.build_leaderboard
+    overlapped = []
+    def build_leaderboard(generation):
+        # The second rebuild starts and finishes while the first is between reading and writing
+        if not overlapped:
+            overlapped.append(None)
+            overlapped[0] = rebuild_snapshot()
+        return build(generation)
+    monkeypatch.setattr(leaderboard, 'build_leaderboard', build_leaderboard)
+    with pytest.raises(PutError):
+        rebuild_snapshot()
+
+    snapshot = LeaderboardSnapshot.get_current(consistent_read=True)
+    assert snapshot.build_id == overlapped[0].build_id
+    assert LeaderboardCache().current().nick_names() == ['alice']
+    # Only the winning build's rank and names chunks are left
+    assert len([c for c in LeaderboardChunk.scan()]) == snapshot.chunk_count + snapshot.names_chunk_count
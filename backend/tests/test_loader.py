@@ -0,0 +1,53 @@
+import pytest
+
+from yellows.models import EventBooking, LeaderboardChunk, User
+from yellows.models import base, loader
+
+@pytest.fixture
+def users(table, monkeypatch):
+    monkeypatch.setenv('MODEL_CACHE', 'true')
+    monkeypatch.setattr(base, '_model_caches', {})
+    loader.reset_loader()
+    for nick in ('alice', 'bob', 'carol'):
+        User.create(nick, nick.title()).save()
+    # Saving fills the cache, start the tests from an empty one
+    base._model_caches.clear()
+    yield
+    loader.reset_loader()
+
+def _count_batch_gets(monkeypatch) -> list:
+    calls = []
+    connection = base.BaseItem._get_connection()
+    original = connection.batch_get_item
+    def batch_get_item(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(connection, 'batch_get_item', batch_get_item)
+    return calls
+
+def test_outstanding_loads_are_fetched_together(users, monkeypatch):
+    calls = _count_batch_gets(monkeypatch)
+    requests = [User.load(nick) for nick in ('alice', 'bob', 'nobody')]
+    assert [r.get() and r.get().nick_name for r in requests] == ['alice', 'bob', None]
+    assert len(calls) == 1
+    assert [u.full_name for u in User.load_many(['carol', 'alice'])] == ['Carol', 'Alice']
+    # alice is memoized, only carol is fetched
+    assert len(calls) == 2 and len(calls[1][0]) == 1
+
+def test_loads_are_served_from_and_refresh_the_model_cache(users, monkeypatch):
+    User.load('alice').get()
+    loader.reset_loader()
+    calls = _count_batch_gets(monkeypatch)
+    assert User.load('alice').get().full_name == 'Alice'
+    assert calls == []
+
+def test_cached_items_are_left_out_of_the_batch(users, monkeypatch):
+    User.get_by_nick_name('alice')
+    calls = _count_batch_gets(monkeypatch)
+    assert [u.nick_name for u in User.load_many(['alice', 'bob'])] == ['alice', 'bob']
+    assert len(calls) == 1 and len(calls[0][0]) == 1
+
+@pytest.mark.parametrize('model_cls', [EventBooking, LeaderboardChunk])
+def test_child_items_cant_be_loaded_by_one_component(model_cls):
+    with pytest.raises(TypeError):
+        model_cls.load('anything')
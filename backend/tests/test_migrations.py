@@ -0,0 +1,21 @@
+import json
+
+from yellows.bulk import MODELS, RateLimiter
+from yellows.migrations import SortOrderBackfill
+from yellows.models import MigrationCheckpoint, User
+
+def test_every_metrics_flush_carries_the_migration_dimension(table, capsys):
+    for n in range(3):
+        User.create('user{}'.format(n), 'Full Name').save()
+    job = SortOrderBackfill(User, total_segments=1, page_size=1,
+                            read_limiter=RateLimiter(None), write_limiter=RateLimiter(None))
+    job.run(workers=1)
+    flushes = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    flushes = [f for f in flushes if 'BackfillScanned' in f]
+    assert len(flushes) > 1
+    for flush in flushes:
+        assert flush['migration'] == job.job
+        assert all('migration' in dims for m in flush['_aws']['CloudWatchMetrics'] for dims in m['Dimensions'])
+
+def test_checkpoints_are_exported():
+    assert MigrationCheckpoint in MODELS
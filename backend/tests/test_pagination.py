@@ -0,0 +1,33 @@
+import pytest
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError
+
+from yellows.models import User
+from yellows.models.sharding import PaginationKeyError
+from yellows.views import common
+
+# Users are written under the same layout the key is issued with
+def _first_page_key(shards: int, monkeypatch) -> dict:
+    monkeypatch.setenv('TYPE_INDEX_SHARDS', str(shards))
+    for n in range(5):
+        User.create('user{}'.format(n), 'Full Name').save()
+    resp = User.list_ordered_raw(limit=1)
+    assert resp['LastEvaluatedKey'] is not None
+    return resp['LastEvaluatedKey']
+
+@pytest.mark.parametrize('issued_with,used_with', [(2, 3), (3, 2), (2, 1), (1, 2)])
+def test_key_from_another_shard_layout_is_rejected(table, monkeypatch, issued_with, used_with):
+    key = _first_page_key(issued_with, monkeypatch)
+    monkeypatch.setenv('TYPE_INDEX_SHARDS', str(used_with))
+    with pytest.raises(PaginationKeyError):
+        User.list_ordered_raw(limit=1, last_evaluated_key=key)
+
+def test_key_from_another_shard_layout_is_a_bad_request(table, monkeypatch):
+    key = _first_page_key(2, monkeypatch)
+    monkeypatch.setenv('TYPE_INDEX_SHARDS', '3')
+    monkeypatch.setattr(common, '_get_page_args', lambda: (1, key))
+    translation = lambda item: item
+    translation.attr_names = None
+    with pytest.raises(BadRequestError, match='Invalid next_token'):
+        common.wrap_raw_list(User.list_ordered_raw, translation, 'users')
+    with pytest.raises(BadRequestError, match='Invalid next_token'):
+        common.wrap_list_iterable(User.list_ordered, lambda user: {}, 'users')
@@ -0,0 +1,32 @@
+import base64
+import gzip
+import json
+
+import pytest
+
+from yellows.responses import process_response
+
+BODY = json.dumps({'items': ['x' * 40] * 100})
+
+def _event(headers: dict) -> dict:
+    return {'httpMethod': 'GET', 'headers': headers}
+
+def _response() -> dict:
+    return {'statusCode': 200, 'headers': {'Content-Type': 'application/json'}, 'body': BODY, 'isBase64Encoded': False}
+
+@pytest.mark.parametrize('accept', ['application/json', 'application/json, text/plain, */*', 'Application/JSON; q=1'])
+def test_compresses_when_api_gateway_will_decode(accept):
+    response = process_response(_event({'Accept': accept, 'Accept-Encoding': 'gzip'}), _response())
+    assert response['isBase64Encoded']
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(base64.b64decode(response['body'])).decode('utf-8') == BODY
+
+@pytest.mark.parametrize('accept', [None, '*/*', 'text/html, application/json'])
+def test_left_uncompressed_unless_json_is_the_first_accept_type(accept):
+    headers = {'Accept-Encoding': 'gzip'}
+    if accept is not None:
+        headers['Accept'] = accept
+    response = process_response(_event(headers), _response())
+    assert not response['isBase64Encoded']
+    assert 'Content-Encoding' not in response['headers']
+    assert response['body'] == BODY
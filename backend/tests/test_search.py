@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from yellows import leaderboard, search
+from yellows.leaderboard import Leaderboard, get_leaderboard_cache, rebuild_snapshot
+from yellows.models import User
+from yellows.models.leaderboard import LeaderboardChunk, LeaderboardSnapshot
+
+@pytest.fixture
+def users(table, monkeypatch):
+    monkeypatch.setenv('LEADERBOARD_REFRESH_SECONDS', '0')
+    monkeypatch.setattr(leaderboard, '_leaderboard_cache', None)
+    monkeypatch.setattr(search, '_search_index_cache', None)
+    for nick, full_name in (('alice', 'Alice Liddell'), ('bob', 'Robert Paulson'), ('carol', 'Carol Danvers')):
+        User.create(nick, full_name).save()
+    rebuild_snapshot()
+
+def _nicks(results):
+    return [r['nick_name'] for r in results]
+
+def test_full_names_are_kept_out_of_the_rank_blob(users):
+    snapshot = LeaderboardSnapshot.get_current()
+    blob = LeaderboardChunk.read_blob(snapshot.generation, snapshot.chunk_count, build_id=snapshot.build_id)
+    assert Leaderboard.from_blob(snapshot.generation, blob).full_names == {}
+    assert _nicks(search.get_search_index().search('paulson', 10)) == ['bob']
+
+def test_users_added_to_the_board_are_searchable_by_nick(users):
+    index = search.get_search_index()
+    get_leaderboard_cache().patch_score('dave', 5)
+    assert _nicks(index.search('dav', 10)) == ['dave']
+    assert _nicks(index.search('dave', 10)) == ['dave']
+    assert _nicks(index.search('ave', 10)) == ['dave']
+
+def test_new_snapshot_is_indexed_in_the_background(users):
+    old = search.get_search_index()
+    User.create('erin', 'Erin Brockovich').save()
+    rebuild_snapshot()
+    # Served straight away from the previous index while the new one builds
+    assert search.get_search_index() is old
+    deadline = time.monotonic() + 10
+    while search.get_search_index() is old and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _nicks(search.get_search_index().search('brockovich', 10)) == ['erin']
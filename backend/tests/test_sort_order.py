@@ -0,0 +1,124 @@
+import random
+
+import pytest
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError
+
+from yellows.models import User
+from yellows.views import users as users_views
+
+MAX_SCORE = User._SORT_ORDER_MAX_SCORE
+# The largest and smallest tie-breakers valid UTF-8 can produce
+LOWEST_NICK = ''
+HIGHEST_NICK = '\U0010ffff' * 3
+
+EDGE_SCORES = [-MAX_SCORE, -MAX_SCORE + 1, -1, 0, 1, MAX_SCORE - 1, MAX_SCORE]
+EDGE_NICKS = [LOWEST_NICK, '\0', 'a', 'a' * 11, 'a' * 11 + 'b', 'b', 'zz', 'é', '\U0001f600', HIGHEST_NICK]
+
+def _random_cases(n: int, seed: int):
+    rng = random.Random(seed)
+    alphabet = 'abcxyz09_-éß\U0001f600'
+    for _ in range(n):
+        score = rng.choice([rng.randint(-MAX_SCORE, MAX_SCORE), rng.randint(-3, 3)])
+        nick = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 16)))
+        yield score, nick
+
+EDGE_CASES = [(score, nick) for score in EDGE_SCORES for nick in EDGE_NICKS]
+CASES = EDGE_CASES + list(_random_cases(500, 1))
+
+def _expected_key(score: int, nick: str):
+    # Scores first, then the nick's leading bytes (which is all the encoding can tell apart)
+    return score, nick.encode('utf-8')[:User._SORT_ORDER_NICK_SLICE].rstrip(b'\0')
+
+@pytest.mark.parametrize('score,nick', EDGE_CASES)
+def test_fits_in_38_digits(score, nick):
+    assert abs(User._calculate_sort_order(score, nick)) < 10 ** 38
+
+def test_order_matches_score_then_nick():
+    ordered = sorted(CASES, key=lambda case: _expected_key(*case))
+    for lower, higher in zip(ordered, ordered[1:]):
+        lower_order = User._calculate_sort_order(*lower)
+        higher_order = User._calculate_sort_order(*higher)
+        if _expected_key(*lower) == _expected_key(*higher):
+            assert lower_order == higher_order, (lower, higher)
+        else:
+            assert lower_order < higher_order, (lower, higher)
+
+@pytest.mark.parametrize('score', [MAX_SCORE + 1, -MAX_SCORE - 1, 10 ** 20])
+def test_out_of_range_score_is_rejected(score):
+    with pytest.raises(ValueError):
+        User._calculate_sort_order(score, 'nick')
+
+def test_score_step_moves_by_whole_points():
+    for score, nick in CASES:
+        if score < MAX_SCORE:
+            step = User._calculate_sort_order(score + 1, nick) - User._calculate_sort_order(score, nick)
+            assert step == User._SORT_ORDER_SCORE_STEP
+
+def _condition_allows(condition, value: int) -> bool:
+    bounds = [int(v.value['N']) for v in condition.values[1:]]
+    if condition.operator == 'BETWEEN':
+        return bounds[0] <= value <= bounds[1]
+    if condition.operator == '>=':
+        return value >= bounds[0]
+    if condition.operator == '<=':
+        return value <= bounds[0]
+    raise AssertionError(condition.operator)
+
+RANGES = [(0, 0), (-5, 5), (1, 2), (-MAX_SCORE, MAX_SCORE), (None, 0), (0, None), (-3, None), (None, MAX_SCORE), (-MAX_SCORE, None)]
+
+def _order(score: int, nick: str) -> int:
+    # Also for scores just past the encodable range, which only the bounds need to exclude
+    return score * User._SORT_ORDER_SCORE_STEP + User._calculate_sort_order(0, nick)
+
+@pytest.mark.parametrize('min_score,max_score', RANGES)
+def test_range_condition_edges(min_score, max_score):
+    condition = User.score_range_condition(min_score, max_score)
+    for nick in (LOWEST_NICK, HIGHEST_NICK):
+        if min_score is not None:
+            assert _condition_allows(condition, _order(min_score, nick))
+            assert not _condition_allows(condition, _order(min_score - 1, nick))
+        if max_score is not None:
+            assert _condition_allows(condition, _order(max_score, nick))
+            assert not _condition_allows(condition, _order(max_score + 1, nick))
+
+def test_unbounded_range_has_no_condition():
+    assert User.score_range_condition(None, None) is None
+
+def test_inverted_range_is_rejected():
+    with pytest.raises(ValueError):
+        User.score_range_condition(2, 1)
+
+@pytest.mark.parametrize('min_score,max_score', [(-1, 1), (0, None), (None, 0)])
+def test_leaderboard_query_honours_range(table, min_score, max_score):
+    users = []
+    for score in (-2, -1, 0, 1, 2):
+        for nick in ('a', HIGHEST_NICK):
+            user = User.create('{}{}'.format(nick, score), 'Full Name')
+            user.achievement_score = score
+            user.save()
+            users.append(user)
+    resp = User.list_leaderboard_raw(min_score=min_score, max_score=max_score)
+    returned = [item[User._nick_name.attr_name]['S'] for item in resp['Items']]
+    expected = sorted(users, key=lambda u: u.index_sort_order, reverse=True)
+    expected = [u.nick_name for u in expected
+                if (min_score is None or u.achievement_score >= min_score) and (max_score is None or u.achievement_score <= max_score)]
+    assert returned == expected
+
+@pytest.mark.parametrize('min_score,max_score', [(None, MAX_SCORE + 1), (-MAX_SCORE - 1, None), (10 ** 40, None), (0, 10 ** 40)])
+def test_range_beyond_the_encodable_scores_is_rejected(min_score, max_score):
+    with pytest.raises(ValueError):
+        User.score_range_condition(min_score, max_score)
+
+@pytest.mark.parametrize('query', [
+    {'max_score': str(MAX_SCORE + 1)},
+    {'min_score': str(-MAX_SCORE - 1)},
+    {'min_score': '0', 'max_score': '1' + '0' * 40},
+])
+def test_leaderboard_list_rejects_scores_out_of_range(call_view, query):
+    with pytest.raises(BadRequestError):
+        call_view(users_views.router, '/', query)
+
+def test_leaderboard_list_accepts_the_full_range(table, call_view):
+    User.create('alice', 'Alice').save()
+    page = call_view(users_views.router, '/', {'min_score': str(-MAX_SCORE), 'max_score': str(MAX_SCORE)})
+    assert [u['nick_name'] for u in page['users']] == ['alice']
@@ -0,0 +1,57 @@
+import pytest
+from pynamodb.exceptions import TransactWriteError, UpdateError
+
+from yellows.models import User
+from yellows.models.base import CounterTransactWrite
+
+MAX_SCORE = User._SORT_ORDER_MAX_SCORE
+
+@pytest.fixture
+def user(table):
+    user = User.create('alice', 'Alice Liddell')
+    user.save()
+    return user
+
+def _stored(nick_name: str) -> User:
+    return User.get_by_nick_name(nick_name, consistent_read=True)
+
+def test_score_and_sort_order_move_together(user):
+    assert User.add_achievement_score('alice', 5) == 5
+    assert User.add_achievement_score('alice', -7) == -2
+    stored = _stored('alice')
+    assert stored.index_sort_order == User._calculate_sort_order(-2, 'alice')
+
+@pytest.mark.parametrize('start,delta', [(MAX_SCORE - 1, 1), (-MAX_SCORE + 1, -1), (0, MAX_SCORE), (0, -MAX_SCORE)])
+def test_score_can_reach_the_ends_of_the_range(user, start, delta):
+    user.achievement_score = start
+    user.save()
+    assert User.add_achievement_score('alice', delta) == start + delta
+    assert _stored('alice').index_sort_order == User._calculate_sort_order(start + delta, 'alice')
+
+@pytest.mark.parametrize('start,delta', [(MAX_SCORE, 1), (MAX_SCORE - 1, 2), (-MAX_SCORE, -1), (1, -2 * MAX_SCORE)])
+def test_score_never_leaves_the_orderable_range(user, start, delta):
+    user.achievement_score = start
+    user.save()
+    with pytest.raises(UpdateError):
+        User.add_achievement_score('alice', delta)
+    assert _stored('alice').achievement_score == start
+
+def test_change_larger_than_the_range_is_rejected(user):
+    with pytest.raises(ValueError):
+        User.add_achievement_score('alice', 2 * MAX_SCORE + 1)
+
+def test_missing_user_isnt_created(table):
+    with pytest.raises(UpdateError):
+        User.add_achievement_score('nobody', 1)
+
+def test_transaction_builds_the_same_counter_update(user):
+    actions = [User._achievement_score.add(1)]
+    condition = User._achievement_score <= 0
+    with CounterTransactWrite() as transaction:
+        transaction.update_counters(User, user.pk, actions, condition=condition)
+    assert transaction._update_items == [User._counter_update_kwargs(user.pk, actions, condition=condition)]
+    with pytest.raises(TransactWriteError):
+        with CounterTransactWrite() as transaction:
+            transaction.update_counters(User, user.pk, actions, condition=condition)
+    stored = _stored('alice')
+    assert (stored.achievement_score, stored.version) == (1, user.version + 1)
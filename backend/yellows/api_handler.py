@@ -1,36 +1,129 @@
-from datetime import datetime
+from contextlib import nullcontext
+from importlib import import_module
+import json
+import random
+from typing import Optional
 from aws_lambda_powertools.event_handler import APIGatewayRestResolver
 from aws_lambda_powertools.logging import Logger, correlation_paths
 from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.shared.json_encoder import Encoder
 from aws_lambda_powertools.utilities.typing import LambdaContext
 
+from yellows.config import get_config
+from yellows.dynamo_stats import get_dynamo_stats
+from yellows.retry_stats import get_retry_stats
+from yellows.models.loader import reset_loader
 from yellows.powertools import tracer, metrics
-
-from . import views
+from yellows.responses import get_header, process_response
+from yellows.timing import get_request_timer, profiled
+from yellows.warmup import warm_up
 
 logger = Logger()
 
-app = APIGatewayRestResolver()
+def _serialize(obj) -> str:
+    # Same as the resolver's default serializer, but timed
+    with get_request_timer().phase('serialize'):
+        return json.dumps(obj, separators=(',', ':'), cls=Encoder)
+
+app = APIGatewayRestResolver(serializer=_serialize)
+
+DYNAMO_DEBUG_HEADER = 'X-Yellows-Dynamo'
+PROFILE_HEADER = 'x-yellows-profile'
+REDACTED_HEADERS = frozenset(('cookie', 'authorization', 'x-api-key'))
+
+ROUTERS = {
+    '/api/events': 'yellows.views.events',
+    '/api/users': 'yellows.views.users',
+    '/api/auth': 'yellows.views.auth',
+}
+_included_prefixes = set()
+
+def _include_router(prefix: str):
+    module = import_module(ROUTERS[prefix])
+    app.include_router(module.router, prefix)
+    _included_prefixes.add(prefix)
+
+def _include_router_for_path(path: str):
+    for prefix in ROUTERS:
+        if prefix in _included_prefixes:
+            continue
+        if path == prefix or path.startswith(prefix + '/'):
+            _include_router(prefix)
+
+def _redacted_event(event: dict) -> dict:
+    return {
+        'httpMethod': event.get('httpMethod'),
+        'path': event.get('path'),
+        'queryStringParameters': event.get('queryStringParameters'),
+        'headers': {name: '[redacted]' if name.lower() in REDACTED_HEADERS else value
+                    for name, value in (event.get('headers') or {}).items()},
+        'requestId': (event.get('requestContext') or {}).get('requestId'),
+        'bodyLength': len(event.get('body') or ''),
+    }
+
+def _should_profile(event: dict) -> bool:
+    one_in = config.profile_one_in
+    if one_in > 0 and random.randrange(one_in) == 0:
+        return True
+    scope = config.profile_header_scope
+    if scope is None or get_header(event, PROFILE_HEADER) is None:
+        return False
+    from yellows.auth import get_auth
+    return get_auth().cookie_has_scope(get_header(event, 'cookie') or '', scope)
 
-app.include_router(views.events.router, '/api/events')
-app.include_router(views.users.router, '/api/users')
-app.include_router(views.auth.router, '/api/auth')
+config = get_config()
+if not config.lazy_routes:
+    for prefix in ROUTERS:
+        _include_router(prefix)
+# Runs during the Lambda init phase, before the first invocation is billed
+if config.warm_up_on_init:
+    warm_up()
 
 @logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 @metrics.log_metrics(capture_cold_start_metric=True)
 @tracer.capture_lambda_handler
 def lambda_handler(event: dict, context: LambdaContext) -> dict:
-    t_start = datetime.now()
-    logger.info("Event: %s", event)
+    timer = get_request_timer()
+    timer.reset()
+    if random.random() < config.event_log_sample_rate:
+        logger.info("Event", extra={'event': _redacted_event(event)})
     fault = 0
+    # Lookups batched or memoized by the loader must never leak into the next request
+    reset_loader()
+    dynamo_stats = get_dynamo_stats()
+    dynamo_stats.reset()
+    retry_stats = get_retry_stats()
+    retry_stats.reset()
+    profile: Optional[dict] = None
     try:
-        ret = app.resolve(event, context)
+        profile = {} if _should_profile(event) else None
+        _include_router_for_path(event.get('path', ''))
+        with profiled(profile) if profile is not None else nullcontext():
+            with timer.phase('resolve'):
+                resolved = app.resolve(event, context)
+        with timer.phase('response'):
+            ret = process_response(event, resolved)
+        if config.dynamo_debug_header:
+            ret.setdefault('headers', {})[DYNAMO_DEBUG_HEADER] = dynamo_stats.header_value()
         return ret
     except Exception as e:
         logger.exception("Exception thrown while processing event")
         fault = 1
         raise e
     finally:
-        duration = datetime.now() - t_start
-        metrics.add_metric('Time', MetricUnit.Milliseconds, duration.total_seconds() * 1000.0)
+        total_ms = timer.total_ms()
+        metrics.add_metric('Time', MetricUnit.Milliseconds, total_ms)
         metrics.add_metric('Fault', MetricUnit.Count, fault)
+        dynamo_stats.add_metrics(metrics)
+        retry_stats.add_metrics(metrics)
+        timer.add_metrics(metrics)
+        logger.info("Request timing", extra={
+            'total_ms': total_ms,
+            'phases_ms': timer.phases,
+            'dynamodb_ms': dynamo_stats.time_ms,
+            'dynamodb_calls': dynamo_stats.calls,
+            'aws_retries': retry_stats.retries,
+            'aws_throttles': retry_stats.throttles,
+        })
+        if profile:
+            logger.info("Request profile", extra=profile)
@@ -1,9 +1,12 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from functools import wraps
+import hashlib
 import inspect
-from authlib.integrations.requests_client import OAuth2Session
-from authlib.jose import JsonWebToken
-from authlib.jose.errors import BadSignatureError
+import time
+from typing import List, Optional, Union
+from authlib.jose import JWTClaims
+from authlib.jose.errors import JoseError
 from aws_lambda_powertools.event_handler.api_gateway import Router
 from aws_lambda_powertools.event_handler.exceptions import UnauthorizedError
 from aws_lambda_powertools.logging import Logger
@@ -12,26 +15,72 @@ from http.cookies import SimpleCookie
 
 from aws_lambda_powertools.metrics import MetricUnit
 
+from yellows.cache import TTLCache
 from yellows.config import get_config
-from yellows.models import Login
+from yellows.jwt_keys import JwtKeySet
+from yellows.models import Login, Revocation
 from yellows.powertools import metrics, tracer
+from yellows.timing import get_request_timer
 
 router = Router()
 logger = Logger()
-jwt = JsonWebToken(['RS256'])
 DISCORD_AUTH_URL = 'https://discord.com/oauth2/authorize'
 DISCORD_TOKEN_URL = 'https://discord.com/api/oauth2/token'
 DISCORD_GET_SELF_INFO_URL = 'https://discord.com/api/users/@me'
 
-def _record_login(login: Login):
+@dataclass
+class Principal:
+    login_id: str
+    scope: List[str]
+
+def _record_login(login: Union[Login, Principal]):
     metrics.add_metadata("user", login.login_id)
     tracer.put_annotation('user', login.login_id)
 
+class RevocationCache:
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._revocation: Optional[Revocation] = None
+        self._loaded_at = 0.0
+
+    def warm_up(self):
+        self._current()
+
+    def _current(self) -> Revocation:
+        now = time.monotonic()
+        if self._revocation is None or now - self._loaded_at >= self.refresh_seconds:
+            self._revocation = Revocation.get_current()
+            self._loaded_at = now
+        return self._revocation
+
+    def is_revoked(self, login_id: str, global_generation: int, login_generation: int) -> bool:
+        revocation = self._current()
+        if global_generation < revocation.global_generation:
+            return True
+        return login_generation < revocation.login_generation(login_id)
+
 class Auth:
     def __init__(self):
         self.config = get_config()
+        self.revocations = RevocationCache(self.config.revocation_refresh_seconds)
+        self._keys: Optional[JwtKeySet] = None
+        self._keys_secret: Optional[dict] = None
+        # Claims of tokens whose signature has already been checked, by token hash. Expiry,
+        # scopes and revocation are still checked on every request.
+        self._verified = TTLCache(self.config.jwt_verify_cache_seconds, self.config.jwt_verify_cache_max_items)
+
+    def keys(self) -> JwtKeySet:
+        secret = self.config.jwt_secret
+        if self._keys is None or self._keys_secret is not secret:
+            self._keys = JwtKeySet(secret)
+            self._keys_secret = secret
+            # A rotation may have retired keys that cached tokens were signed with
+            self._verified.clear()
+        return self._keys
 
     def _get_client(self):
+        # Only the login routes talk to Discord, so keep requests out of everyone else's cold start
+        from authlib.integrations.requests_client import OAuth2Session
         redirect_uri = urlunparse((
             'https', self.config.domain_name, '/api/auth/login-finish',
             None, None, None))
@@ -75,16 +124,37 @@ class Auth:
     def _make_jwt_for_login(self, login: Login):
         now = datetime.utcnow()
         exp = now + timedelta(seconds=86400)
+        revocation = Revocation.get_current(consistent_read=True)
         claims = {
             'iss': self.config.domain_name,
             'sub': login.login_id,
             'exp': exp.isoformat(),
             'scope': login.scope,
+            'gen': revocation.global_generation,
+            'login_gen': revocation.login_generation(login.login_id),
         }
-        return jwt.encode({'alg': 'RS256'}, claims, self.config.jwt_private_key).decode('utf-8')
+        return self.keys().encode(claims)
+
+    def _verify_jwt(self, token: str) -> JWTClaims:
+        keys = self.keys()
+        token_hash = hashlib.sha256(token.encode('utf-8')).digest()
+        claims = self._verified.get(token_hash)
+        metrics.add_metric('JwtVerifyCacheHit', MetricUnit.Count, 0 if claims is None else 1)
+        if claims is None:
+            claims = keys.decode(token, claims_options={
+                'iss': {
+                    'essential': True,
+                    'values': [self.config.domain_name],
+                },
+                'sub': { 'essential': True },
+                'exp': { 'essential': True },
+                'scope': { 'essential': True },
+            })
+            self._verified.put(token_hash, claims)
+        return claims
 
     @tracer.capture_method(capture_response=False)
-    def check_auth(self, required_scopes) -> Login:
+    def check_auth(self, required_scopes) -> Union[Login, Principal]:
         denied = 0
         try:
             return self._check_auth(required_scopes)
@@ -95,36 +165,50 @@ class Auth:
             metrics.add_metric('Unauthorized', MetricUnit.Count, denied)
 
 
-    def _check_auth(self, required_scopes) -> Login:
-        cookies = SimpleCookie(router.current_event.headers.get('Cookie', ''))
+    def _claims_from_cookie(self, cookie_header: str) -> JWTClaims:
+        cookies = SimpleCookie(cookie_header)
         auth_cookie = cookies.get('yellows-auth')
         if auth_cookie is None:
             raise UnauthorizedError("Missing auth cookie")
         try:
-            claims = jwt.decode(auth_cookie.value, self.config.jwt_public_key, claims_options={
-                'iss': {
-                    'essential': True,
-                    'values': [self.config.domain_name],
-                },
-                'sub': { 'essential': True },
-                'exp': { 'essential': True },
-                'scope': { 'essential': True },
-            })
-        except BadSignatureError:
+            claims = self._verify_jwt(auth_cookie.value)
+        except JoseError:
             logger.exception("Failed to validate JWT")
             raise UnauthorizedError("Invalid JWT")
         # Check Expiry
         expiry = datetime.fromisoformat(claims['exp'])
         if expiry < datetime.now():
             raise UnauthorizedError("Session expired")
-        # Check that user has valid scopes
-        scopes = set(claims['scope'])
-        has_all_scopes = all(s in scopes for s in required_scopes)
-        if not has_all_scopes:
-            logger.warn("User missing scopes")
-            raise UnauthorizedError("Insufficient access")
-        # TODO: Do we need this, can we just read out the JWT?
-        login = Login.get_by_login_id(claims['sub'])
+        return claims
+
+    def _is_revoked(self, claims: JWTClaims) -> bool:
+        # Tokens issued before generations existed count as generation 0
+        return self.revocations.is_revoked(claims['sub'], claims.get('gen', 0), claims.get('login_gen', 0))
+
+    # For checks made outside a view, before any route has run
+    def cookie_has_scope(self, cookie_header: str, scope: str) -> bool:
+        try:
+            claims = self._claims_from_cookie(cookie_header)
+        except UnauthorizedError:
+            return False
+        return scope in claims['scope'] and not self._is_revoked(claims)
+
+    def _check_auth(self, required_scopes) -> Union[Login, Principal]:
+        timer = get_request_timer()
+        with timer.phase('auth'):
+            claims = self._claims_from_cookie(router.current_event.headers.get('Cookie', ''))
+            # Check that user has valid scopes
+            scopes = set(claims['scope'])
+            has_all_scopes = all(s in scopes for s in required_scopes)
+            if not has_all_scopes:
+                logger.warn("User missing scopes")
+                raise UnauthorizedError("Insufficient access")
+            if self._is_revoked(claims):
+                raise UnauthorizedError("Session revoked")
+        if self.config.stateless_auth:
+            return Principal(login_id=claims['sub'], scope=list(claims['scope']))
+        with timer.phase('login_lookup'):
+            login = Login.get_by_login_id(claims['sub'])
         if login is None:
             raise UnauthorizedError("Insufficient access")
         return login
@@ -0,0 +1,286 @@
+import argparse
+from base64 import b64decode, b64encode
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import glob
+import gzip
+import json
+import os
+import random
+import threading
+import time
+from typing import IO, Any, Iterator, List, Optional, Sequence, Type
+from aws_lambda_powertools.logging import Logger
+from pynamodb.connection import TableConnection
+from pynamodb.exceptions import PutError
+
+from yellows.dynamo_stats import consumed_units
+from yellows.models import Event, EventBooking, LeaderboardChunk, LeaderboardSnapshot, Login, MigrationCheckpoint, Revocation, User
+from yellows.models.base import BaseItem
+
+logger = Logger()
+
+# Bulk export and import of the data table, for backups, seeding and migrations:
+#   python -m yellows.bulk export OUT_DIR [--segments N] [--workers N] [--type EVENT ...] [--gzip]
+#   python -m yellows.bulk import IN_DIR [--workers N] [--type EVENT ...] [--max-wcu N]
+# Exports are one file per scan segment (rotated every --chunk-items), each line
+# {"Item": {...}} in DynamoDB JSON with binary values base64 encoded, as DynamoDB's own S3
+# export does, plus a manifest.json with the counts.
+
+BATCH_WRITE_LIMIT = 25
+MAX_ATTEMPTS = 10
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 5.0
+DISCRIMINATOR_ATTR_NAME = BaseItem.pynamo_discriminator.attr_name
+
+MODELS = (Event, EventBooking, LeaderboardChunk, LeaderboardSnapshot, Login, MigrationCheckpoint, Revocation, User)
+
+def _model_for(type_name: str) -> Type[BaseItem]:
+    # Either the stored discriminator ('EVENT') or the model's name ('Event')
+    for model_cls in MODELS:
+        if type_name in (BaseItem.pynamo_discriminator.get_discriminator(model_cls), model_cls.__name__):
+            return model_cls
+    raise ValueError("Unknown item type {}".format(type_name))
+
+def _connection(table_name: Optional[str]) -> TableConnection:
+    if table_name is None:
+        return BaseItem._get_connection()
+    return TableConnection(table_name)
+
+# Throughput limiter shared by every thread in the process. Capacity is only known once a
+# request has been made, so it's paid for afterwards and the next caller waits off the debt.
+class RateLimiter:
+    def __init__(self, units_per_second: Optional[float]):
+        self.units_per_second = units_per_second
+        self._available = units_per_second or 0.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, units: float):
+        if not self.units_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.units_per_second, self._available + (now - self._updated_at) * self.units_per_second)
+            self._updated_at = now
+            self._available -= units
+            wait = -self._available / self.units_per_second if self._available < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+def _map_binary(value: dict, f) -> dict:
+    (type_, inner), = value.items()
+    if type_ == 'B':
+        return {'B': f(inner)}
+    if type_ == 'BS':
+        return {'BS': [f(b) for b in inner]}
+    if type_ == 'M':
+        return {'M': {k: _map_binary(v, f) for k, v in inner.items()}}
+    if type_ == 'L':
+        return {'L': [_map_binary(v, f) for v in inner]}
+    return value
+
+def encode_item(item: dict) -> str:
+    return json.dumps({'Item': {k: _map_binary(v, lambda b: b64encode(b).decode('ascii')) for k, v in item.items()}},
+                      separators=(',', ':'))
+
+def decode_item(line: str) -> dict:
+    return {k: _map_binary(v, b64decode) for k, v in json.loads(line)['Item'].items()}
+
+class _ChunkWriter:
+    def __init__(self, out_dir: str, segment: int, chunk_items: int, compress: bool):
+        self._out_dir = out_dir
+        self._segment = segment
+        self._chunk_items = chunk_items
+        self._compress = compress
+        self._file: Optional[IO[str]] = None
+        self._chunk = 0
+        self._in_chunk = 0
+        self.files: List[str] = []
+
+    def write(self, item: dict):
+        if self._file is None or self._in_chunk >= self._chunk_items:
+            self.close()
+            name = 'segment-{:04d}-{:05d}.json'.format(self._segment, self._chunk)
+            if self._compress:
+                name += '.gz'
+            path = os.path.join(self._out_dir, name)
+            self._file = gzip.open(path, 'wt', encoding='utf-8') if self._compress else open(path, 'w', encoding='utf-8')
+            self.files.append(name)
+            self._chunk += 1
+            self._in_chunk = 0
+        self._file.write(encode_item(item))
+        self._file.write('\n')
+        self._in_chunk += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+_read_limiter: Optional[RateLimiter] = None
+_write_limiter: Optional[RateLimiter] = None
+
+def _init_limiters(max_rcu: Optional[float], max_wcu: Optional[float]):
+    global _read_limiter, _write_limiter
+    _read_limiter = RateLimiter(max_rcu)
+    _write_limiter = RateLimiter(max_wcu)
+
+def export_segment(table_name: Optional[str], out_dir: str, segment: int, total_segments: int,
+                   types: Sequence[str], chunk_items: int, compress: bool, page_size: Optional[int]) -> dict:
+    connection = _connection(table_name)
+    writer = _ChunkWriter(out_dir, segment, chunk_items, compress)
+    filter_condition = None
+    if types:
+        # Filtered server side, but a Scan still reads (and is billed for) every item
+        filter_condition = BaseItem.pynamo_discriminator.is_in(*[_model_for(t) for t in types])
+    counts = {'segment': segment, 'scanned': 0, 'exported': 0}
+    last_evaluated_key = None
+    try:
+        while True:
+            resp = connection.scan(
+                filter_condition=filter_condition,
+                segment=segment, total_segments=total_segments,
+                exclusive_start_key=last_evaluated_key,
+                limit=page_size,
+                return_consumed_capacity='TOTAL',
+            )
+            if _read_limiter is not None:
+                _read_limiter.consume(consumed_units(resp))
+            counts['scanned'] += resp.get('ScannedCount', 0)
+            for item in resp.get('Items', []):
+                writer.write(item)
+                counts['exported'] += 1
+            last_evaluated_key = resp.get('LastEvaluatedKey')
+            if last_evaluated_key is None:
+                break
+    finally:
+        writer.close()
+    counts['files'] = writer.files
+    logger.info("Exported segment %d: %s", segment, {k: v for k, v in counts.items() if k != 'files'})
+    return counts
+
+def _read_items(path: str) -> Iterator[dict]:
+    opener: Any = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield decode_item(line)
+
+def _write_batch(connection: TableConnection, items: List[dict]):
+    table_name = connection.table_name
+    attempt = 0
+    while items:
+        resp = connection.batch_write_item(put_items=items, return_consumed_capacity='TOTAL')
+        if _write_limiter is not None:
+            _write_limiter.consume(consumed_units(resp))
+        unprocessed = resp.get('UnprocessedItems', {}).get(table_name, [])
+        items = [request['PutRequest']['Item'] for request in unprocessed]
+        if items:
+            attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                raise PutError("{} items still unprocessed after {} attempts".format(len(items), attempt))
+            # Full jitter, every worker is probably being throttled at the same time
+            time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))))
+
+def import_file(table_name: Optional[str], path: str, types: Sequence[str]) -> dict:
+    connection = _connection(table_name)
+    discriminators = [BaseItem.pynamo_discriminator.get_discriminator(_model_for(t)) for t in types]
+    counts = {'file': os.path.basename(path), 'read': 0, 'imported': 0}
+    batch: List[dict] = []
+    for item in _read_items(path):
+        counts['read'] += 1
+        if discriminators and item.get(DISCRIMINATOR_ATTR_NAME, {}).get('S') not in discriminators:
+            continue
+        batch.append(item)
+        if len(batch) == BATCH_WRITE_LIMIT:
+            _write_batch(connection, batch)
+            counts['imported'] += len(batch)
+            batch = []
+    if batch:
+        _write_batch(connection, batch)
+        counts['imported'] += len(batch)
+    logger.info("Imported %s", counts)
+    return counts
+
+def _make_executor(kind: str, workers: int, max_rcu: Optional[float], max_wcu: Optional[float]) -> Executor:
+    if kind == 'process':
+        # Each process limits itself to its share of the overall rate
+        share = lambda rate: None if rate is None else rate / workers
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_limiters,
+                                   initargs=(share(max_rcu), share(max_wcu)))
+    _init_limiters(max_rcu, max_wcu)
+    return ThreadPoolExecutor(max_workers=workers)
+
+def export_table(out_dir: str, table_name: Optional[str]=None, segments: int=8, workers: int=8, executor: str='thread',
+                 types: Sequence[str]=(), chunk_items: int=100000, compress: bool=False,
+                 page_size: Optional[int]=None, max_rcu: Optional[float]=None) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    discriminators = [BaseItem.pynamo_discriminator.get_discriminator(_model_for(t)) for t in types]
+    t_start = time.monotonic()
+    with _make_executor(executor, workers, max_rcu, None) as pool:
+        futures = [
+            pool.submit(export_segment, table_name, out_dir, segment, segments, types, chunk_items, compress, page_size)
+            for segment in range(segments)
+        ]
+        results = [f.result() for f in futures]
+    manifest = {
+        'table': table_name or BaseItem.Meta.table_name,
+        'segments': segments,
+        'types': discriminators,
+        'scanned': sum(r['scanned'] for r in results),
+        'exported': sum(r['exported'] for r in results),
+        'files': [name for r in results for name in r['files']],
+        'seconds': round(time.monotonic() - t_start, 3),
+    }
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def import_table(in_dir: str, table_name: Optional[str]=None, workers: int=8, executor: str='thread',
+                 types: Sequence[str]=(), max_wcu: Optional[float]=None) -> dict:
+    paths = sorted(glob.glob(os.path.join(in_dir, 'segment-*.json')) + glob.glob(os.path.join(in_dir, 'segment-*.json.gz')))
+    t_start = time.monotonic()
+    with _make_executor(executor, workers, None, max_wcu) as pool:
+        results = list(pool.map(import_file, [table_name] * len(paths), paths, [types] * len(paths)))
+    return {
+        'files': len(paths),
+        'read': sum(r['read'] for r in results),
+        'imported': sum(r['imported'] for r in results),
+        'seconds': round(time.monotonic() - t_start, 3),
+    }
+
+def main(argv: Optional[List[str]]=None):
+    parser = argparse.ArgumentParser(prog='python -m yellows.bulk')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('export', 'import'):
+        sub = subparsers.add_parser(name)
+        sub.add_argument('directory')
+        sub.add_argument('--table', help="defaults to DDB_TABLE_NAME")
+        sub.add_argument('--type', dest='types', action='append', default=[],
+                         help="only items of this type (discriminator or model name), repeatable")
+        sub.add_argument('--workers', type=int, default=8)
+        sub.add_argument('--executor', choices=('thread', 'process'), default='thread')
+    export_parser = subparsers.choices['export']
+    export_parser.add_argument('--segments', type=int, default=8)
+    export_parser.add_argument('--chunk-items', type=int, default=100000)
+    export_parser.add_argument('--gzip', action='store_true')
+    export_parser.add_argument('--page-size', type=int)
+    export_parser.add_argument('--max-rcu', type=float, help="consumed read capacity per second, across all workers")
+    import_parser = subparsers.choices['import']
+    import_parser.add_argument('--max-wcu', type=float, help="consumed write capacity per second, across all workers")
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        result = export_table(
+            args.directory, table_name=args.table, segments=args.segments, workers=args.workers,
+            executor=args.executor, types=args.types, chunk_items=args.chunk_items, compress=args.gzip,
+            page_size=args.page_size, max_rcu=args.max_rcu)
+        result = {k: v for k, v in result.items() if k != 'files'}
+    else:
+        result = import_table(
+            args.directory, table_name=args.table, workers=args.workers, executor=args.executor,
+            types=args.types, max_wcu=args.max_wcu)
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
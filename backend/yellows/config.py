@@ -1,23 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
 from functools import cached_property
 import os
+import threading
+import time
+from typing import Dict, List, Optional
 import boto3
+from botocore.config import Config as BotocoreConfig
+import botocore.session
 import json
 import pynamodb.settings
 from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import MetricUnit
 from mypy_boto3_secretsmanager.client import SecretsManagerClient
 from mypy_boto3_dynamodb.client import DynamoDBClient
 
+from yellows import dynamo_stats, retry_stats
+from yellows.powertools import metrics
+
 logger = Logger()
 
+SECRET_ENVVARS = ('DISCORD_OAUTH2_SECRET_ARN', 'JWT_SECRET_ARN')
+
 class Config:
+    def __init__(self):
+        self._secrets: Dict[str, dict] = {}
+        self._secrets_fetched_at = 0.0
+        self._secrets_refreshing = False
+        self._secrets_lock = threading.Lock()
+        self._secrets_fetch_lock = threading.Lock()
+
     def init_pynamodb(self):
+        config = self
         class Settings:
             region = os.environ['AWS_REGION']
+            # DynamoDB Local, for load tests
+            host = os.environ.get('DDB_ENDPOINT_URL')
+            # For connections that build their own client (bulk's --table) rather than share dynamodb_client
+            connect_timeout_seconds = config.aws_connect_timeout_seconds
+            read_timeout_seconds = config.aws_read_timeout_seconds
+            max_pool_connections = config.aws_max_pool_connections
+            # PynamoDB retries in its own loop (with full jitter) rather than through botocore's
+            max_retry_attempts = config.aws_max_attempts - 1
         pynamodb.settings.override_settings = Settings
+        dynamo_stats.instrument_pynamodb()
+        retry_stats.instrument_pynamodb()
+
+    @property
+    def aws_max_pool_connections(self) -> int:
+        return int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+
+    @property
+    def aws_connect_timeout_seconds(self) -> float:
+        return float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '1'))
+
+    @property
+    def aws_read_timeout_seconds(self) -> float:
+        return float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '3'))
+
+    # Including the first attempt
+    @property
+    def aws_max_attempts(self) -> int:
+        return int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+    @cached_property
+    def botocore_config(self) -> BotocoreConfig:
+        options = {}
+        if 'tcp_keepalive' in BotocoreConfig.OPTION_DEFAULTS:
+            # Not understood by older botocore
+            options['tcp_keepalive'] = True
+        return BotocoreConfig(
+            max_pool_connections=self.aws_max_pool_connections,
+            connect_timeout=self.aws_connect_timeout_seconds,
+            read_timeout=self.aws_read_timeout_seconds,
+            retries={'mode': 'adaptive', 'total_max_attempts': self.aws_max_attempts},
+            **options)
+
+    # Every client is created from this session so they all pick up botocore_config, including the
+    # ones the Encryption SDK makes for itself
+    @cached_property
+    def botocore_session(self) -> botocore.session.Session:
+        session = botocore.session.get_session()
+        session.set_default_client_config(self.botocore_config)
+        return session
 
     @cached_property
     def boto_session(self):
-        return boto3.Session()
+        return boto3.Session(botocore_session=self.botocore_session)
+
+    def _client(self, service_name: str, **kwargs):
+        return retry_stats.instrument_client(self.boto_session.client(service_name, **kwargs))
 
     @property
     def domain_name(self) -> str:
@@ -27,23 +98,113 @@ class Config:
     def kms_key_arn(self) -> str:
         return os.environ['KMS_KEY_ARN']
 
+    # Comma separated keys that tokens may still have been minted under, while rotating away from them
+    @property
+    def previous_kms_key_arns(self) -> List[str]:
+        return [arn.strip() for arn in os.environ.get('PREVIOUS_KMS_KEY_ARNS', '').split(',') if arn.strip()]
+
+    # For direct callers, which get botocore's parameter validation
     @cached_property
     def dynamodb_client(self) -> DynamoDBClient:
-        return self.boto_session.client('dynamodb')
+        return dynamo_stats.instrument_client(self._client('dynamodb', endpoint_url=os.environ.get('DDB_ENDPOINT_URL')))
+
+    # Shared by every model, so they use the one connection pool. PynamoDB serialises its requests
+    # itself, so validating them again is only per-call overhead on the hot path.
+    @cached_property
+    def pynamodb_client(self) -> DynamoDBClient:
+        return dynamo_stats.instrument_client(self._client(
+            'dynamodb', endpoint_url=os.environ.get('DDB_ENDPOINT_URL'),
+            config=BotocoreConfig(parameter_validation=False)))
 
     @cached_property
     def secrets_manager_client(self) -> SecretsManagerClient:
-        return self.boto_session.client('secretsmanager')
+        return self._client('secretsmanager', endpoint_url=os.environ.get('SECRETS_MANAGER_ENDPOINT_URL'))
+
+    @cached_property
+    def kms_client(self):
+        return self._client('kms')
+
+    @property
+    def secrets_ttl_seconds(self) -> float:
+        return float(os.environ.get('SECRETS_TTL_SECONDS', '300'))
+
+    def _fetch_secret_strings(self, secret_ids: List[str]) -> Dict[str, str]:
+        # Neither API takes an empty request
+        if not secret_ids:
+            return {}
+        client = self.secrets_manager_client
+        if not hasattr(client, 'batch_get_secret_value'):
+            # Older botocore (and some local stand-ins) lack the batch API
+            with ThreadPoolExecutor(max_workers=len(secret_ids)) as pool:
+                secrets = pool.map(lambda secret_id: client.get_secret_value(SecretId=secret_id), secret_ids)
+                return {secret_id: secret['SecretString'] for secret_id, secret in zip(secret_ids, secrets)}
+
+        fetched = []
+        kwargs = {'SecretIdList': secret_ids}
+        while True:
+            resp = client.batch_get_secret_value(**kwargs)
+            if resp.get('Errors'):
+                raise RuntimeError("Failed to fetch secrets: {}".format(resp['Errors']))
+            fetched.extend(resp['SecretValues'])
+            if not resp.get('NextToken'):
+                break
+            kwargs['NextToken'] = resp['NextToken']
+        # Results only carry the full ARN and the name, callers may have asked by either or by a
+        # partial ARN, which is the full one without the "-" and six random characters at the end
+        ret = {}
+        for secret in fetched:
+            partial_arn = secret['ARN'][:-7]
+            for secret_id in secret_ids:
+                if secret_id in (secret['ARN'], secret['Name'], partial_arn):
+                    ret[secret_id] = secret['SecretString']
+        return ret
+
+    def _refresh_secrets(self):
+        secret_ids = {envvar: os.environ[envvar] for envvar in SECRET_ENVVARS if envvar in os.environ}
+        logger.info("Fetching secrets %s", list(secret_ids.keys()))
+        t_start = time.monotonic()
+        secret_strings = self._fetch_secret_strings(list(secret_ids.values()))
+        metrics.add_metric('SecretFetchTime', MetricUnit.Milliseconds, (time.monotonic() - t_start) * 1000.0)
+        for envvar, secret_id in secret_ids.items():
+            if secret_id not in secret_strings:
+                raise RuntimeError("Secret {} from {} wasn't returned, give its name or ARN".format(secret_id, envvar))
+        secrets = {envvar: json.loads(secret_strings[secret_id]) for envvar, secret_id in secret_ids.items()}
+        with self._secrets_lock:
+            self._secrets = secrets
+            self._secrets_fetched_at = time.monotonic()
+
+    def _background_refresh_secrets(self):
+        try:
+            self._refresh_secrets()
+        except Exception:
+            logger.exception("Background secret refresh failed, keeping previous values")
+        finally:
+            with self._secrets_lock:
+                self._secrets_refreshing = False
+
+    def _maybe_refresh_secrets(self):
+        with self._secrets_lock:
+            stale = time.monotonic() - self._secrets_fetched_at >= self.secrets_ttl_seconds
+            if not stale or self._secrets_refreshing:
+                return
+            self._secrets_refreshing = True
+        threading.Thread(target=self._background_refresh_secrets, daemon=True).start()
+
+    def prefetch_secrets(self):
+        with self._secrets_fetch_lock:
+            self._refresh_secrets()
 
     def _get_secret_dict(self, envvar) -> dict:
-        secret_id = os.environ[envvar]
-        logger.info("Fetching %s (%s)", secret_id, envvar)
-        secret = self.secrets_manager_client.get_secret_value(
-            SecretId=secret_id,
-        )
-        return json.loads(secret['SecretString'])
+        if envvar not in self._secrets:
+            # Only the very first lookup blocks, after that rotation is picked up in the background
+            with self._secrets_fetch_lock:
+                if envvar not in self._secrets:
+                    self._refresh_secrets()
+            return self._secrets[envvar]
+        self._maybe_refresh_secrets()
+        return self._secrets[envvar]
 
-    @cached_property
+    @property
     def _discord_oauth_secret(self) -> dict:
         return self._get_secret_dict('DISCORD_OAUTH2_SECRET_ARN')
 
@@ -55,10 +216,15 @@ class Config:
     def discord_oauth_client_secret(self) -> str:
         return self._discord_oauth_secret['clientSecret']
 
-    @cached_property
+    @property
     def _jwt_secret(self) -> dict:
         return self._get_secret_dict('JWT_SECRET_ARN')
 
+    # The whole secret, Auth parses it into a key set whenever rotation replaces it
+    @property
+    def jwt_secret(self) -> dict:
+        return self._jwt_secret
+
     @property
     def jwt_public_key(self) -> str:
         return self._jwt_secret['publicKey']
@@ -67,6 +233,104 @@ class Config:
     def jwt_private_key(self) -> str:
         return self._jwt_secret['privateKey']
 
+    @property
+    def stateless_auth(self) -> bool:
+        return os.environ.get('STATELESS_AUTH', 'true').lower() == 'true'
+
+    @property
+    def revocation_refresh_seconds(self) -> float:
+        return float(os.environ.get('REVOCATION_REFRESH_SECONDS', '60'))
+
+    @property
+    def token_key_max_age_seconds(self) -> float:
+        return float(os.environ.get('TOKEN_KEY_MAX_AGE_SECONDS', '3600'))
+
+    @property
+    def token_key_max_uses(self) -> int:
+        return int(os.environ.get('TOKEN_KEY_MAX_USES', '100000'))
+
+    # KMS calls per second (and burst) for unwrapping data keys this container hasn't seen
+    @property
+    def token_key_unwraps_per_second(self) -> float:
+        return float(os.environ.get('TOKEN_KEY_UNWRAPS_PER_SECOND', '10'))
+
+    @property
+    def lazy_routes(self) -> bool:
+        return os.environ.get('LAZY_ROUTES', 'true').lower() == 'true'
+
+    @property
+    def warm_up_on_init(self) -> bool:
+        return os.environ.get('WARM_UP_ON_INIT', 'true').lower() == 'true'
+
+    @property
+    def use_leaderboard_index(self) -> bool:
+        return os.environ.get('USE_LEADERBOARD_INDEX', 'false').lower() == 'true'
+
+    @property
+    def type_index_shards(self) -> int:
+        return int(os.environ.get('TYPE_INDEX_SHARDS', '1'))
+
+    @property
+    def type_index_read_legacy(self) -> bool:
+        return os.environ.get('TYPE_INDEX_READ_LEGACY', 'false').lower() == 'true'
+
+    @property
+    def upcoming_events_cache_seconds(self) -> float:
+        return float(os.environ.get('UPCOMING_EVENTS_CACHE_SECONDS', '30'))
+
+    @property
+    def model_cache_enabled(self) -> bool:
+        return os.environ.get('MODEL_CACHE', 'false').lower() == 'true'
+
+    @property
+    def model_cache_max_items(self) -> int:
+        return int(os.environ.get('MODEL_CACHE_MAX_ITEMS', '1000'))
+
+    def model_cache_ttl_seconds(self, type_str: str, default: float) -> float:
+        return float(os.environ.get(f'MODEL_CACHE_TTL_{type_str}', default))
+
+    @property
+    def compression_min_bytes(self) -> int:
+        return int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+
+    @property
+    def leaderboard_refresh_seconds(self) -> int:
+        return int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '60'))
+
+    # Booking counters are maintained from the table's stream rather than in each booking's transaction
+    @property
+    def stream_counters(self) -> bool:
+        return os.environ.get('STREAM_COUNTERS', 'false').lower() == 'true'
+
+    # Tokens already verified by this instance skip the signature check until this expires
+    @property
+    def jwt_verify_cache_seconds(self) -> float:
+        return float(os.environ.get('JWT_VERIFY_CACHE_SECONDS', '300'))
+
+    @property
+    def jwt_verify_cache_max_items(self) -> int:
+        return int(os.environ.get('JWT_VERIFY_CACHE_MAX_ITEMS', '1024'))
+
+    # Adds each response's DynamoDB call count, time and capacity as a header, for debugging
+    @property
+    def dynamo_debug_header(self) -> bool:
+        return os.environ.get('DYNAMO_DEBUG_HEADER', 'false').lower() == 'true'
+
+    # Fraction of requests whose (redacted) event is logged
+    @property
+    def event_log_sample_rate(self) -> float:
+        return float(os.environ.get('EVENT_LOG_SAMPLE_RATE', '0.01'))
+
+    # Profile one in this many requests, 0 for none
+    @property
+    def profile_one_in(self) -> int:
+        return int(os.environ.get('PROFILE_ONE_IN', '0'))
+
+    # Holders of this scope can ask for a profile of their request with a header, unset for nobody
+    @property
+    def profile_header_scope(self) -> Optional[str]:
+        return os.environ.get('PROFILE_HEADER_SCOPE') or None
+
     def get_dynamo_table_name(self) -> str:
         return os.environ['DDB_TABLE_NAME']
 
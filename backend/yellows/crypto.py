@@ -1,17 +1,149 @@
 from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import cached_property
 import json
-import aws_encryption_sdk
+import os
+import struct
+import threading
+import time
+from typing import Optional
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 
 from yellows.config import get_config
 from yellows.powertools import tracer
+from yellows.timing import timed
+
+# Token layout: magic | version | encrypted data key length | encrypted data key | nonce | AES-GCM ciphertext
+# Everything before the nonce is authenticated as associated data.
+TOKEN_MAGIC = b'YT'
+TOKEN_VERSION = 1
+_HEADER = struct.Struct('>2sBH')
+_NONCE_LENGTH = 12
+_ENCRYPTION_CONTEXT = {'purpose': 'yellows-token'}
+_MAX_CACHED_DATA_KEYS = 16
+_UNWRAP_BURST = 16
+
+class _DataKey:
+    def __init__(self, plaintext: bytes, encrypted: bytes):
+        self.aead = AESGCM(plaintext)
+        self.encrypted = encrypted
+        self.created_at = time.monotonic()
+        self.uses = 0
 
 class CryptoHelper:
     def __init__(self):
         self.config = get_config()
-        self.crypto_client = aws_encryption_sdk.EncryptionSDKClient()
-        self.key_provider = aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(key_ids=[
+        self._data_key: Optional[_DataKey] = None
+        self._decrypt_keys: 'OrderedDict[bytes, AESGCM]' = OrderedDict()
+        self._unwrap_allowance = float(_UNWRAP_BURST)
+        self._unwrap_checked_at = time.monotonic()
+        self._unwrap_lock = threading.Lock()
+
+    # The Encryption SDK is only needed for tokens minted before the local codec,
+    # so it is imported on first use rather than on every cold start
+    @cached_property
+    def crypto_client(self):
+        import aws_encryption_sdk
+        return aws_encryption_sdk.EncryptionSDKClient()
+
+    @cached_property
+    def key_provider(self):
+        import aws_encryption_sdk
+        return aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(key_ids=[
             self.config.kms_key_arn,
-        ])
+        ], botocore_session=self.config.botocore_session)
+
+    def warm_up(self):
+        if self._data_key is None:
+            self._data_key = self._generate_data_key()
+
+    def _current_data_key(self) -> _DataKey:
+        data_key = self._data_key
+        if data_key is None \
+                or time.monotonic() - data_key.created_at >= self.config.token_key_max_age_seconds \
+                or data_key.uses >= self.config.token_key_max_uses:
+            data_key = self._generate_data_key()
+            self._data_key = data_key
+        data_key.uses += 1
+        return data_key
+
+    @tracer.capture_method(capture_response=False)
+    def _generate_data_key(self) -> _DataKey:
+        resp = self.config.kms_client.generate_data_key(
+            KeyId=self.config.kms_key_arn,
+            KeySpec='AES_256',
+            EncryptionContext=_ENCRYPTION_CONTEXT,
+        )
+        data_key = _DataKey(resp['Plaintext'], resp['CiphertextBlob'])
+        self._remember_decrypt_key(data_key.encrypted, data_key.aead)
+        return data_key
+
+    def _remember_decrypt_key(self, encrypted: bytes, aead: AESGCM):
+        self._decrypt_keys[encrypted] = aead
+        self._decrypt_keys.move_to_end(encrypted)
+        while len(self._decrypt_keys) > _MAX_CACHED_DATA_KEYS:
+            self._decrypt_keys.popitem(last=False)
+
+    # The encrypted data key comes from the client, so each one this container hasn't seen costs a
+    # KMS call. Genuine tokens only ever name a handful, anything beyond the allowance is refused.
+    def _take_unwrap_allowance(self):
+        with self._unwrap_lock:
+            now = time.monotonic()
+            rate = self.config.token_key_unwraps_per_second
+            self._unwrap_allowance = min(_UNWRAP_BURST, self._unwrap_allowance + (now - self._unwrap_checked_at) * rate)
+            self._unwrap_checked_at = now
+            if self._unwrap_allowance < 1:
+                raise ValueError("Too many unknown token keys")
+            self._unwrap_allowance -= 1
+
+    @tracer.capture_method(capture_response=False)
+    def _unwrap_data_key(self, encrypted: bytes) -> AESGCM:
+        self._take_unwrap_allowance()
+        client = self.config.kms_client
+        # Pinned to our own keys rather than whichever one the blob names. Tokens minted under a
+        # previous KMS_KEY_ARN still decode while it's listed in PREVIOUS_KMS_KEY_ARNS.
+        for key_id in [self.config.kms_key_arn] + self.config.previous_kms_key_arns:
+            try:
+                resp = client.decrypt(
+                    CiphertextBlob=encrypted,
+                    KeyId=key_id,
+                    EncryptionContext=_ENCRYPTION_CONTEXT,
+                )
+                break
+            except client.exceptions.IncorrectKeyException:
+                continue
+        else:
+            raise ValueError("Token key isn't one of ours")
+        aead = AESGCM(resp['Plaintext'])
+        self._remember_decrypt_key(encrypted, aead)
+        return aead
+
+    def _get_decrypt_key(self, encrypted: bytes) -> AESGCM:
+        aead = self._decrypt_keys.get(encrypted)
+        if aead is None:
+            return self._unwrap_data_key(encrypted)
+        self._decrypt_keys.move_to_end(encrypted)
+        return aead
+
+    def encrypt_token(self, plaintext: bytes) -> str:
+        data_key = self._current_data_key()
+        header = _HEADER.pack(TOKEN_MAGIC, TOKEN_VERSION, len(data_key.encrypted)) + data_key.encrypted
+        nonce = os.urandom(_NONCE_LENGTH)
+        cyphertext = data_key.aead.encrypt(nonce, plaintext, header)
+        return urlsafe_b64encode(header + nonce + cyphertext).decode('utf-8')
+
+    def decrypt_token(self, b: bytes) -> bytes:
+        magic, version, key_length = _HEADER.unpack_from(b)
+        if magic != TOKEN_MAGIC or version != TOKEN_VERSION:
+            raise ValueError("Unknown token format")
+        header_length = _HEADER.size + key_length
+        header = b[:header_length]
+        nonce = b[header_length:header_length + _NONCE_LENGTH]
+        cyphertext = b[header_length + _NONCE_LENGTH:]
+        if len(header) != header_length or len(nonce) != _NONCE_LENGTH:
+            raise ValueError("Truncated token")
+        aead = self._get_decrypt_key(header[_HEADER.size:])
+        return aead.decrypt(nonce, cyphertext, header)
 
     @tracer.capture_method(capture_response=False)
     def encrypt(self, s: str) -> str:
@@ -24,16 +156,20 @@ class CryptoHelper:
     @tracer.capture_method(capture_response=False)
     def decrypt(self, s: str) -> str:
         b = urlsafe_b64decode(s)
+        if b.startswith(TOKEN_MAGIC):
+            return self.decrypt_token(b).decode('utf-8')
         plaintext, _ = self.crypto_client.decrypt(
             source=b,
             key_provider=self.key_provider,
         )
         return plaintext.decode('utf-8')
 
+    @timed('token_crypto')
     def encrypt_dict(self, d: dict) -> str:
         s = json.dumps(d)
-        return self.encrypt(s)
+        return self.encrypt_token(s.encode('utf-8'))
 
+    @timed('token_crypto')
     def decrypt_dict(self, cyphertext: str) -> dict:
         plaintext = self.decrypt(cyphertext)
         return json.loads(plaintext)
@@ -0,0 +1,114 @@
+from functools import wraps
+import threading
+import time
+from typing import Dict, Optional
+from aws_lambda_powertools.metrics import Metrics, MetricUnit
+from pynamodb.connection.base import Connection
+
+# Counts every DynamoDB call made while serving a request: PynamoDB's Connection.dispatch (which
+# already asks for TOTAL consumed capacity) and any boto3 client passed to instrument_client.
+# api_handler resets it per request and reports it under that request's operation dimension.
+
+READ_OPERATIONS = frozenset(('GetItem', 'BatchGetItem', 'Query', 'Scan', 'TransactGetItems'))
+
+def consumed_units(data: Optional[dict]) -> float:
+    consumed = (data or {}).get('ConsumedCapacity')
+    if isinstance(consumed, list):
+        return sum(c.get('CapacityUnits', 0.0) for c in consumed)
+    if isinstance(consumed, dict):
+        return consumed.get('CapacityUnits', 0.0)
+    return 0.0
+
+def _items_returned(data: Optional[dict]) -> int:
+    if not data:
+        return 0
+    if 'Count' in data:
+        return data['Count']
+    if 'Item' in data:
+        return 1
+    responses = data.get('Responses')
+    if isinstance(responses, dict):
+        return sum(len(items) for items in responses.values())
+    if isinstance(responses, list):
+        return sum(1 for response in responses if response.get('Item'))
+    return 0
+
+class DynamoStats:
+    def __init__(self):
+        # The loader and warm up make calls from worker threads
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.time_ms = 0.0
+        self.read_units = 0.0
+        self.write_units = 0.0
+        self.items = 0
+        self.operations: Dict[str, int] = {}
+
+    def record(self, operation_name: str, elapsed_ms: float, data: Optional[dict]):
+        units = consumed_units(data)
+        items = _items_returned(data)
+        with self._lock:
+            self.calls += 1
+            self.time_ms += elapsed_ms
+            if operation_name in READ_OPERATIONS:
+                self.read_units += units
+            else:
+                self.write_units += units
+            self.items += items
+            self.operations[operation_name] = self.operations.get(operation_name, 0) + 1
+
+    def add_metrics(self, metrics: Metrics):
+        metrics.add_metric('DynamoCalls', MetricUnit.Count, self.calls)
+        metrics.add_metric('DynamoTime', MetricUnit.Milliseconds, self.time_ms)
+        metrics.add_metric('DynamoReadUnits', MetricUnit.Count, self.read_units)
+        metrics.add_metric('DynamoWriteUnits', MetricUnit.Count, self.write_units)
+        metrics.add_metric('DynamoItems', MetricUnit.Count, self.items)
+
+    def header_value(self) -> str:
+        operations = ','.join('{}:{}'.format(name, count) for name, count in sorted(self.operations.items()))
+        return 'calls={};time={:.1f};rcu={:g};wcu={:g};items={};ops={}'.format(
+            self.calls, self.time_ms, self.read_units, self.write_units, self.items, operations)
+
+_stats = DynamoStats()
+def get_dynamo_stats() -> DynamoStats:
+    return _stats
+
+_pynamodb_instrumented = False
+def instrument_pynamodb():
+    global _pynamodb_instrumented
+    if _pynamodb_instrumented:
+        return
+    dispatch = Connection.dispatch
+
+    @wraps(dispatch)
+    def _dispatch(self, operation_name, operation_kwargs, *args, **kwargs):
+        data = None
+        t_start = time.perf_counter()
+        try:
+            data = dispatch(self, operation_name, operation_kwargs, *args, **kwargs)
+            return data
+        finally:
+            _stats.record(operation_name, (time.perf_counter() - t_start) * 1000.0, data)
+    Connection.dispatch = _dispatch
+    _pynamodb_instrumented = True
+
+def instrument_client(client):
+    def _request_capacity(params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _before_call(context, **kwargs):
+        context['dynamo_stats_start'] = time.perf_counter()
+
+    def _after_call(parsed, model, context, **kwargs):
+        t_start = context.get('dynamo_stats_start')
+        elapsed_ms = 0.0 if t_start is None else (time.perf_counter() - t_start) * 1000.0
+        _stats.record(model.name, elapsed_ms, parsed)
+
+    client.meta.events.register('provide-client-params.dynamodb', _request_capacity)
+    client.meta.events.register('before-call.dynamodb', _before_call)
+    client.meta.events.register('after-call.dynamodb', _after_call)
+    return client
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+from authlib.jose import JsonWebKey, JsonWebToken, JWTClaims, KeySet
+from authlib.jose.errors import JoseError
+
+# The JWT secret holds the current signing key as PEM (publicKey/privateKey), optionally with an
+# "algorithm" and "kid", plus "retiredKeys": [{"publicKey", "algorithm"?, "kid"?}] that tokens are
+# still accepted from while they age out. Everything is parsed once per version of the secret.
+
+ALGORITHMS = ('RS256', 'ES256', 'EdDSA')
+jwt = JsonWebToken(list(ALGORITHMS))
+
+class UnknownKeyError(JoseError):
+    error = 'unknown_key'
+
+def _default_algorithm(key) -> str:
+    params = key.as_dict()
+    if params['kty'] == 'RSA':
+        return 'RS256'
+    if params['kty'] == 'EC' and params['crv'] == 'P-256':
+        return 'ES256'
+    if params['kty'] == 'OKP' and params['crv'] == 'Ed25519':
+        return 'EdDSA'
+    raise ValueError("No JWT algorithm for {} {} keys".format(params['kty'], params.get('crv', '')))
+
+def _import_public_key(pem: str, algorithm: Optional[str], kid: Optional[str]):
+    key = JsonWebKey.import_key(pem)
+    algorithm = algorithm or _default_algorithm(key)
+    if algorithm not in ALGORITHMS:
+        raise ValueError("Unsupported JWT algorithm {}".format(algorithm))
+    # Thumbprints are stable, so a kid only needs configuring to override them
+    return JsonWebKey.import_key(pem, {'kid': kid or key.thumbprint(), 'alg': algorithm, 'use': 'sig'})
+
+@dataclass
+class SigningKey:
+    kid: str
+    algorithm: str
+    key: Any
+
+class JwtKeySet:
+    def __init__(self, secret: dict):
+        current = _import_public_key(secret['publicKey'], secret.get('algorithm'), secret.get('kid'))
+        self.signing_key = SigningKey(current.kid, current['alg'], JsonWebKey.import_key(secret['privateKey']))
+        self.public_keys = KeySet([current] + [
+            _import_public_key(retired['publicKey'], retired.get('algorithm'), retired.get('kid'))
+            for retired in secret.get('retiredKeys', [])
+        ])
+        self._by_kid = {key.kid: key for key in reversed(self.public_keys.keys)}
+        self._by_algorithm = {key['alg']: key for key in reversed(self.public_keys.keys)}
+        self._header = {'alg': self.signing_key.algorithm, 'kid': self.signing_key.kid}
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(self._header, claims, self.signing_key.key).decode('utf-8')
+
+    def _resolve(self, header: dict, payload: bytes):
+        if 'kid' in header:
+            key = self._by_kid.get(header['kid'])
+        else:
+            # Tokens from before key ids go to the newest key of their algorithm
+            key = self._by_algorithm.get(header['alg'])
+        # Only ever verify with the algorithm the key was issued for, whatever the header claims
+        if key is None or header['alg'] != key['alg']:
+            raise UnknownKeyError("No {} key {}".format(header['alg'], header.get('kid')))
+        return key
+
+    def decode(self, token: str, claims_options: Optional[dict] = None) -> JWTClaims:
+        return jwt.decode(token, self._resolve, claims_options=claims_options)
@@ -0,0 +1,220 @@
+from bisect import bisect_left, insort
+import json
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+import zlib
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from pynamodb.exceptions import PutError
+
+from yellows.config import get_config
+from yellows.models import User
+from yellows.models.leaderboard import NAMES_PART, LeaderboardChunk, LeaderboardSnapshot
+from yellows.powertools import metrics, tracer
+
+logger = Logger()
+
+# Version 2 carried full names, which now have a blob of their own. Versions 1 and 2 still load.
+BLOB_VERSION = 3
+NAMES_BLOB_VERSION = 1
+
+# Every user's (score, nick), held as one list sorted best first (score descending, then nick)
+# so rank, top-N and "around me" are a bisect plus a slice.
+class Leaderboard:
+    def __init__(self, generation: int, entries: List[Tuple[int, str]], full_names: Optional[Dict[str, str]]=None):
+        self.generation = generation
+        self._keys = sorted((-score, nick) for score, nick in entries)
+        self._scores = {nick: -neg_score for neg_score, nick in self._keys}
+        self.full_names = full_names or {}
+        # Chunks of the snapshot's names blob, None when the names came in the rank blob
+        self.names_chunk_count: Optional[int] = None
+        # The build whose chunks the board was read from
+        self.build_id: Optional[str] = None
+        # Nicks set_score has added since the board was built, in the order they arrived
+        self.added: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def score_of(self, nick_name: str) -> Optional[int]:
+        return self._scores.get(nick_name)
+
+    # Best first
+    def nick_names(self) -> List[str]:
+        return [nick for _, nick in self._keys]
+
+    def _rank_of_score(self, score: int) -> int:
+        # Everyone on the same score shares the best rank among them
+        return bisect_left(self._keys, (-score, '')) + 1
+
+    def _entry(self, position: int) -> dict:
+        neg_score, nick = self._keys[position]
+        return {
+            'nick_name': nick,
+            'achievement_score': -neg_score,
+            'rank': self._rank_of_score(-neg_score),
+        }
+
+    def rank(self, nick_name: str) -> Optional[dict]:
+        score = self._scores.get(nick_name)
+        if score is None:
+            return None
+        return {
+            'nick_name': nick_name,
+            'achievement_score': score,
+            'rank': self._rank_of_score(score),
+            'total': len(self._keys),
+        }
+
+    def top(self, count: int) -> List[dict]:
+        return [self._entry(i) for i in range(min(count, len(self._keys)))]
+
+    def around(self, nick_name: str, count: int) -> Optional[List[dict]]:
+        score = self._scores.get(nick_name)
+        if score is None:
+            return None
+        position = bisect_left(self._keys, (-score, nick_name))
+        start = max(0, min(position - count // 2, len(self._keys) - count))
+        return [self._entry(i) for i in range(start, min(start + count, len(self._keys)))]
+
+    def set_score(self, nick_name: str, score: int):
+        old_score = self._scores.get(nick_name)
+        if old_score is not None:
+            del self._keys[bisect_left(self._keys, (-old_score, nick_name))]
+        else:
+            self.added.append(nick_name)
+        insort(self._keys, (-score, nick_name))
+        self._scores[nick_name] = score
+
+    def to_blob(self) -> bytes:
+        doc = {
+            'v': BLOB_VERSION,
+            'scores': [-neg_score for neg_score, _ in self._keys],
+            'nicks': [nick for _, nick in self._keys],
+        }
+        return zlib.compress(json.dumps(doc, separators=(',', ':')).encode('utf-8'), 9)
+
+    def names_to_blob(self) -> bytes:
+        doc = {'v': NAMES_BLOB_VERSION, 'names': self.full_names}
+        return zlib.compress(json.dumps(doc, separators=(',', ':')).encode('utf-8'), 9)
+
+    @classmethod
+    def from_blob(cls, generation: int, blob: bytes) -> 'Leaderboard':
+        doc = json.loads(zlib.decompress(blob))
+        if doc.get('v') not in (1, 2, BLOB_VERSION):
+            raise ValueError("Unknown leaderboard blob version {}".format(doc.get('v')))
+        full_names = {nick: name for nick, name in zip(doc['nicks'], doc.get('names', [])) if name is not None}
+        return cls(generation, list(zip(doc['scores'], doc['nicks'])), full_names)
+
+def load_full_names(board: Leaderboard) -> Dict[str, str]:
+    if board.names_chunk_count is None:
+        return board.full_names
+    doc = json.loads(zlib.decompress(LeaderboardChunk.read_blob(board.generation, board.names_chunk_count, NAMES_PART, board.build_id)))
+    if doc.get('v') != NAMES_BLOB_VERSION:
+        raise ValueError("Unknown leaderboard names blob version {}".format(doc.get('v')))
+    return doc['names']
+
+# The snapshot this container serves from. Loaded on first use, then the snapshot item is
+# re-read every LEADERBOARD_REFRESH_SECONDS and the blob only fetched again when it changes.
+class LeaderboardCache:
+    def __init__(self):
+        self._board: Optional[Leaderboard] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @tracer.capture_method(capture_response=False)
+    def _load(self):
+        try:
+            snapshot = LeaderboardSnapshot.get_current()
+        except LeaderboardSnapshot.DoesNotExist:
+            return
+        if self._board is not None and self._board.generation == snapshot.generation:
+            return
+        blob = LeaderboardChunk.read_blob(snapshot.generation, snapshot.chunk_count, build_id=snapshot.build_id)
+        board = Leaderboard.from_blob(snapshot.generation, blob)
+        board.names_chunk_count = snapshot.names_chunk_count
+        board.build_id = snapshot.build_id
+        self._board = board
+
+    def current(self) -> Optional[Leaderboard]:
+        with self._lock:
+            now = time.monotonic()
+            if self._board is None or now - self._checked_at >= get_config().leaderboard_refresh_seconds:
+                self._checked_at = now
+                try:
+                    self._load()
+                except Exception:
+                    # Keep serving whatever we had, the next refresh tries again
+                    logger.exception("Failed to load leaderboard snapshot")
+            return self._board
+
+    # Score changes made by this container show up straight away rather than at the next rebuild
+    def patch_score(self, nick_name: str, score: int):
+        with self._lock:
+            if self._board is not None:
+                self._board.set_score(nick_name, score)
+
+_leaderboard_cache = None
+def get_leaderboard_cache() -> LeaderboardCache:
+    global _leaderboard_cache
+    if _leaderboard_cache is None:
+        _leaderboard_cache = LeaderboardCache()
+    return _leaderboard_cache
+
+def build_leaderboard(generation: int) -> Leaderboard:
+    resp = User.list_leaderboard_raw(attributes_to_get=[
+        User._nick_name.attr_name,
+        User.full_name.attr_name,
+        User._achievement_score.attr_name,
+    ])
+    entries = []
+    full_names = {}
+    for item in resp['Items']:
+        nick = item[User._nick_name.attr_name]['S']
+        entries.append((int(item[User._achievement_score.attr_name]['N']), nick))
+        full_name = item.get(User.full_name.attr_name)
+        if full_name is not None:
+            full_names[nick] = full_name['S']
+    return Leaderboard(generation, entries, full_names)
+
+def rebuild_snapshot() -> LeaderboardSnapshot:
+    try:
+        previous: Optional[LeaderboardSnapshot] = LeaderboardSnapshot.get_current(consistent_read=True)
+    except LeaderboardSnapshot.DoesNotExist:
+        previous = None
+    generation = 1 if previous is None else previous.generation + 1
+    # Rebuilds that overlap (a duplicate delivery, or one running past the next schedule) build
+    # the same generation, so each writes chunks under its own id and only the winner's are used
+    build_id = uuid.uuid4().hex
+    board = build_leaderboard(generation)
+    chunk_count = LeaderboardChunk.write_blob(generation, board.to_blob(), build_id=build_id)
+    names_chunk_count = LeaderboardChunk.write_blob(generation, board.names_to_blob(), NAMES_PART, build_id)
+    snapshot = LeaderboardSnapshot.create(generation, chunk_count, len(board), names_chunk_count, build_id)
+    try:
+        if previous is None:
+            snapshot.save(LeaderboardSnapshot.pk.does_not_exist())
+        else:
+            # Only one rebuild can take over from the generation it read
+            snapshot.version = previous.version
+            snapshot.save()
+    except PutError:
+        LeaderboardChunk.delete_build(generation, build_id)
+        raise
+    if previous is not None:
+        LeaderboardChunk.delete_build(previous.generation, previous.build_id)
+    return snapshot
+
+# Scheduled entry point
+@logger.inject_lambda_context
+@metrics.log_metrics
+@tracer.capture_lambda_handler
+def lambda_handler(event: dict, context: LambdaContext) -> dict:
+    t_start = time.monotonic()
+    snapshot = rebuild_snapshot()
+    metrics.add_metric('LeaderboardEntries', MetricUnit.Count, snapshot.entry_count)
+    metrics.add_metric('LeaderboardBuildTime', MetricUnit.Milliseconds, (time.monotonic() - t_start) * 1000.0)
+    logger.info("Built leaderboard generation %d with %d entries", snapshot.generation, snapshot.entry_count)
+    return {'generation': snapshot.generation, 'entries': snapshot.entry_count}
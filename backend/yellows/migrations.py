@@ -0,0 +1,199 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Context, Decimal
+import json
+import threading
+from typing import Optional, Type, Union
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import MetricUnit
+from pynamodb.exceptions import UpdateError
+
+from yellows.bulk import RateLimiter
+from yellows.dynamo_stats import consumed_units
+from yellows.models import Event, MigrationCheckpoint, User
+from yellows.models.base import BaseItem
+from yellows.powertools import metrics
+
+logger = Logger()
+
+# Moves items into the TypeIndexOrder partition the current TYPE_INDEX_SHARDS setting expects.
+# Safe to run while serving: updates are version checked, and anything that loses a race is
+# counted as skipped and picked up by running it again. Enable TYPE_INDEX_READ_LEGACY until it
+# reports nothing left to move.
+def backfill_type_partitions(model_cls: Type[BaseItem]) -> dict:
+    counts = {'scanned': 0, 'moved': 0, 'skipped': 0}
+    for item in model_cls.scan():
+        counts['scanned'] += 1
+        expected = model_cls._type_partition_for(item.pk)
+        if item.type_ == expected:
+            continue
+        try:
+            item.update([model_cls.type_.set(expected)])
+            counts['moved'] += 1
+        except UpdateError:
+            logger.warning("Lost update race for %s, skipping", item.pk)
+            counts['skipped'] += 1
+    logger.info("Backfilled type partitions for %s: %s", model_cls.__name__, counts)
+    return counts
+
+# DynamoDB keeps 38 significant digits, so that's all a stored sort order can be compared on
+_DYNAMO_NUMBER_CONTEXT = Context(prec=38)
+
+def _as_stored(n: Optional[Union[int, float, Decimal]]) -> Optional[Decimal]:
+    if n is None:
+        return None
+    return _DYNAMO_NUMBER_CONTEXT.create_decimal(repr(n) if isinstance(n, float) else n).normalize(_DYNAMO_NUMBER_CONTEXT)
+
+_metrics_lock = threading.Lock()
+
+def _add_metric(name: str, value: float):
+    with _metrics_lock:
+        metrics.add_metric(name, MetricUnit.Count, value)
+
+def _flush_metrics(job: str):
+    # Long running jobs report as they go rather than once at the end. clear_metrics drops
+    # dimensions too, so the job's is added back on every flush.
+    with _metrics_lock:
+        if metrics.metric_set:
+            metrics.add_dimension('migration', job)
+            print(json.dumps(metrics.serialize_metric_set(), separators=(',', ':')))
+            metrics.clear_metrics()
+
+class SortOrderBackfill:
+    def __init__(self, model_cls: Type[BaseItem], total_segments: int, page_size: int,
+                 read_limiter: RateLimiter, write_limiter: RateLimiter, dry_run: bool=False):
+        self.model_cls = model_cls
+        self.job = 'sort-order-{}'.format(BaseItem.pynamo_discriminator.get_discriminator(model_cls))
+        self.total_segments = total_segments
+        self.page_size = page_size
+        self.read_limiter = read_limiter
+        self.write_limiter = write_limiter
+        self.dry_run = dry_run
+
+    def _checkpoint(self, segment: int, restart: bool) -> MigrationCheckpoint:
+        existing = MigrationCheckpoint.get_for(self.job, segment)
+        if existing is not None and not restart:
+            if existing.total_segments != self.total_segments:
+                raise ValueError("{} was checkpointed with {} segments, restart it to change that".format(
+                    self.job, existing.total_segments))
+            return existing
+        checkpoint = MigrationCheckpoint.create(self.job, segment, self.total_segments)
+        if existing is not None:
+            checkpoint.version = existing.version
+        return checkpoint
+
+    def _fix(self, item: BaseItem, counts: dict):
+        expected = item._expected_index_sort_order()
+        if expected is None or _as_stored(item.index_sort_order) == _as_stored(expected):
+            return
+        if self.dry_run:
+            counts['changed'] += 1
+            return
+        for attempt in range(2):
+            try:
+                # Version checked, so a concurrent write is never overwritten with a stale sort order
+                item.update([self.model_cls.index_sort_order.set(expected)])
+                # UpdateItem doesn't report what it used here, these items are all well under 1KB
+                self.write_limiter.consume(1)
+                counts['changed'] += 1
+                return
+            except UpdateError:
+                if attempt > 0:
+                    break
+                try:
+                    item = self.model_cls.get(item.pk, item.sk, consistent_read=True)
+                except self.model_cls.DoesNotExist:
+                    return
+                expected = item._expected_index_sort_order()
+                if _as_stored(item.index_sort_order) == _as_stored(expected):
+                    return
+        logger.warning("Lost update races for %s twice, skipping", item.pk)
+        counts['skipped'] += 1
+
+    def run_segment(self, segment: int, restart: bool=False) -> dict:
+        checkpoint = self._checkpoint(segment, restart)
+        counts = {'scanned': 0, 'changed': 0, 'skipped': 0}
+        counts.update(checkpoint.counts or {})
+        if checkpoint.done:
+            return counts
+        connection = self.model_cls._get_connection()
+        filter_condition = BaseItem.pynamo_discriminator.is_in(self.model_cls)
+        last_evaluated_key = checkpoint.last_evaluated_key
+        while True:
+            resp = connection.scan(
+                filter_condition=filter_condition,
+                segment=segment, total_segments=self.total_segments,
+                exclusive_start_key=last_evaluated_key,
+                limit=self.page_size,
+                return_consumed_capacity='TOTAL',
+            )
+            self.read_limiter.consume(consumed_units(resp))
+            before = dict(counts)
+            for raw_item in resp.get('Items', []):
+                counts['scanned'] += 1
+                self._fix(self.model_cls.from_raw_data(raw_item), counts)
+            for name in counts:
+                _add_metric('Backfill' + name.capitalize(), counts[name] - before[name])
+            last_evaluated_key = resp.get('LastEvaluatedKey')
+            checkpoint.last_evaluated_key = last_evaluated_key
+            checkpoint.done = last_evaluated_key is None
+            checkpoint.counts = counts
+            if not self.dry_run:
+                checkpoint.save()
+            _flush_metrics(self.job)
+            if last_evaluated_key is None:
+                return counts
+
+    def run(self, workers: int, restart: bool=False) -> dict:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(lambda s: self.run_segment(s, restart), range(self.total_segments)))
+        totals = {name: sum(r[name] for r in results) for name in ('scanned', 'changed', 'skipped')}
+        logger.info("Backfilled sort orders for %s: %s", self.model_cls.__name__, totals)
+        return totals
+
+def _capacity_limits(fraction: Optional[float], max_rcu: Optional[float], max_wcu: Optional[float]):
+    if fraction is None:
+        return max_rcu, max_wcu
+    throughput = BaseItem._get_connection().describe_table().get('ProvisionedThroughput', {})
+    read, write = throughput.get('ReadCapacityUnits', 0), throughput.get('WriteCapacityUnits', 0)
+    if not read or not write:
+        # On-demand tables have nothing to take a fraction of
+        logger.warning("Table has no provisioned capacity, using --max-rcu/--max-wcu only")
+        return max_rcu, max_wcu
+    return read * fraction, write * fraction
+
+# Recomputes IndexSortOrder with the current model code and rewrites whatever differs, so a change
+# of encoding (or items written by older code) doesn't leave TypeIndexOrder misordered. Resumes
+# from its checkpoints when rerun; pass restart to start the scan over.
+def backfill_sort_order(model_cls: Type[BaseItem], segments: int=4, workers: int=4, page_size: int=100,
+                        capacity_fraction: Optional[float]=None, max_rcu: Optional[float]=None,
+                        max_wcu: Optional[float]=None, restart: bool=False, dry_run: bool=False) -> dict:
+    read_units, write_units = _capacity_limits(capacity_fraction, max_rcu, max_wcu)
+    job = SortOrderBackfill(model_cls, segments, page_size, RateLimiter(read_units), RateLimiter(write_units), dry_run)
+    return job.run(workers, restart)
+
+def _sort_order(args):
+    return [backfill_sort_order(
+        m, segments=args.segments, workers=args.workers, page_size=args.page_size,
+        capacity_fraction=args.capacity_fraction, max_rcu=args.max_rcu, max_wcu=args.max_wcu,
+        restart=args.restart, dry_run=args.dry_run,
+    ) for m in (User, Event)]
+
+MIGRATIONS = {
+    'type-partitions': lambda args: [backfill_type_partitions(m) for m in (User, Event)],
+    'sort-order': _sort_order,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='python -m yellows.migrations')
+    parser.add_argument('migration', choices=sorted(MIGRATIONS))
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--capacity-fraction', type=float, help="of the table's provisioned capacity")
+    parser.add_argument('--max-rcu', type=float)
+    parser.add_argument('--max-wcu', type=float)
+    parser.add_argument('--restart', action='store_true', help="ignore checkpoints and scan from the start")
+    parser.add_argument('--dry-run', action='store_true', help="count what would change without writing")
+    args = parser.parse_args()
+    print(json.dumps(MIGRATIONS[args.migration](args)))
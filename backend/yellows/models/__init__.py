@@ -1,3 +1,6 @@
 from yellows.models.events import Event, EventBooking
+from yellows.models.leaderboard import LeaderboardChunk, LeaderboardSnapshot
 from yellows.models.login import Login
+from yellows.models.migration import MigrationCheckpoint
+from yellows.models.revocation import Revocation
 from yellows.models.users import User
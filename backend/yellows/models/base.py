@@ -1,11 +1,39 @@
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Type, Union
 from typing_extensions import Self
 from pynamodb.indexes import AllProjection, GlobalSecondaryIndex
+from pynamodb.connection import TableConnection
+from pynamodb.connection.base import BOTOCORE_EXCEPTIONS
+from pynamodb.constants import UPDATE_ITEM
+from pynamodb.exceptions import UpdateError
 from pynamodb.models import Model
+from pynamodb.expressions.condition import Condition
 from pynamodb.attributes import DiscriminatorAttribute, NumberAttribute, UnicodeAttribute, VersionAttribute
+from pynamodb.expressions.update import Action
 from pynamodb.pagination import ResultIterator
+from pynamodb.transactions import TransactWrite
 
+from aws_lambda_powertools.metrics import MetricUnit
+
+from yellows.cache import TTLCache
 from yellows.config import get_config
+from yellows.models.sharding import INDEX_KEY_ATTRIBUTES, MergedQuery, check_unsharded_key, shard_for
+from yellows.powertools import metrics
+
+if TYPE_CHECKING:
+    from yellows.models.loader import LoadRequest
+
+
+def _query_pages_raw(query_page: Callable[[Optional[dict], Optional[int]], dict],
+                     limit: Optional[int], last_evaluated_key: Optional[dict]) -> dict:
+    items: List[dict] = []
+    while True:
+        resp = query_page(last_evaluated_key, None if limit is None else limit - len(items))
+        items.extend(resp.get('Items', []))
+        last_evaluated_key = resp.get('LastEvaluatedKey')
+        if last_evaluated_key is None or (limit is not None and len(items) >= limit):
+            return {'Items': items, 'LastEvaluatedKey': last_evaluated_key}
 
+_model_caches: Dict[type, TTLCache] = {}
 
 class InvertedIndex(GlobalSecondaryIndex):
     class Meta:
@@ -32,6 +60,104 @@ class BaseItem(Model):
     inverted_index = InvertedIndex()
     type_ordered_index = TypeOrderedIndex()
     version = VersionAttribute(attr_name="Version")
+    # Seconds a point lookup may be served from the in-process cache, None to never cache
+    cache_ttl_seconds: Optional[float] = None
+    # Items keyed as PK == SK, so one key component names an item. Child items in another's
+    # collection set this False, and can't be cached or loaded by key.
+    root_item: bool = True
+
+    # Every model talks through Config's PynamoDB client, so they share its connection pool, timeouts and
+    # instrumentation rather than PynamoDB building a client per model class
+    @classmethod
+    def _get_connection(cls) -> TableConnection:
+        connection = super()._get_connection()
+        if connection.connection._client is None:
+            connection.connection._client = get_config().pynamodb_client
+        return connection
+
+    # What IndexSortOrder should hold under the current encoding, None for types that aren't ordered
+    def _expected_index_sort_order(self) -> Optional[Union[int, float]]:
+        return None
+
+    @classmethod
+    def _model_cache(cls) -> Optional[TTLCache]:
+        config = get_config()
+        if cls.cache_ttl_seconds is None or not config.model_cache_enabled:
+            return None
+        cache = _model_caches.get(cls)
+        if cache is None:
+            type_str = cls.pynamo_discriminator.get_discriminator(cls)
+            ttl = config.model_cache_ttl_seconds(type_str, cls.cache_ttl_seconds)
+            cache = _model_caches[cls] = TTLCache(ttl, config.model_cache_max_items)
+        return cache
+
+    # Hits are rebuilt from the serialized item so callers can't mutate what's cached
+    @classmethod
+    def _from_cache(cls, key: str) -> Optional[Self]:
+        cache = cls._model_cache()
+        if cache is None:
+            return None
+        type_str = cls.pynamo_discriminator.get_discriminator(cls)
+        raw = cache.get(key)
+        if raw is None:
+            metrics.add_metric(f'{type_str}CacheMiss', MetricUnit.Count, 1)
+            return None
+        metrics.add_metric(f'{type_str}CacheHit', MetricUnit.Count, 1)
+        return cls.from_raw_data(raw)
+
+    # For root items. Consistent reads always go to DynamoDB (refreshing the cache).
+    @classmethod
+    def _get_cached(cls, key: str, consistent_read:bool=False) -> Self:
+        if not consistent_read:
+            item = cls._from_cache(key)
+            if item is not None:
+                return item
+        item = cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+        item._remember()
+        return item
+
+    # Batched point lookups through the request's loader, e.g. User.load(nick_name). Nothing is
+    # fetched until the first get() on any outstanding request, which fetches them all.
+    @classmethod
+    def load(cls, *components: str) -> 'LoadRequest[Self]':
+        from yellows.models.loader import get_loader
+        return get_loader().load(cls, *components)
+
+    @classmethod
+    def load_many(cls, components: Iterable[str]) -> List[Optional[Self]]:
+        from yellows.models.loader import get_loader
+        return get_loader().load_many(cls, components)
+
+    def _remember(self):
+        cache = type(self)._model_cache()
+        if cache is None or self.pk != self.sk:
+            return
+        cached = cache.get(self.pk)
+        # Never let an older copy (e.g. from a slow eventually consistent read) replace a newer one
+        if cached is not None and int(cached[type(self).version.attr_name]['N']) > (self.version or 0):
+            return
+        cache.put(self.pk, self.serialize())
+
+    @classmethod
+    def _forget(cls, key: str):
+        cache = cls._model_cache()
+        if cache is not None:
+            cache.pop(key)
+
+    def save(self, *args, **kwargs):
+        ret = super().save(*args, **kwargs)
+        self._remember()
+        return ret
+
+    def update(self, *args, **kwargs):
+        ret = super().update(*args, **kwargs)
+        self._remember()
+        return ret
+
+    def delete(self, *args, **kwargs):
+        ret = super().delete(*args, **kwargs)
+        type(self)._forget(self.pk)
+        return ret
 
     @classmethod
     def _build_key(cls, *components: str) -> str:
@@ -40,7 +166,153 @@ class BaseItem(Model):
             raise ValueError("Don't know type of {}".format(type(cls)))
         return '_'.join([type_str] + list(components))
 
+    # Counter-style updates (ADD and friends) that don't need to see the item first. Model.update
+    # would add a Version condition and turn contention into retries, so the Version is bumped
+    # unconditionally instead, which still makes any concurrent read-modify-write save fail.
+    # condition, when given, must hold as well as the item existing.
     @classmethod
-    def list_ordered(cls, *args, **kwargs) -> ResultIterator[Self]:
+    def _counter_update_kwargs(cls, key: str, actions: List[Action], return_values:Optional[str]=None,
+                               condition:Optional[Condition]=None) -> dict:
+        return cls._get_connection().get_operation_kwargs(
+            key, range_key=key,
+            actions=actions + [cls.version.add(1)],
+            condition=cls.pk.exists() if condition is None else cls.pk.exists() & condition,
+            return_values=return_values,
+        )
+
+    # Like delete(), but without needing the item's current Version
+    @classmethod
+    def delete_key(cls, hash_key: str, range_key: str):
+        cls._forget(hash_key)
+        cls._get_connection().delete_item(hash_key, range_key=range_key, condition=cls.pk.exists())
+
+    @classmethod
+    def update_counters(cls, key: str, actions: List[Action], return_values:Optional[str]=None,
+                        condition:Optional[Condition]=None) -> dict:
+        cls._forget(key)
+        kwargs = cls._counter_update_kwargs(key, actions, return_values=return_values, condition=condition)
+        try:
+            return cls._get_connection().connection.dispatch(UPDATE_ITEM, kwargs)
+        except BOTOCORE_EXCEPTIONS as e:
+            raise UpdateError("Failed to update item: {}".format(e), e)
+
+    @classmethod
+    def _type_partition_for(cls, key: str) -> str:
+        type_str = cls.pynamo_discriminator.get_discriminator(cls)
+        shards = get_config().type_index_shards
+        if shards <= 1:
+            return type_str
+        return '{}#{}'.format(type_str, shard_for(key, shards))
+
+    @classmethod
+    def _type_partitions(cls) -> List[str]:
         type_str = cls.pynamo_discriminator.get_discriminator(cls)
-        return cls.type_ordered_index.query(type_str, *args, **kwargs)
+        config = get_config()
+        if config.type_index_shards <= 1:
+            return [type_str]
+        partitions = ['{}#{}'.format(type_str, n) for n in range(config.type_index_shards)]
+        # Items written before sharding stay under the bare type until backfilled
+        if config.type_index_read_legacy:
+            partitions.append(type_str)
+        return partitions
+
+    @classmethod
+    def _query_type_partition(cls, partition: str, index: GlobalSecondaryIndex, **kwargs) -> dict:
+        discriminator = cls._get_discriminator_attribute()
+        return cls._get_connection().query(
+            partition,
+            filter_condition=discriminator.is_in(*discriminator.get_registered_subclasses(cls)),
+            index_name=index.Meta.index_name,
+            **kwargs,
+        )
+
+    @classmethod
+    def _list_ordered_sharded(cls, partitions: List[str], index: GlobalSecondaryIndex, limit:Optional[int]=None,
+                              last_evaluated_key:Optional[dict]=None, scan_index_forward:Optional[bool]=None,
+                              attributes_to_get:Optional[Sequence[str]]=None, range_key_condition:Optional[Condition]=None,
+                              map_fn=lambda item: item) -> MergedQuery:
+        if attributes_to_get is not None:
+            attributes_to_get = list(set(attributes_to_get) | set(INDEX_KEY_ATTRIBUTES))
+
+        def _query_page(partition: str, start_key: Optional[dict]) -> dict:
+            return cls._query_type_partition(
+                partition, index,
+                range_key_condition=range_key_condition,
+                exclusive_start_key=start_key,
+                scan_index_forward=scan_index_forward,
+                limit=limit,
+                attributes_to_get=attributes_to_get,
+            )
+        return MergedQuery(_query_page, partitions, last_evaluated_key, scan_index_forward, limit, map_fn=map_fn)
+
+    @classmethod
+    def list_ordered(cls, *args, **kwargs) -> Union[ResultIterator[Self], MergedQuery]:
+        partitions = cls._type_partitions()
+        if len(partitions) == 1:
+            check_unsharded_key(kwargs.get('last_evaluated_key'))
+            return cls.type_ordered_index.query(partitions[0], *args, **kwargs)
+        if args:
+            raise TypeError("Sharded list_ordered only takes keyword arguments")
+        return cls._list_ordered_sharded(partitions, cls.type_ordered_index, map_fn=cls.from_raw_data, **kwargs)
+
+    # Like list_ordered, but items are left in DynamoDB wire format rather than built into models.
+    # Follows pages until limit is reached (or to the end without one), like ResultIterator does.
+    @classmethod
+    def list_ordered_raw(cls, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None,
+                         scan_index_forward:Optional[bool]=None, attributes_to_get:Optional[Sequence[str]]=None,
+                         index:Optional[GlobalSecondaryIndex]=None, range_key_condition:Optional[Condition]=None) -> dict:
+        index = index or cls.type_ordered_index
+        partitions = cls._type_partitions()
+        if len(partitions) > 1:
+            merged = cls._list_ordered_sharded(
+                partitions, index, limit=limit, last_evaluated_key=last_evaluated_key,
+                scan_index_forward=scan_index_forward, attributes_to_get=attributes_to_get,
+                range_key_condition=range_key_condition)
+            return {'Items': list(merged), 'LastEvaluatedKey': merged.last_evaluated_key}
+
+        check_unsharded_key(last_evaluated_key)
+        return _query_pages_raw(
+            lambda start_key, page_limit: cls._query_type_partition(
+                partitions[0], index,
+                range_key_condition=range_key_condition,
+                exclusive_start_key=start_key,
+                scan_index_forward=scan_index_forward,
+                limit=page_limit,
+                attributes_to_get=None if attributes_to_get is None else list(attributes_to_get),
+            ), limit, last_evaluated_key)
+
+    # Every item sharing a hash key (on the table, or on index if given) whatever its type, in wire format.
+    # Single-table "item collections" like an event and its bookings come back in one query.
+    @classmethod
+    def query_collection_raw(cls, hash_key:str, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None,
+                             scan_index_forward:Optional[bool]=None, index:Optional[GlobalSecondaryIndex]=None) -> dict:
+        return _query_pages_raw(
+            lambda start_key, page_limit: cls._get_connection().query(
+                hash_key,
+                index_name=None if index is None else index.Meta.index_name,
+                exclusive_start_key=start_key,
+                scan_index_forward=scan_index_forward,
+                limit=page_limit,
+            ), limit, last_evaluated_key)
+
+class CounterTransactWrite(TransactWrite):
+    def __init__(self, **kwargs):
+        super().__init__(connection=BaseItem._get_connection().connection, **kwargs)
+        self._written_keys: List[tuple] = []
+
+    def update_counters(self, model_cls: Type[BaseItem], key: str, actions: List[Action],
+                        condition:Optional[Condition]=None):
+        self._update_items.append(model_cls._counter_update_kwargs(key, actions, condition=condition))
+        self._written_keys.append((model_cls, key))
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            for model_cls, key in self._written_keys:
+                model_cls._forget(key)
+
+    # Like delete(), but without needing the item's current Version
+    def delete_key(self, model_cls: Type[BaseItem], hash_key: str, range_key: str):
+        self._delete_items.append(model_cls._get_connection().get_operation_kwargs(
+            hash_key, range_key=range_key, condition=model_cls.pk.exists()))
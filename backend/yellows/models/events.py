@@ -1,13 +1,16 @@
 from datetime import datetime
+from typing import Optional, Sequence
 from typing_extensions import Self
 
 from pynamodb.attributes import BooleanAttribute, NumberAttribute, UTCDateTimeAttribute, UnicodeAttribute
 from pynamodb.pagination import ResultIterator
 
-from yellows.models.base import BaseItem
+from yellows.config import get_config
+from yellows.models.base import BaseItem, CounterTransactWrite
 from yellows.models.users import User
 
 class Event(BaseItem, discriminator="EVENT"):
+    cache_ttl_seconds = 60
     short_name = UnicodeAttribute(attr_name="ShortName")
     long_name = UnicodeAttribute(attr_name="LongName")
     starts_at = UTCDateTimeAttribute(attr_name="StartsAt")
@@ -25,7 +28,7 @@ class Event(BaseItem, discriminator="EVENT"):
             long_name=long_name,
             starts_at=starts_at,
             ends_at=ends_at,
-            type_='EVENT',
+            type_=cls._type_partition_for(key),
             index_sort_order=ordering,
         )
 
@@ -34,13 +37,38 @@ class Event(BaseItem, discriminator="EVENT"):
         key = cls._build_key(short_name)
         return cls(key, sk=key)
 
+    def _expected_index_sort_order(self) -> float:
+        return self.starts_at.timestamp()
+
+    @classmethod
+    def list_starting_raw(cls, starts_from:Optional[datetime]=None, starts_to:Optional[datetime]=None,
+                          limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None,
+                          scan_index_forward:Optional[bool]=None, attributes_to_get:Optional[Sequence[str]]=None) -> dict:
+        # index_sort_order is the start timestamp (see create), so the window is a key condition
+        condition = None
+        if starts_from is not None and starts_to is not None:
+            condition = cls.index_sort_order.between(starts_from.timestamp(), starts_to.timestamp())
+        elif starts_from is not None:
+            condition = cls.index_sort_order >= starts_from.timestamp()
+        elif starts_to is not None:
+            condition = cls.index_sort_order <= starts_to.timestamp()
+        return cls.list_ordered_raw(
+            limit=limit, last_evaluated_key=last_evaluated_key, scan_index_forward=scan_index_forward,
+            attributes_to_get=attributes_to_get, range_key_condition=condition)
+
+    # The event comes first (EVENT_ sorts before USER_), followed by its bookings
+    @classmethod
+    def list_with_bookings_raw(cls, short_name:str, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None) -> dict:
+        return cls.query_collection_raw(cls._build_key(short_name), limit=limit, last_evaluated_key=last_evaluated_key)
+
     @classmethod
     def get_by_short_name(cls, short_name:str, consistent_read:bool=False) -> Self:
         key = cls._build_key(short_name)
-        return cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+        return cls._get_cached(key, consistent_read=consistent_read)
 
 
 class EventBooking(BaseItem, discriminator='EVENTBOOKING'):
+    root_item = False
     user_nick_name = UnicodeAttribute(attr_name="UserNickName")
     user_full_name = UnicodeAttribute(attr_name="UserFullName")
     event_short_name = UnicodeAttribute(attr_name="EventShortName")
@@ -70,3 +98,29 @@ class EventBooking(BaseItem, discriminator='EVENTBOOKING'):
     @classmethod
     def list_bookings_for_event(cls, event:Event) -> ResultIterator[Self]:
         return cls.query(event.pk, range_key_condition=cls.sk.startswith("USER_"))
+
+    # Writes the booking and bumps both counters in one transaction, without reading either item.
+    # Raises TransactWriteError if the booking already exists or the event or user doesn't.
+    # With STREAM_COUNTERS the counters are left to yellows.stream_handler, and a plain
+    # conditional put raises PutError instead.
+    @classmethod
+    def book(cls, event:Event, user:User, eta:str, etd:str) -> Self:
+        booking = cls.create(event, user, eta, etd)
+        if get_config().stream_counters:
+            booking.save(condition=cls.pk.does_not_exist())
+            return booking
+        with CounterTransactWrite() as transaction:
+            transaction.save(booking, condition=cls.pk.does_not_exist())
+            transaction.update_counters(Event, event.pk, [Event.attendee_count.add(1)])
+            transaction.update_counters(User, user.pk, [User.event_count.add(1)])
+        return booking
+
+    @classmethod
+    def cancel(cls, event:Event, user:User):
+        if get_config().stream_counters:
+            cls.delete_key(event.pk, user.pk)
+            return
+        with CounterTransactWrite() as transaction:
+            transaction.delete_key(cls, event.pk, user.pk)
+            transaction.update_counters(Event, event.pk, [Event.attendee_count.add(-1)])
+            transaction.update_counters(User, user.pk, [User.event_count.add(-1)])
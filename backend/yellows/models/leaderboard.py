@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+from typing_extensions import Self
+
+from pynamodb.attributes import BinaryAttribute, NumberAttribute, UnicodeAttribute, UTCDateTimeAttribute
+from yellows.models.base import BaseItem
+
+# A leaderboard snapshot is a compressed blob split over LeaderboardChunk items (one item
+# collection per build), plus the LeaderboardSnapshot item naming the live generation and the
+# build that wrote it. Chunks are written before the snapshot item is switched over, so readers
+# never see half of one, and overlapping rebuilds of a generation never share chunk keys.
+# Full names go in a separate set of chunks, as only search needs them.
+
+# Binary values count against the 400 KB item limit at their raw length, less some room here for
+# the keys and other attributes
+ITEM_LIMIT_BYTES = 400 * 1024
+CHUNK_BYTES = ITEM_LIMIT_BYTES - 4 * 1024
+NAMES_PART = 'NAMES'
+
+class LeaderboardSnapshot(BaseItem, discriminator="LEADERBOARD"):
+    generation = NumberAttribute(attr_name='Generation')
+    chunk_count = NumberAttribute(attr_name='ChunkCount')
+    entry_count = NumberAttribute(attr_name='EntryCount')
+    built_at = UTCDateTimeAttribute(attr_name='BuiltAt')
+    # None for snapshots from before names were split out of the rank blob
+    names_chunk_count = NumberAttribute(attr_name='NamesChunkCount', null=True)
+    # None for snapshots from before chunks were keyed by build
+    build_id = UnicodeAttribute(attr_name='BuildId', null=True)
+
+    @classmethod
+    def _key(cls) -> str:
+        return cls._build_key('CURRENT')
+
+    @classmethod
+    def get_current(cls, consistent_read:bool=False) -> Self:
+        key = cls._key()
+        return cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+
+    @classmethod
+    def create(cls, generation:int, chunk_count:int, entry_count:int, names_chunk_count:Optional[int]=None,
+               build_id:Optional[str]=None) -> Self:
+        key = cls._key()
+        return cls(
+            key, sk=key,
+            generation=generation,
+            chunk_count=chunk_count,
+            entry_count=entry_count,
+            names_chunk_count=names_chunk_count,
+            build_id=build_id,
+            built_at=datetime.now(timezone.utc),
+        )
+
+class LeaderboardChunk(BaseItem, discriminator="LEADERBOARDCHUNK"):
+    root_item = False
+    data = BinaryAttribute(attr_name='Data')
+
+    # Each part of a build gets its own collection. Without a build id this is the layout older
+    # snapshots were written with.
+    @classmethod
+    def _collection(cls, generation:int, part:Optional[str], build_id:Optional[str]) -> List[str]:
+        collection = [str(generation)]
+        if build_id is not None:
+            collection.append(build_id)
+        if part is not None:
+            collection.append(part)
+        return collection
+
+    @classmethod
+    def create(cls, generation:int, index:int, data:bytes, part:Optional[str]=None, build_id:Optional[str]=None) -> Self:
+        collection = cls._collection(generation, part, build_id)
+        return cls(
+            cls._build_key(*collection),
+            sk=cls._build_key(*collection, '{:04d}'.format(index)),
+            data=data,
+        )
+
+    @classmethod
+    def write_blob(cls, generation:int, blob:bytes, part:Optional[str]=None, build_id:Optional[str]=None) -> int:
+        chunks = [blob[i:i + CHUNK_BYTES] for i in range(0, len(blob), CHUNK_BYTES)] or [b'']
+        with cls.batch_write() as batch:
+            for i, data in enumerate(chunks):
+                batch.save(cls.create(generation, i, data, part, build_id))
+        return len(chunks)
+
+    @classmethod
+    def read_blob(cls, generation:int, chunk_count:int, part:Optional[str]=None, build_id:Optional[str]=None) -> bytes:
+        collection = cls._collection(generation, part, build_id)
+        chunks: List[LeaderboardChunk] = [c for c in cls.query(cls._build_key(*collection), consistent_read=True)]
+        if len(chunks) != chunk_count:
+            raise ValueError("Leaderboard generation {} has {} of {} chunks".format(generation, len(chunks), chunk_count))
+        return b''.join(c.data for c in chunks)
+
+    @classmethod
+    def delete_build(cls, generation:int, build_id:Optional[str]):
+        for part in (None, NAMES_PART):
+            with cls.batch_write() as batch:
+                for chunk in cls.query(cls._build_key(*cls._collection(generation, part, build_id))):
+                    batch.delete(chunk)
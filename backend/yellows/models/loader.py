@@ -0,0 +1,105 @@
+import random
+import time
+from typing import Dict, Generic, Iterable, List, Optional, Tuple, Type, TypeVar
+
+from pynamodb.exceptions import GetError
+
+from yellows.models.base import BaseItem
+
+# DataLoader-style batching for point lookups: ask for any number of items (of any model) via
+# load(), and the first get() fetches everything outstanding with BatchGetItem. Root items are
+# served from the model cache where there's one, and whatever is fetched refreshes it.
+
+BATCH_GET_LIMIT = 100
+MAX_ATTEMPTS = 8
+BASE_BACKOFF_SECONDS = 0.05
+MAX_BACKOFF_SECONDS = 2.0
+
+T = TypeVar('T', bound=BaseItem)
+Key = Tuple[str, str]
+
+class LoadRequest(Generic[T]):
+    def __init__(self, loader: 'BatchLoader', key: Key, cached: Optional[T]=None):
+        self._loader = loader
+        self.key = key
+        self._resolved = cached is not None
+        self._value: Optional[T] = cached
+
+    def get(self) -> Optional[T]:
+        if not self._resolved:
+            self._value = self._loader._resolve(self.key)  # type: ignore
+            self._resolved = True
+        return self._value
+
+class BatchLoader:
+    def __init__(self, memoize: bool = True):
+        self.memoize = memoize
+        self._pending: Dict[Key, None] = {}
+        self._results: Dict[Key, Optional[BaseItem]] = {}
+
+    def load(self, model_cls: Type[T], *components: str) -> LoadRequest[T]:
+        if not model_cls.root_item:
+            raise TypeError("{} items aren't keyed by PK alone, use load_key".format(model_cls.__name__))
+        key = model_cls._build_key(*components)
+        if not (self.memoize and (key, key) in self._results):
+            cached = model_cls._from_cache(key)
+            if cached is not None:
+                return LoadRequest(self, (key, key), cached)
+        return self.load_key(key, key)
+
+    def load_key(self, pk: str, sk: str) -> LoadRequest:
+        key = (pk, sk)
+        if not (self.memoize and key in self._results):
+            self._pending[key] = None
+        return LoadRequest(self, key)
+
+    def load_many(self, model_cls: Type[T], components: Iterable[str]) -> List[Optional[T]]:
+        requests = [self.load(model_cls, c) for c in components]
+        return [r.get() for r in requests]
+
+    def dispatch(self):
+        keys = [k for k in self._pending]
+        self._pending.clear()
+        for i in range(0, len(keys), BATCH_GET_LIMIT):
+            self._fetch(keys[i:i + BATCH_GET_LIMIT])
+
+    def _fetch(self, keys: List[Key]):
+        table_name = BaseItem.Meta.table_name
+        hash_key_name = BaseItem._hash_key_attribute().attr_name
+        range_key_name = BaseItem._range_key_attribute().attr_name
+        for key in keys:
+            self._results[key] = None
+        request_keys = [{hash_key_name: pk, range_key_name: sk} for pk, sk in keys]
+        attempt = 0
+        while request_keys:
+            data = BaseItem._get_connection().batch_get_item(request_keys)
+            for raw_item in data.get('Responses', {}).get(table_name, []):
+                item = BaseItem.from_raw_data(raw_item)
+                item._remember()
+                self._results[(item.pk, item.sk)] = item
+            request_keys = data.get('UnprocessedKeys', {}).get(table_name, {}).get('Keys')
+            if request_keys:
+                attempt += 1
+                if attempt >= MAX_ATTEMPTS:
+                    raise GetError("{} keys still unprocessed after {} attempts".format(len(request_keys), attempt))
+                # Full jitter, so concurrent containers being throttled don't retry in lockstep
+                time.sleep(random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt))))
+
+    def _resolve(self, key: Key) -> Optional[BaseItem]:
+        if key in self._pending or key not in self._results:
+            self._pending[key] = None
+            self.dispatch()
+        if self.memoize:
+            return self._results[key]
+        return self._results.pop(key, None)
+
+_loader = None
+def get_loader() -> BatchLoader:
+    global _loader
+    if _loader is None:
+        _loader = BatchLoader()
+    return _loader
+
+def reset_loader():
+    global _loader
+    _loader = None
@@ -6,6 +6,7 @@ from pynamodb.attributes import ListAttribute, UTCDateTimeAttribute, UnicodeAttr
 from yellows.models.base import BaseItem
 
 class Login(BaseItem, discriminator="LOGIN"):
+    cache_ttl_seconds = 30
     login_id = UnicodeAttribute(attr_name='LoginId')
     last_login = UTCDateTimeAttribute(attr_name="LastLogin", null=True)
     scope = ListAttribute(attr_name="Scope", of=UnicodeAttribute)
@@ -22,7 +23,7 @@ class Login(BaseItem, discriminator="LOGIN"):
     @classmethod
     def get_by_login_id(cls, login_id:str, consistent_read:bool=False) -> Optional[Self]:
         key = cls._build_key(login_id)
-        return cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+        return cls._get_cached(key, consistent_read=consistent_read)
 
     def update_last_login(self):
         self.update([
@@ -0,0 +1,32 @@
+from typing import Optional
+from typing_extensions import Self
+
+from pynamodb.attributes import BooleanAttribute, JSONAttribute, NumberAttribute
+from yellows.models.base import BaseItem
+
+# Where one scan segment of a migration job has got to, so a stopped job carries on from
+# its last page instead of rescanning. One item collection per job.
+class MigrationCheckpoint(BaseItem, discriminator="MIGRATION"):
+    root_item = False
+    total_segments = NumberAttribute(attr_name='TotalSegments')
+    last_evaluated_key = JSONAttribute(attr_name='LastEvaluatedKey', null=True)
+    done = BooleanAttribute(attr_name='Done')
+    counts = JSONAttribute(attr_name='Counts')
+
+    @classmethod
+    def create(cls, job:str, segment:int, total_segments:int) -> Self:
+        return cls(
+            cls._build_key(job),
+            sk=cls._build_key(job, '{:04d}'.format(segment)),
+            total_segments=total_segments,
+            last_evaluated_key=None,
+            done=False,
+            counts={},
+        )
+
+    @classmethod
+    def get_for(cls, job:str, segment:int) -> Optional[Self]:
+        try:
+            return cls.get(cls._build_key(job), cls._build_key(job, '{:04d}'.format(segment)), consistent_read=True)
+        except cls.DoesNotExist:
+            return None
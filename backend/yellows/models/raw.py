@@ -0,0 +1,61 @@
+from typing import Any, Callable, Dict, Optional
+
+from pynamodb.attributes import Attribute, BooleanAttribute, NumberAttribute, UTCDateTimeAttribute, UnicodeAttribute
+
+# Translators that go straight from DynamoDB wire-format items ({'AttrName': {'S': ...}}) to
+# response dicts, for list endpoints where building a full model per item dominates CPU time.
+
+def _decode_string(value: dict) -> Optional[str]:
+    return value.get('S')
+
+def _decode_number(value: dict) -> Any:
+    n = value.get('N')
+    if n is None:
+        return None
+    try:
+        return int(n)
+    except ValueError:
+        return float(n)
+
+def _decode_bool(value: dict) -> Optional[bool]:
+    return value.get('BOOL')
+
+def _decode_utc_datetime_iso(value: dict) -> Optional[str]:
+    # Stored as '%Y-%m-%dT%H:%M:%S.%f+0000', rewrite to what datetime.isoformat() would give
+    s = value.get('S')
+    if s is None:
+        return None
+    s = s[:-5] + '+00:00'
+    if s[19:26] == '.000000':
+        s = s[:19] + s[26:]
+    return s
+
+_DECODERS = {
+    UnicodeAttribute: _decode_string,
+    NumberAttribute: _decode_number,
+    BooleanAttribute: _decode_bool,
+    UTCDateTimeAttribute: _decode_utc_datetime_iso,
+}
+
+def _decoder_for(attribute: Attribute) -> Callable[[dict], Any]:
+    for attribute_type in type(attribute).__mro__:
+        decoder = _DECODERS.get(attribute_type)
+        if decoder is not None:
+            return decoder
+    raise TypeError("No raw decoder for {}".format(type(attribute).__name__))
+
+class RawTranslator:
+    def __init__(self, fields: Dict[str, Attribute]):
+        self._plan = tuple((key, attribute.attr_name, _decoder_for(attribute)) for key, attribute in fields.items())
+        # What to project when querying for this translator, missing attributes translate to None
+        self.attr_names = [attr_name for _, attr_name, _ in self._plan]
+
+    def __call__(self, item: dict) -> dict:
+        ret = {}
+        for key, attr_name, decode in self._plan:
+            value = item.get(attr_name)
+            ret[key] = None if value is None else decode(value)
+        return ret
+
+def compile_translator(fields: Dict[str, Attribute]) -> RawTranslator:
+    return RawTranslator(fields)
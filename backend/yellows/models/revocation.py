@@ -0,0 +1,50 @@
+from typing_extensions import Self
+
+from pynamodb.attributes import MapAttribute, NumberAttribute
+from yellows.models.base import BaseItem
+
+class Revocation(BaseItem, discriminator="REVOCATION"):
+    global_generation = NumberAttribute(attr_name="GlobalGeneration")
+    login_generations = MapAttribute(attr_name="LoginGenerations")
+
+    @classmethod
+    def create(cls) -> Self:
+        key = cls._build_key('GLOBAL')
+        return cls(
+            key, sk=key,
+            global_generation=0,
+            login_generations={},
+        )
+
+    @classmethod
+    def get_current(cls, consistent_read:bool=False) -> Self:
+        key = cls._build_key('GLOBAL')
+        try:
+            return cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+        except cls.DoesNotExist:
+            return cls.create()
+
+    @classmethod
+    def _get_or_create(cls) -> Self:
+        revocation = cls.get_current(consistent_read=True)
+        if revocation.version is None:
+            revocation.save()
+        return revocation
+
+    def login_generation(self, login_id:str) -> int:
+        return int(self.login_generations.as_dict().get(login_id, 0))
+
+    @classmethod
+    def revoke_all(cls):
+        revocation = cls._get_or_create()
+        revocation.update([
+            Revocation.global_generation.add(1),
+        ])
+
+    @classmethod
+    def revoke_login(cls, login_id:str):
+        revocation = cls._get_or_create()
+        generation = revocation.login_generation(login_id) + 1
+        revocation.update([
+            Revocation.login_generations[login_id].set(generation),
+        ])
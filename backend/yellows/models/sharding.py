@@ -0,0 +1,105 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from decimal import Decimal
+import heapq
+from typing import Any, Callable, Iterator, List, Optional
+import zlib
+
+# Helpers for spreading a TypeIndexOrder partition ('USER') over several ('USER#0'..'USER#n-1')
+# and reading them back as one ordered stream. The sort key and table keys are always
+# projected so items can be merged and paging can resume per shard.
+
+INDEX_KEY_ATTRIBUTES = ['PK', 'SK', 'Type', 'IndexSortOrder']
+SHARDS_KEY = 'Shards'
+_SHARD_DONE = 'done'
+
+# Partitions are queried from here, threads are only started as they're first needed
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='shard-query')
+
+# A pagination key that can't resume this query, e.g. one issued under a different shard layout
+class PaginationKeyError(ValueError):
+    pass
+
+QueryPage = Callable[[str, Optional[dict]], dict]
+
+def shard_for(key: str, shards: int) -> int:
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+# For the single partition case, which pages with plain DynamoDB keys
+def check_unsharded_key(last_evaluated_key: Optional[dict]):
+    if last_evaluated_key is not None and SHARDS_KEY in last_evaluated_key:
+        raise PaginationKeyError("Pagination key doesn't match the current shard layout")
+
+def _sort_value(item: dict) -> Decimal:
+    # Decimal, not float, as user sort orders use more bits than a double can hold
+    return Decimal(item['IndexSortOrder']['N'])
+
+def _key_of(item: dict) -> dict:
+    return {k: item[k] for k in INDEX_KEY_ATTRIBUTES}
+
+class _ShardStream:
+    def __init__(self, index: int, partition: str, query_page: QueryPage, first_page: 'Future[dict]'):
+        self.index = index
+        self.partition = partition
+        self._query_page = query_page
+        self._first_page = first_page
+        self.finished = False
+        self.yielded = 0
+
+    def __iter__(self):
+        resp = self._first_page.result()
+        while True:
+            for item in resp.get('Items', []):
+                self.yielded += 1
+                yield (_sort_value(item), self.index, item)
+            last_evaluated_key = resp.get('LastEvaluatedKey')
+            if last_evaluated_key is None:
+                self.finished = True
+                return
+            resp = self._query_page(self.partition, last_evaluated_key)
+
+class MergedQuery:
+    def __init__(self, query_page: QueryPage, partitions: List[str], last_evaluated_key: Optional[dict],
+                 scan_index_forward: Optional[bool], limit: Optional[int], map_fn: Callable[[dict], Any]=lambda item: item):
+        if last_evaluated_key is None:
+            positions: List[Any] = [None] * len(partitions)
+        else:
+            positions = last_evaluated_key.get(SHARDS_KEY)
+            if not isinstance(positions, list) or len(positions) != len(partitions):
+                raise PaginationKeyError("Pagination key doesn't match the current shard layout")
+        self._positions = positions
+        self._limit = limit
+        self._reverse = scan_index_forward is False
+        self._map_fn = map_fn
+        self._consumed = [0] * len(partitions)
+        self._streams: List[Optional[_ShardStream]] = []
+        for i, partition in enumerate(partitions):
+            if positions[i] == _SHARD_DONE:
+                self._streams.append(None)
+                continue
+            first_page = _executor.submit(query_page, partition, positions[i])
+            self._streams.append(_ShardStream(i, partition, query_page, first_page))
+
+    def __iter__(self) -> Iterator[Any]:
+        count = 0
+        if self._limit is not None and self._limit <= 0:
+            return
+        merged = heapq.merge(*(s for s in self._streams if s is not None), reverse=self._reverse)
+        for _, index, item in merged:
+            self._positions[index] = _key_of(item)
+            self._consumed[index] += 1
+            count += 1
+            yield self._map_fn(item)
+            if self._limit is not None and count >= self._limit:
+                return
+
+    @property
+    def last_evaluated_key(self) -> Optional[dict]:
+        positions = []
+        for i, stream in enumerate(self._streams):
+            if stream is None or (stream.finished and self._consumed[i] == stream.yielded):
+                positions.append(_SHARD_DONE)
+            else:
+                positions.append(self._positions[i])
+        if all(p == _SHARD_DONE for p in positions):
+            return None
+        return {SHARDS_KEY: positions}
@@ -1,12 +1,28 @@
+from typing import Optional, Sequence
 from typing_extensions import Self
 from pynamodb.attributes import NumberAttribute, UnicodeAttribute
+from pynamodb.constants import UPDATED_NEW
+from pynamodb.expressions.condition import Condition
+from pynamodb.indexes import GlobalSecondaryIndex, IncludeProjection
+from yellows.config import get_config
 from yellows.models.base import BaseItem
 
+# Same keys as TypeIndexOrder but only projects what the leaderboard shows (plus the
+# discriminator, which list queries filter on), so reading it costs less as User items grow
+class LeaderboardIndex(GlobalSecondaryIndex):
+    class Meta:
+        index_name = 'LeaderboardIndex'
+        projection = IncludeProjection(['NickName', 'FullName', 'EventCount', 'AchievementScore', '__PDB_DISCRIM'])
+    type_ = UnicodeAttribute(attr_name="Type", hash_key=True)
+    index_sort_order = NumberAttribute(attr_name="IndexSortOrder", range_key=True)
+
 class User(BaseItem, discriminator="USER"):
+    cache_ttl_seconds = 30
     _nick_name = UnicodeAttribute(attr_name='NickName')
     full_name = UnicodeAttribute(attr_name='FullName')
     event_count = NumberAttribute(attr_name='EventCount')
     _achievement_score = NumberAttribute(attr_name='AchievementScore')
+    leaderboard_index = LeaderboardIndex()
 
     @property
     def nick_name(self) -> str:
@@ -20,15 +36,63 @@ class User(BaseItem, discriminator="USER"):
         return int(self._achievement_score)
     achievement_score = property(_get_achievement_score, _set_achievement_score)
 
+    # score * 10^27 + the first 11 bytes of the nick as a big-endian number (< 2^88 < 10^27), so
+    # scores order first and nicks break ties. Stays within DynamoDB's 38 significant digits for
+    # scores up to 10^11 either side of zero, where the previous 128-bit packing lost its low bits.
+    _SORT_ORDER_NICK_SLICE = 11
+    # The sort order moves by exactly this much per point, which add_achievement_score relies on
+    _SORT_ORDER_SCORE_STEP = 10 ** 27
+    _SORT_ORDER_MAX_SCORE = 10 ** 11 - 1
+
     @classmethod
     def _calculate_sort_order(cls, achievement_score:float, nick_name:str) -> int:
         achievement_score = int(achievement_score)
-        nick_slice = 12
-        name_bytes = nick_name.encode('utf-8')[:nick_slice]
-        bits = (achievement_score & 0xffffffff) << (nick_slice * 8)
-        for i, byte in enumerate(name_bytes):
-            bits |= (byte << ((nick_slice - i - 1) * 8))
-        return bits
+        if abs(achievement_score) > cls._SORT_ORDER_MAX_SCORE:
+            raise ValueError("Achievement score {} can't be ordered".format(achievement_score))
+        name_bytes = nick_name.encode('utf-8')[:cls._SORT_ORDER_NICK_SLICE]
+        tie_breaker = int.from_bytes(name_bytes.ljust(cls._SORT_ORDER_NICK_SLICE, b'\0'), 'big')
+        return achievement_score * cls._SORT_ORDER_SCORE_STEP + tie_breaker
+
+    # Key condition for users scoring between min_score and max_score inclusive, either end open
+    @classmethod
+    def score_range_condition(cls, min_score:Optional[int]=None, max_score:Optional[int]=None) -> Optional[Condition]:
+        if min_score is not None and max_score is not None and min_score > max_score:
+            raise ValueError("min_score is above max_score")
+        for score in (min_score, max_score):
+            if score is not None and abs(int(score)) > cls._SORT_ORDER_MAX_SCORE:
+                raise ValueError("Achievement score {} can't be ordered".format(score))
+        low = None if min_score is None else int(min_score) * cls._SORT_ORDER_SCORE_STEP
+        high = None if max_score is None else (int(max_score) + 1) * cls._SORT_ORDER_SCORE_STEP - 1
+        if low is not None and high is not None:
+            return cls.index_sort_order.between(low, high)
+        if low is not None:
+            return cls.index_sort_order >= low
+        if high is not None:
+            return cls.index_sort_order <= high
+        return None
+
+    # Adjusts the score and the sort order together with ADD, so there's no read and no version
+    # conflict however many of these race. Returns the new score. Raises UpdateError, changing
+    # nothing, if the user is missing or the score would leave the range the sort order encodes.
+    @classmethod
+    def add_achievement_score(cls, nick_name:str, delta:int) -> int:
+        delta = int(delta)
+        if abs(delta) > 2 * cls._SORT_ORDER_MAX_SCORE:
+            raise ValueError("Achievement score change {} can't be ordered".format(delta))
+        condition = None
+        if delta > 0:
+            condition = cls._achievement_score <= cls._SORT_ORDER_MAX_SCORE - delta
+        elif delta < 0:
+            condition = cls._achievement_score >= -cls._SORT_ORDER_MAX_SCORE - delta
+        resp = cls.update_counters(cls._build_key(nick_name), [
+            cls._achievement_score.add(delta),
+            cls.index_sort_order.add(delta * cls._SORT_ORDER_SCORE_STEP),
+        ], return_values=UPDATED_NEW, condition=condition)
+        score = int(resp['Attributes'][cls._achievement_score.attr_name]['N'])
+        # Imported here as yellows.leaderboard builds on the models
+        from yellows.leaderboard import get_leaderboard_cache
+        get_leaderboard_cache().patch_score(nick_name, score)
+        return score
 
     @classmethod
     def create(cls, nick_name:str, full_name:str) -> Self:
@@ -39,7 +103,7 @@ class User(BaseItem, discriminator="USER"):
             full_name=full_name,
             event_count=0,
             _achievement_score=0,
-            type_='USER',
+            type_=cls._type_partition_for(key),
             index_sort_order=cls._calculate_sort_order(0, nick_name),
         )
 
@@ -49,9 +113,30 @@ class User(BaseItem, discriminator="USER"):
         return cls(key, sk=key)
 
     def _fix_sort_order(self):
-        self.index_sort_order = self._calculate_sort_order(self.achievement_score, self.nick_name)
+        self.index_sort_order = self._expected_index_sort_order()
+
+    def _expected_index_sort_order(self) -> int:
+        return self._calculate_sort_order(self.achievement_score, self.nick_name)
 
     @classmethod
     def get_by_nick_name(cls, nick_name:str, consistent_read:bool=False) -> Self:
         key = cls._build_key(nick_name)
-        return cls.get(hash_key=key, range_key=key, consistent_read=consistent_read)
+        return cls._get_cached(key, consistent_read=consistent_read)
+
+    @classmethod
+    def list_leaderboard_raw(cls, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None,
+                             attributes_to_get:Optional[Sequence[str]]=None,
+                             min_score:Optional[int]=None, max_score:Optional[int]=None) -> dict:
+        index = cls.leaderboard_index if get_config().use_leaderboard_index else cls.type_ordered_index
+        return cls.list_ordered_raw(
+            limit=limit, last_evaluated_key=last_evaluated_key, scan_index_forward=False,
+            attributes_to_get=attributes_to_get, index=index,
+            range_key_condition=cls.score_range_condition(min_score, max_score))
+
+    # Over InvertedIndex a user's collection is their bookings (PK EVENT_...) and the user itself,
+    # read backwards so the user comes first
+    @classmethod
+    def list_with_bookings_raw(cls, nick_name:str, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None) -> dict:
+        return cls.query_collection_raw(
+            cls._build_key(nick_name), limit=limit, last_evaluated_key=last_evaluated_key,
+            scan_index_forward=False, index=cls.inverted_index)
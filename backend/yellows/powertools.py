@@ -2,8 +2,10 @@ from functools import wraps
 from aws_lambda_powertools.tracing import Tracer
 from aws_lambda_powertools.metrics import Metrics
 
-tracer = Tracer()
-tracer.patch()
+# Only patch the libraries we actually call, patch_all imports every supported library on cold start
+TRACED_MODULES = ('botocore', 'requests')
+
+tracer = Tracer(patch_modules=TRACED_MODULES)
 metrics = Metrics()
 
 def annotate_operation(f):
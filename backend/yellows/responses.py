@@ -0,0 +1,93 @@
+import base64
+import gzip
+import hashlib
+from typing import List, Optional
+
+from yellows.config import get_config
+
+# Post-processing applied to every resolved response in api_handler: strong ETags with
+# If-None-Match revalidation, then content negotiated compression of larger bodies.
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Must match binaryMediaTypes on the API Gateway in infra/lib/yellows-stack.ts. API Gateway only
+# decodes a base64 body for the client when the request's first Accept type is one of them.
+BINARY_MEDIA_TYPES = ('application/json',)
+
+# Case-insensitive lookup in a raw API Gateway event's headers
+def get_header(event: dict, name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+def _accepted_encodings(accept_encoding: str) -> List[str]:
+    ret = []
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and params[2:] in ('0', '0.0', '0.00', '0.000'):
+            continue
+        ret.append(coding.strip().lower())
+    return ret
+
+def _choose_encoding(event: dict) -> Optional[str]:
+    accepted = _accepted_encodings(get_header(event, 'accept-encoding') or '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def _binary_accepted(event: dict) -> bool:
+    accept = get_header(event, 'accept') or ''
+    first = accept.split(',', 1)[0].partition(';')[0].strip().lower()
+    return first in BINARY_MEDIA_TYPES
+
+def _etag_matches(if_none_match: str, digest: str) -> bool:
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        # Each encoding gets its own tag, but all of them describe the same content
+        if tag.strip('"').split('-', 1)[0] == digest:
+            return True
+    return False
+
+def process_response(event: dict, response: dict) -> dict:
+    if event.get('httpMethod') != 'GET' or response.get('statusCode') != 200 \
+            or response.get('isBase64Encoded') or not isinstance(response.get('body'), str):
+        return response
+    headers = response.setdefault('headers', {})
+    if 'Content-Encoding' in headers:
+        return response
+    body = response['body'].encode('utf-8')
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    encoding = None
+    if len(body) >= get_config().compression_min_bytes and _binary_accepted(event):
+        encoding = _choose_encoding(event)
+    headers['ETag'] = '"{}"'.format(digest) if encoding is None else '"{}-{}"'.format(digest, encoding)
+    headers['Vary'] = 'Accept-Encoding'
+
+    if_none_match = get_header(event, 'if-none-match')
+    if if_none_match is not None and _etag_matches(if_none_match, digest):
+        response['statusCode'] = 304
+        response['body'] = ''
+        headers.pop('Content-Type', None)
+        return response
+
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=6)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        response['body'] = base64.b64encode(body).decode('ascii')
+        response['isBase64Encoded'] = True
+    return response
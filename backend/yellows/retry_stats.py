@@ -0,0 +1,81 @@
+from functools import wraps
+import threading
+from aws_lambda_powertools.metrics import Metrics, MetricUnit
+from pynamodb.connection.base import Connection
+
+# Counts retried and throttled AWS calls while serving a request, reset and reported by api_handler
+# next to the DynamoDB stats. boto3 clients passed to instrument_client report both through
+# botocore's retry events. PynamoDB retries inside its own loop, so its retries are counted from the
+# attempts each dispatch sends, and its throttles only when they outlast those retries.
+
+THROTTLING_CODES = frozenset((
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottledException',
+    'TooManyRequestsException', 'ProvisionedThroughputExceededException', 'RequestLimitExceeded',
+    'RequestThrottled',
+))
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.retries = 0
+        self.throttles = 0
+
+    def record(self, retries: int = 0, throttles: int = 0):
+        with self._lock:
+            self.retries += retries
+            self.throttles += throttles
+
+    def add_metrics(self, metrics: Metrics):
+        metrics.add_metric('AwsRetries', MetricUnit.Count, self.retries)
+        metrics.add_metric('AwsThrottles', MetricUnit.Count, self.throttles)
+
+_stats = RetryStats()
+def get_retry_stats() -> RetryStats:
+    return _stats
+
+def _error_code(parsed) -> str:
+    return (parsed or {}).get('Error', {}).get('Code', '')
+
+_attempts = threading.local()
+
+def instrument_client(client):
+    def _needs_retry(response, **kwargs):
+        # Called after every attempt, response is None when the attempt raised instead
+        if response is not None and _error_code(response[1]) in THROTTLING_CODES:
+            _stats.record(throttles=1)
+
+    def _after_call(parsed, **kwargs):
+        _stats.record(retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0))
+
+    def _before_send(**kwargs):
+        # PynamoDB still fires this for each attempt it sends through the client
+        _attempts.count = getattr(_attempts, 'count', 0) + 1
+
+    client.meta.events.register('needs-retry', _needs_retry)
+    client.meta.events.register('after-call', _after_call)
+    client.meta.events.register('before-send', _before_send)
+    return client
+
+_pynamodb_instrumented = False
+def instrument_pynamodb():
+    global _pynamodb_instrumented
+    if _pynamodb_instrumented:
+        return
+    dispatch = Connection.dispatch
+
+    @wraps(dispatch)
+    def _dispatch(self, *args, **kwargs):
+        _attempts.count = 0
+        throttled = False
+        try:
+            return dispatch(self, *args, **kwargs)
+        except Exception as e:
+            throttled = _error_code(getattr(e, 'response', None)) in THROTTLING_CODES
+            raise
+        finally:
+            _stats.record(retries=max(_attempts.count - 1, 0), throttles=int(throttled))
+    Connection.dispatch = _dispatch
+    _pynamodb_instrumented = True
@@ -0,0 +1,219 @@
+from array import array
+from bisect import bisect_left
+import heapq
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+import unicodedata
+from aws_lambda_powertools.logging import Logger
+
+from yellows.cache import TTLCache
+from yellows.leaderboard import Leaderboard, get_leaderboard_cache, load_full_names
+
+logger = Logger()
+
+# Typeahead over nick and full names, built from the leaderboard snapshot already held in
+# memory plus the snapshot's names blob. Sorted name tokens answer prefix queries with a bisect,
+# trigram postings answer "somewhere in the name" queries, so a keystroke never needs a DynamoDB
+# query. Building takes seconds for a big board, so a new snapshot's index is built in the
+# background while the previous one keeps serving.
+
+# Matches come back as exact nick, nick prefix, full name word prefix, then substring of either,
+# each tier in leaderboard order (user ids are assigned in that order)
+
+# Results for recent queries, typeahead repeats the same short prefixes constantly
+_MEMO_SIZE = 1024
+_MEMO_TTL_SECONDS = 3600
+
+def fold(s: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', s.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def _trigrams(s: str) -> List[str]:
+    return [s[i:i + 3] for i in range(len(s) - 2)]
+
+def _prefix_range(tokens: List[Tuple[str, int]], q: str) -> Tuple[int, int]:
+    return bisect_left(tokens, (q, -1)), bisect_left(tokens, (q + '\U0010ffff', -1))
+
+# Sparse table over the user ids of a sorted token list: the smallest id in any range is two
+# lookups, so the best k matches of a prefix cost O(k log k) however many tokens share it.
+class _RangeMin:
+    def __init__(self, values: List[int]):
+        self._values = values
+        levels = [array('I', range(len(values)))]
+        width = 1
+        while width * 2 <= len(values):
+            prev = levels[-1]
+            levels.append(array('I', (
+                prev[i] if values[prev[i]] <= values[prev[i + width]] else prev[i + width]
+                for i in range(len(values) - width * 2 + 1))))
+            width *= 2
+        self._levels = levels
+
+    def _argmin(self, lo: int, hi: int) -> int:
+        level = (hi - lo).bit_length() - 1
+        a = self._levels[level][lo]
+        b = self._levels[level][hi - (1 << level)]
+        return a if self._values[a] <= self._values[b] else b
+
+    def ascending(self, lo: int, hi: int) -> Iterator[int]:
+        heap = []
+        if lo < hi:
+            i = self._argmin(lo, hi)
+            heap.append((self._values[i], i, lo, hi))
+        while heap:
+            value, i, lo, hi = heapq.heappop(heap)
+            yield value
+            for sub_lo, sub_hi in ((lo, i), (i + 1, hi)):
+                if sub_lo < sub_hi:
+                    j = self._argmin(sub_lo, sub_hi)
+                    heapq.heappush(heap, (self._values[j], j, sub_lo, sub_hi))
+
+class UserSearchIndex:
+    def __init__(self, board: Leaderboard, full_names: Dict[str, str]):
+        self.generation = board.generation
+        self._board = board
+        self._full_names = full_names
+        # Users the board gained after this was built are only matched on nick, by a linear scan.
+        # Their ids come after everyone else's, so each tier stays in id order.
+        self._added_seen = len(board.added)
+        self._added_ids: List[int] = []
+        self._nicks = board.nick_names()
+        self._haystacks: List[str] = []
+        nick_tokens: List[Tuple[str, int]] = []
+        word_tokens: List[Tuple[str, int]] = []
+        postings: Dict[str, array] = {}
+        for user_id, nick in enumerate(self._nicks):
+            folded_nick = fold(nick)
+            folded_name = fold(full_names.get(nick, ''))
+            self._haystacks.append(folded_nick + '\0' + folded_name)
+            nick_tokens.append((folded_nick, user_id))
+            word_tokens.extend((word, user_id) for word in set(folded_name.split()))
+            for trigram in set(_trigrams(folded_nick)) | set(_trigrams(folded_name)):
+                postings.setdefault(trigram, array('I')).append(user_id)
+        nick_tokens.sort()
+        word_tokens.sort()
+        self._nick_tokens = nick_tokens
+        self._word_tokens = word_tokens
+        self._nick_ids = _RangeMin([user_id for _, user_id in nick_tokens])
+        self._word_ids = _RangeMin([user_id for _, user_id in word_tokens])
+        self._postings = postings
+        self._memo = TTLCache(_MEMO_TTL_SECONDS, _MEMO_SIZE)
+
+    def _add_new_users(self):
+        added = self._board.added
+        if self._added_seen == len(added):
+            return
+        for nick in added[self._added_seen:]:
+            self._added_ids.append(len(self._nicks))
+            self._nicks.append(nick)
+            self._haystacks.append(fold(nick) + '\0')
+        self._added_seen = len(added)
+        self._memo.clear()
+
+    def _matches(self, q: str, limit: int) -> List[int]:
+        ret: List[int] = []
+        seen = set()
+
+        def take(user_ids):
+            for user_id in user_ids:
+                if user_id not in seen:
+                    seen.add(user_id)
+                    ret.append(user_id)
+                    if len(ret) >= limit:
+                        return
+
+        lo, hi = _prefix_range(self._nick_tokens, q)
+        exact_hi = bisect_left(self._nick_tokens, (q, len(self._nicks)), lo, hi)
+        take(self._nick_ids.ascending(lo, exact_hi))
+        # Added haystacks are just the folded nick and a NUL
+        if len(ret) < limit:
+            take(i for i in self._added_ids if self._haystacks[i] == q + '\0')
+        if len(ret) < limit:
+            take(self._nick_ids.ascending(exact_hi, hi))
+        if len(ret) < limit:
+            take(i for i in self._added_ids if self._haystacks[i].startswith(q))
+        if len(ret) < limit:
+            take(self._word_ids.ascending(*_prefix_range(self._word_tokens, q)))
+        if len(ret) < limit and len(q) >= 3:
+            take(self._substring_matches(q))
+        if len(ret) < limit and len(q) >= 3:
+            take(i for i in self._added_ids if q in self._haystacks[i])
+        return ret
+
+    def _substring_matches(self, q: str) -> Iterator[int]:
+        lists = [self._postings.get(t) for t in set(_trigrams(q))]
+        if any(l is None for l in lists):
+            return
+        # Postings are in id order, so walking the rarest trigram's list yields the best first.
+        # Having every trigram doesn't make them contiguous, so check the names themselves.
+        for user_id in min(lists, key=len):
+            if q in self._haystacks[user_id]:
+                yield user_id
+
+    def search(self, q: str, limit: int) -> List[dict]:
+        q = fold(q).strip()
+        if not q:
+            return []
+        self._add_new_users()
+        memo_key = (q, limit)
+        user_ids = self._memo.get(memo_key)
+        if user_ids is None:
+            user_ids = self._matches(q, limit)
+            self._memo.put(memo_key, user_ids)
+        ret = []
+        for user_id in user_ids:
+            nick = self._nicks[user_id]
+            ret.append({
+                'nick_name': nick,
+                'full_name': self._full_names.get(nick),
+                'achievement_score': self._board.score_of(nick),
+            })
+        return ret
+
+# Follows the leaderboard cache onto each new snapshot. Only a container's very first build
+# blocks, after that the previous index serves until the next one is ready.
+class SearchIndexCache:
+    def __init__(self):
+        self._index: Optional[UserSearchIndex] = None
+        # The board the latest build was for, a failed build waits for the next snapshot
+        self._building_for: Optional[Leaderboard] = None
+        self._lock = threading.Lock()
+        self._first_build_lock = threading.Lock()
+
+    def _build(self, board: Leaderboard) -> UserSearchIndex:
+        return UserSearchIndex(board, load_full_names(board))
+
+    def _background_build(self, board: Leaderboard):
+        try:
+            index = self._build(board)
+            with self._lock:
+                self._index = index
+        except Exception:
+            logger.exception("Search index build failed, keeping previous index")
+
+    def current(self) -> Optional[UserSearchIndex]:
+        board = get_leaderboard_cache().current()
+        if board is None:
+            return None
+        with self._lock:
+            index = self._index
+            if index is not None:
+                if self._building_for is not board:
+                    self._building_for = board
+                    threading.Thread(target=self._background_build, args=(board,), daemon=True).start()
+                return index
+        with self._first_build_lock:
+            if self._index is None:
+                self._index = self._build(board)
+                self._building_for = board
+            return self._index
+
+_search_index_cache = None
+def get_search_index_cache() -> SearchIndexCache:
+    global _search_index_cache
+    if _search_index_cache is None:
+        _search_index_cache = SearchIndexCache()
+    return _search_index_cache
+
+def get_search_index() -> Optional[UserSearchIndex]:
+    return get_search_index_cache().current()
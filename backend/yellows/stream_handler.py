@@ -0,0 +1,152 @@
+import json
+import sys
+from typing import Callable, Dict, List, Optional, Tuple, Type
+from aws_lambda_powertools.logging import Logger
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.typing import LambdaContext
+from pynamodb.attributes import NumberAttribute
+from pynamodb.exceptions import UpdateError
+
+from yellows.models import Event, EventBooking, User
+from yellows.models.base import BaseItem
+from yellows.powertools import metrics, tracer
+
+logger = Logger()
+
+DISCRIMINATOR_ATTR_NAME = BaseItem.pynamo_discriminator.attr_name
+
+# Entry point for the data table's stream. Counter changes implied by each record are folded
+# together across the batch, then applied as one ADD per affected item.
+
+CounterKey = Tuple[Type[BaseItem], str]
+Contribution = Tuple[CounterKey, NumberAttribute, int]
+
+def _booking_counters(image: dict) -> List[Contribution]:
+    event_key = image['PK']['S']
+    user_key = image['SK']['S']
+    return [
+        ((Event, event_key), Event.attendee_count, 1),
+        ((User, user_key), User.event_count, 1),
+    ]
+
+# What an item of each type counts towards while it exists
+COUNTED_TYPES: Dict[str, Callable[[dict], List[Contribution]]] = {
+    BaseItem.pynamo_discriminator.get_discriminator(EventBooking): _booking_counters,
+}
+
+def _contributions(image: Optional[dict], sign: int) -> List[Contribution]:
+    if not image:
+        return []
+    counted = COUNTED_TYPES.get(image.get(DISCRIMINATOR_ATTR_NAME, {}).get('S'))
+    if counted is None:
+        return []
+    return [(key, attribute, sign * delta) for key, attribute, delta in counted(image)]
+
+def _sequence_number(record: dict) -> int:
+    return int(record['dynamodb']['SequenceNumber'])
+
+class CounterDeltas:
+    def __init__(self):
+        # Per item: attribute name -> (attribute, {sequence number: delta})
+        self.items: Dict[CounterKey, Dict[str, Tuple[NumberAttribute, Dict[int, int]]]] = {}
+
+    def add(self, record: dict):
+        # An INSERT only has a new image and a REMOVE only an old one, so every event type is
+        # "what it counts for now minus what it counted for before"
+        images = record['dynamodb']
+        sequence_number = _sequence_number(record)
+        for key, attribute, delta in _contributions(images.get('NewImage'), 1) + _contributions(images.get('OldImage'), -1):
+            attributes = self.items.setdefault(key, {})
+            _, by_record = attributes.setdefault(attribute.attr_name, (attribute, {}))
+            by_record[sequence_number] = by_record.get(sequence_number, 0) + delta
+
+    def totals(self, key: CounterKey, from_sequence_number: int = 0) -> List[Tuple[NumberAttribute, int]]:
+        ret = []
+        for attribute, by_record in self.items[key].values():
+            total = sum(delta for sequence_number, delta in by_record.items() if sequence_number >= from_sequence_number)
+            if total != 0:
+                ret.append((attribute, total))
+        return ret
+
+    def first_sequence_number(self, key: CounterKey) -> int:
+        return min(n for _, by_record in self.items[key].values() for n in by_record)
+
+def fold_records(records: List[dict]) -> CounterDeltas:
+    deltas = CounterDeltas()
+    for record in records:
+        deltas.add(record)
+    return deltas
+
+def _is_missing_item(e: UpdateError) -> bool:
+    return getattr(e.cause, 'response', {}).get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+def _apply(key: CounterKey, totals: List[Tuple[NumberAttribute, int]]) -> bool:
+    model_cls, item_key = key
+    if not totals:
+        return True
+    try:
+        model_cls.update_counters(item_key, [attribute.add(delta) for attribute, delta in totals])
+    except UpdateError as e:
+        if _is_missing_item(e):
+            # The event or user is gone, so there's nothing left to count against
+            logger.warning("Dropping counter update for missing item %s", item_key)
+            metrics.add_metric('StreamCounterMissingItem', MetricUnit.Count, 1)
+            return True
+        logger.exception("Counter update for %s failed", item_key)
+        return False
+    return True
+
+# Lambda resumes a stream batch from the earliest failure reported, replaying every record after
+# it. So when some updates fail, whatever the successful ones applied from those records is
+# backed out again before reporting, or the replay would count it twice.
+def apply_deltas(deltas: CounterDeltas) -> Optional[int]:
+    applied = []
+    failed = []
+    for key in deltas.items:
+        if _apply(key, deltas.totals(key)):
+            applied.append(key)
+        else:
+            failed.append(key)
+    metrics.add_metric('StreamCounterUpdates', MetricUnit.Count, len(applied))
+    if not failed:
+        return None
+
+    replay_from = min(deltas.first_sequence_number(key) for key in failed)
+    for key in applied:
+        compensation = [(attribute, -delta) for attribute, delta in deltas.totals(key, replay_from)]
+        if not _apply(key, compensation):
+            logger.error("Couldn't back out replayed deltas for %s, its counters will drift", key[1])
+            metrics.add_metric('StreamCounterDrift', MetricUnit.Count, 1)
+    metrics.add_metric('StreamCounterFailures', MetricUnit.Count, len(failed))
+    return replay_from
+
+def process_records(records: List[dict]) -> dict:
+    deltas = fold_records(records)
+    replay_from = apply_deltas(deltas)
+    if replay_from is None:
+        return {'batchItemFailures': []}
+    for record in records:
+        if _sequence_number(record) == replay_from:
+            return {'batchItemFailures': [{'itemIdentifier': record['dynamodb']['SequenceNumber']}]}
+    raise AssertionError("Failed sequence number isn't in the batch")
+
+@logger.inject_lambda_context
+@metrics.log_metrics
+@tracer.capture_lambda_handler
+def lambda_handler(event: dict, context: LambdaContext) -> dict:
+    records = event.get('Records', [])
+    metrics.add_metric('StreamRecords', MetricUnit.Count, len(records))
+    return process_records(records)
+
+# Replays a recorded stream event: python -m yellows.stream_handler event.json [--apply]
+# Without --apply the folded deltas are only printed.
+if __name__ == '__main__':
+    with open(sys.argv[1]) as f:
+        recorded = json.load(f)
+    if '--apply' in sys.argv[2:]:
+        print(json.dumps(process_records(recorded['Records'])))
+    else:
+        folded = fold_records(recorded['Records'])
+        for (model_cls, item_key) in folded.items:
+            for attribute, delta in folded.totals((model_cls, item_key)):
+                print("{} {} {:+d}".format(item_key, attribute.attr_name, delta))
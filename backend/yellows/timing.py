@@ -0,0 +1,68 @@
+import cProfile
+from contextlib import contextmanager
+from functools import wraps
+import io
+import pstats
+import time
+from typing import Dict, Iterator
+from aws_lambda_powertools.metrics import Metrics, MetricUnit
+
+# Request scoped phase timings, reset by api_handler and reported once per request as a single log
+# line and a <Phase>Time metric each. Phases can nest (translation happens inside the view, and
+# DynamoDB calls inside most things), so they don't add up to the total.
+
+PROFILE_TOP_FUNCTIONS = 40
+
+def _metric_name(phase: str) -> str:
+    return ''.join(part.capitalize() for part in phase.split('_')) + 'Time'
+
+class RequestTimer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+
+    def add(self, phase: str, ms: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + ms
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, (time.perf_counter() - t_start) * 1000.0)
+
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self._started_at) * 1000.0
+
+    def add_metrics(self, metrics: Metrics):
+        for phase, ms in self.phases.items():
+            metrics.add_metric(_metric_name(phase), MetricUnit.Milliseconds, ms)
+
+_timer = RequestTimer()
+def get_request_timer() -> RequestTimer:
+    return _timer
+
+def timed(phase: str):
+    def _deco(f):
+        @wraps(f)
+        def _inner(*args, **kwargs):
+            with _timer.phase(phase):
+                return f(*args, **kwargs)
+        return _inner
+    return _deco
+
+@contextmanager
+def profiled(report: Dict[str, str]) -> Iterator[None]:
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        report['profile'] = out.getvalue()
@@ -1 +0,0 @@
-from . import auth, events, users
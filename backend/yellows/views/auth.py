@@ -1,12 +1,10 @@
 from aws_lambda_powertools.event_handler import Response
 from aws_lambda_powertools.event_handler.api_gateway import Router
 from aws_lambda_powertools.logging import Logger
-from aws_lambda_powertools.tracing import Tracer
 from yellows.auth import get_auth
 from yellows.powertools import annotate_operation
 from yellows.request_helpers import get_request_url
 
-tracer = Tracer()
 router = Router()
 logger = Logger()
 
@@ -1,13 +1,19 @@
 
-from typing import Any, Callable, Optional, Protocol, TypeVar, cast
+from typing import Any, Callable, List, Optional, Protocol, Sequence, Tuple, Type, TypeVar, cast
 from aws_lambda_powertools.event_handler.api_gateway import Router
-from aws_lambda_powertools.event_handler.exceptions import BadRequestError
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError, NotFoundError
 from pynamodb.pagination import ResultIterator
 
 from yellows.crypto import get_crypto
+from yellows.models.base import BaseItem
+from yellows.models.raw import RawTranslator
+from yellows.models.sharding import PaginationKeyError
+from yellows.timing import get_request_timer
 
 router = Router()
 
+DISCRIMINATOR_ATTR_NAME = BaseItem.pynamo_discriminator.attr_name
+
 
 def _try_convert_int(s: str, name: str) -> int:
     try:
@@ -17,10 +23,14 @@ def _try_convert_int(s: str, name: str) -> int:
 
 T = TypeVar("T")
 class PynamoGeneratorPartial(Protocol[T]):
-    def __call__(self, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None) -> ResultIterator[T]: # type: ignore
+    def __call__(self, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None, attributes_to_get:Optional[Sequence[str]]=None) -> ResultIterator[T]: # type: ignore
+        pass
+
+class RawQueryPartial(Protocol):
+    def __call__(self, limit:Optional[int]=None, last_evaluated_key:Optional[dict]=None, attributes_to_get:Optional[Sequence[str]]=None) -> dict: # type: ignore
         pass
 
-def wrap_list_iterable(partial: PynamoGeneratorPartial[T], translation: Callable[[T], dict], items_key: str):
+def _get_page_args() -> Tuple[Optional[int], Optional[dict]]:
     max_items = router.current_event.get_query_string_value('max_items')
     if max_items is not None:
         max_items = _try_convert_int(cast(str, max_items), 'max_items')
@@ -33,17 +43,63 @@ def wrap_list_iterable(partial: PynamoGeneratorPartial[T], translation: Callable
             last_key = crypto_helper.decrypt_dict(next_token)
         except:
             raise BadRequestError(f"Bad next_token") 
+    return max_items, last_key
 
-    iterable = partial(limit=max_items, last_evaluated_key=last_key)
-    json_objects = []
-    for i in iterable:
-        json_objects.append(translation(i))
-
+def _make_page(json_objects: List[dict], last_evaluated_key: Optional[dict], items_key: str):
     ret: Any = {
         items_key: json_objects,
         'next_token': None,
     }
-    if iterable.last_evaluated_key:
+    if last_evaluated_key:
         crypto_helper = get_crypto()
-        ret['next_token'] = crypto_helper.encrypt_dict(iterable.last_evaluated_key)
+        ret['next_token'] = crypto_helper.encrypt_dict(last_evaluated_key)
+    return ret
+
+# attributes_to_get should name every attribute translation reads, anything else comes back unset
+def wrap_list_iterable(partial: PynamoGeneratorPartial[T], translation: Callable[[T], dict], items_key: str,
+                       attributes_to_get:Optional[Sequence[str]]=None):
+    max_items, last_key = _get_page_args()
+    try:
+        iterable = partial(limit=max_items, last_evaluated_key=last_key, attributes_to_get=attributes_to_get)
+    except PaginationKeyError:
+        raise BadRequestError("Invalid next_token")
+    json_objects = []
+    for i in iterable:
+        json_objects.append(translation(i))
+    return _make_page(json_objects, iterable.last_evaluated_key, items_key)
+
+# Same contract as wrap_list_iterable, but over a raw Query response and a compiled RawTranslator,
+# skipping model instantiation entirely. Tokens are interchangeable between the two.
+def wrap_raw_list(partial: RawQueryPartial, translation: RawTranslator, items_key: str):
+    max_items, last_key = _get_page_args()
+    try:
+        resp = partial(limit=max_items, last_evaluated_key=last_key, attributes_to_get=translation.attr_names)
+    except PaginationKeyError:
+        raise BadRequestError("Invalid next_token")
+    with get_request_timer().phase('translate'):
+        json_objects = [translation(item) for item in resp['Items']]
+    return _make_page(json_objects, resp.get('LastEvaluatedKey'), items_key)
+
+# For item collections mixing types: the header_model row becomes the single header_key object,
+# items_model rows are paged under items_key and anything else is skipped.
+def wrap_raw_collection(partial: RawQueryPartial,
+                        header_model: Type[BaseItem], header_translation: RawTranslator, header_key: str,
+                        items_model: Type[BaseItem], items_translation: RawTranslator, items_key: str):
+    header_discriminator = BaseItem.pynamo_discriminator.get_discriminator(header_model)
+    items_discriminator = BaseItem.pynamo_discriminator.get_discriminator(items_model)
+    max_items, last_key = _get_page_args()
+    resp = partial(limit=max_items, last_evaluated_key=last_key)
+    if last_key is None and not resp['Items']:
+        raise NotFoundError()
+    header = None
+    json_objects = []
+    with get_request_timer().phase('translate'):
+        for item in resp['Items']:
+            discriminator = item.get(DISCRIMINATOR_ATTR_NAME, {}).get('S')
+            if discriminator == header_discriminator:
+                header = header_translation(item)
+            elif discriminator == items_discriminator:
+                json_objects.append(items_translation(item))
+    ret = _make_page(json_objects, resp.get('LastEvaluatedKey'), items_key)
+    ret[header_key] = header
     return ret
@@ -1,11 +1,17 @@
+from datetime import datetime, timezone
 import functools
+from typing import Optional
 from aws_lambda_powertools.event_handler.api_gateway import Router
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError
 from aws_lambda_powertools.logging import Logger
 
 from yellows.auth import auth_required
-from yellows.models import Event
+from yellows.cache import TTLCache
+from yellows.config import get_config
+from yellows.models import Event, EventBooking
+from yellows.models.raw import compile_translator
 from yellows.powertools import annotate_operation
-from yellows.views.common import wrap_list_iterable
+from yellows.views.common import _make_page, wrap_raw_collection, wrap_raw_list
 
 router = Router()
 logger = Logger()
@@ -20,14 +26,104 @@ def _translate_event(event: Event) -> dict:
         'ends_at': event.ends_at.isoformat(),
     }
 
+# Must produce exactly what _translate_event does for the same item
+_translate_raw_event = compile_translator({
+    'short_name': Event.short_name,
+    'long_name': Event.long_name,
+    'attendee_count': Event.attendee_count,
+    'yellow_count': Event.yellow_count,
+    'starts_at': Event.starts_at,
+    'ends_at': Event.ends_at,
+})
+
+_translate_raw_event_booking = compile_translator({
+    'nick_name': EventBooking.user_nick_name,
+    'full_name': EventBooking.user_full_name,
+    'eta': EventBooking.eta,
+    'etd': EventBooking.etd,
+    'role': EventBooking.role,
+    'is_team_lead': EventBooking.is_team_lead,
+})
+
+_upcoming_cache = None
+def _get_upcoming_cache() -> TTLCache:
+    global _upcoming_cache
+    if _upcoming_cache is None:
+        _upcoming_cache = TTLCache(get_config().upcoming_events_cache_seconds, max_size=32)
+    return _upcoming_cache
+
+def _get_time_param(name: str) -> Optional[datetime]:
+    value = router.current_event.get_query_string_value(name)
+    if value is None:
+        return None
+    try:
+        t = datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequestError(f"{name} is not an ISO 8601 time")
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t
+
 @router.get('/')
 @auth_required()
 @annotate_operation
 def list():
-    return wrap_list_iterable(functools.partial(Event.list_ordered), _translate_event, 'events')
+    window = router.current_event.get_query_string_value('window')
+    order = router.current_event.get_query_string_value('order')
+    starts_from = _get_time_param('from')
+    starts_to = _get_time_param('to')
+    if starts_from is not None and starts_to is not None and starts_from > starts_to:
+        raise BadRequestError("from is after to")
+
+    scan_index_forward = True
+    # "upcoming" is soonest first, "past" is most recent first. Each sets one end of the range
+    # to now, so that end can't also be given.
+    if window == 'upcoming':
+        if starts_from is not None:
+            raise BadRequestError("from can't be combined with window=upcoming")
+        starts_from = datetime.now(timezone.utc)
+    elif window == 'past':
+        if starts_to is not None:
+            raise BadRequestError("to can't be combined with window=past")
+        starts_to = datetime.now(timezone.utc)
+        scan_index_forward = False
+    elif window is not None:
+        raise BadRequestError("window must be 'upcoming' or 'past'")
+    if order is not None:
+        if order not in ('asc', 'desc'):
+            raise BadRequestError("order must be 'asc' or 'desc'")
+        scan_index_forward = order == 'asc'
+    # e.g. upcoming events up to a time already past. DynamoDB rejects an inverted BETWEEN.
+    if starts_from is not None and starts_to is not None and starts_from > starts_to:
+        return _make_page([], None, 'events')
+
+    # The dashboard's "next N events" is the same first page for everyone, so briefly share it
+    cache_key = None
+    query_params = router.current_event.query_string_parameters or {}
+    if window == 'upcoming' and set(query_params.keys()) <= {'window', 'order', 'max_items'}:
+        cache_key = (window, scan_index_forward, query_params.get('max_items'))
+        cached = _get_upcoming_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
+    partial = functools.partial(
+        Event.list_starting_raw, starts_from=starts_from, starts_to=starts_to, scan_index_forward=scan_index_forward)
+    ret = wrap_raw_list(partial, _translate_raw_event, 'events')
+    if cache_key is not None:
+        _get_upcoming_cache().put(cache_key, ret)
+    return ret
 
 @router.post('/')
 @auth_required('event-admin')
 @annotate_operation
 def post(user=None):
     return user.__dict__
+
+@router.get('/<short_name>')
+@auth_required()
+@annotate_operation
+def get(short_name: str):
+    return wrap_raw_collection(
+        functools.partial(Event.list_with_bookings_raw, short_name),
+        Event, _translate_raw_event, 'event',
+        EventBooking, _translate_raw_event_booking, 'bookings')
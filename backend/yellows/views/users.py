@@ -1,16 +1,25 @@
 import functools
 from aws_lambda_powertools.event_handler.api_gateway import Router
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError, NotFoundError, ServiceError
 from aws_lambda_powertools.logging import Logger
 
 from yellows.auth import auth_required
-from yellows.models.users import User
+from yellows.leaderboard import Leaderboard, get_leaderboard_cache
+from yellows.models import EventBooking, User
+from yellows.models.raw import compile_translator
 from yellows.powertools import annotate_operation
-from yellows.views.common import wrap_list_iterable
+from yellows.search import get_search_index
+from yellows.views.common import _try_convert_int, wrap_raw_collection, wrap_raw_list
 
 
 router = Router()
 logger = Logger()
 
+LEADERBOARD_DEFAULT_ITEMS = 10
+LEADERBOARD_MAX_ITEMS = 100
+SEARCH_DEFAULT_ITEMS = 10
+SEARCH_MAX_ITEMS = 50
+
 def _translate_user(user: User) -> dict:
     return {
         'nick_name': user.nick_name,
@@ -19,8 +28,97 @@ def _translate_user(user: User) -> dict:
         'achievement_score': user.achievement_score,
     }
 
+# Must produce exactly what _translate_user does for the same item
+_translate_raw_user = compile_translator({
+    'nick_name': User._nick_name,
+    'full_name': User.full_name,
+    'event_count': User.event_count,
+    'achievement_score': User._achievement_score,
+})
+
+_translate_raw_user_booking = compile_translator({
+    'short_name': EventBooking.event_short_name,
+    'long_name': EventBooking.event_long_name,
+    'eta': EventBooking.eta,
+    'etd': EventBooking.etd,
+    'role': EventBooking.role,
+    'is_team_lead': EventBooking.is_team_lead,
+})
+
 @router.get('/')
 @auth_required()
 @annotate_operation
 def list():
-    return wrap_list_iterable(functools.partial(User.list_ordered, scan_index_forward=False), _translate_user, 'users')
+    # Optional min_score/max_score (inclusive) page a score band straight off the index
+    scores = {}
+    for name in ('min_score', 'max_score'):
+        value = router.current_event.get_query_string_value(name)
+        if value is not None:
+            scores[name] = _try_convert_int(value, name)
+            # Nobody scores outside this, and bounds beyond it aren't valid DynamoDB numbers
+            if abs(scores[name]) > User._SORT_ORDER_MAX_SCORE:
+                raise BadRequestError(f"{name} must be within ±{User._SORT_ORDER_MAX_SCORE}")
+    if 'min_score' in scores and 'max_score' in scores and scores['min_score'] > scores['max_score']:
+        raise BadRequestError("min_score is above max_score")
+    return wrap_raw_list(functools.partial(User.list_leaderboard_raw, **scores), _translate_raw_user, 'users')
+
+def _get_leaderboard() -> Leaderboard:
+    board = get_leaderboard_cache().current()
+    if board is None:
+        raise ServiceError(503, "Leaderboard not built yet")
+    return board
+
+# /leaderboard and /search are registered ahead of /<nick_name> so they aren't taken for nick names
+@router.get('/leaderboard')
+@auth_required()
+@annotate_operation
+def leaderboard():
+    max_items = router.current_event.get_query_string_value('max_items')
+    count = LEADERBOARD_DEFAULT_ITEMS if max_items is None else _try_convert_int(max_items, 'max_items')
+    count = max(1, min(count, LEADERBOARD_MAX_ITEMS))
+    board = _get_leaderboard()
+    around = router.current_event.get_query_string_value('around')
+    if around is None:
+        users = board.top(count)
+    else:
+        users = board.around(around, count)
+        if users is None:
+            raise NotFoundError()
+    return {
+        'users': users,
+        'total': len(board),
+        'generation': board.generation,
+    }
+
+@router.get('/search')
+@auth_required()
+@annotate_operation
+def search():
+    q = router.current_event.get_query_string_value('q')
+    if not q or not q.strip():
+        raise BadRequestError("q is required")
+    max_items = router.current_event.get_query_string_value('max_items')
+    count = SEARCH_DEFAULT_ITEMS if max_items is None else _try_convert_int(max_items, 'max_items')
+    count = max(1, min(count, SEARCH_MAX_ITEMS))
+    index = get_search_index()
+    if index is None:
+        raise ServiceError(503, "Search index not built yet")
+    return {'users': index.search(q, count)}
+
+@router.get('/<nick_name>/rank')
+@auth_required()
+@annotate_operation
+def rank(nick_name: str):
+    ret = _get_leaderboard().rank(nick_name)
+    if ret is None:
+        raise NotFoundError()
+    return ret
+
+@router.get('/<nick_name>')
+@auth_required()
+@annotate_operation
+def get(nick_name: str):
+    return wrap_raw_collection(
+        functools.partial(User.list_with_bookings_raw, nick_name),
+        User, _translate_raw_user, 'user',
+        EventBooking, _translate_raw_user_booking, 'bookings')
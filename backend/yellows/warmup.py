@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+from aws_lambda_powertools.logging import Logger
+
+from yellows.config import get_config
+
+logger = Logger()
+
+def _run(name, f):
+    try:
+        f()
+    except Exception:
+        # Whatever failed here is retried lazily by the first request that needs it
+        logger.exception("Warm up of %s failed", name)
+
+def warm_up():
+    from yellows.auth import get_auth
+    from yellows.crypto import get_crypto
+
+    t_start = time.monotonic()
+    config = get_config()
+    # boto3 sessions aren't thread safe, so build the clients here and only fan out the network calls
+    config.secrets_manager_client
+    config.kms_client
+    config.pynamodb_client
+    auth = get_auth()
+    crypto = get_crypto()
+    tasks = {
+        'secrets': config.prefetch_secrets,
+        'revocations': auth.revocations.warm_up,
+        'token_data_key': crypto.warm_up,
+    }
+    with ThreadPoolExecutor(max_workers=len(tasks)) as pool:
+        for name, f in tasks.items():
+            pool.submit(_run, name, f)
+    # Needs the secrets fetched above
+    _run('jwt_keys', auth.keys)
+    logger.info("Warm up took %.1fms", (time.monotonic() - t_start) * 1000.0)
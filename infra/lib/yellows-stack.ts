@@ -1,18 +1,22 @@
 import { Stack, StackProps, Duration, CfnParameter, SecretValue } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
-import { DockerImageFunction, DockerImageCode, IFunction, Tracing } from 'aws-cdk-lib/aws-lambda';
+import { DockerImageFunction, DockerImageCode, IFunction, StartingPosition, Tracing } from 'aws-cdk-lib/aws-lambda';
+import { DynamoEventSource } from 'aws-cdk-lib/aws-lambda-event-sources';
 import { LambdaRestApi, AccessLogFormat, LogGroupLogDestination, MethodLoggingLevel, RestApi } from 'aws-cdk-lib/aws-apigateway';
 import { LogGroup, RetentionDays } from 'aws-cdk-lib/aws-logs';
-import { Distribution, PriceClass, SecurityPolicyProtocol, OriginRequestPolicy, CachePolicy, ViewerProtocolPolicy, AllowedMethods, OriginRequestHeaderBehavior, OriginAccessIdentity, OriginRequestCookieBehavior, OriginRequestQueryStringBehavior, IDistribution } from 'aws-cdk-lib/aws-cloudfront';
+import { Distribution, PriceClass, SecurityPolicyProtocol, OriginRequestPolicy, CachePolicy, CacheCookieBehavior, CacheHeaderBehavior, CacheQueryStringBehavior, ViewerProtocolPolicy, AllowedMethods, OriginRequestHeaderBehavior, OriginAccessIdentity, OriginRequestCookieBehavior, OriginRequestQueryStringBehavior, IDistribution } from 'aws-cdk-lib/aws-cloudfront';
 import { RestApiOrigin, S3Origin } from 'aws-cdk-lib/aws-cloudfront-origins';
 import { Bucket, BucketEncryption, IBucket } from 'aws-cdk-lib/aws-s3';
 import { BucketDeployment, Source } from 'aws-cdk-lib/aws-s3-deployment';
 import { ISecret, Secret } from 'aws-cdk-lib/aws-secretsmanager';
-import { ITable, Table, AttributeType, BillingMode, TableEncryption } from 'aws-cdk-lib/aws-dynamodb';
+import { ITable, Table, AttributeType, BillingMode, ProjectionType, StreamViewType, TableEncryption } from 'aws-cdk-lib/aws-dynamodb';
 import { ARecord, AaaaRecord, HostedZone, RecordTarget } from 'aws-cdk-lib/aws-route53';
 import { CloudFrontTarget } from 'aws-cdk-lib/aws-route53-targets';
 import { Certificate, ICertificate } from 'aws-cdk-lib/aws-certificatemanager';
 import { Key, KeySpec, IKey } from 'aws-cdk-lib/aws-kms';
+import { PolicyStatement } from 'aws-cdk-lib/aws-iam';
+import { Rule, Schedule } from 'aws-cdk-lib/aws-events';
+import { LambdaFunction } from 'aws-cdk-lib/aws-events-targets';
 
 export interface YellowsStackProps extends StackProps {
   domainName: string,
@@ -29,6 +33,8 @@ export class YellowsStack extends Stack {
     const dataTable = this.makeDataTable(key);
     const apiLambda = this.makeBackendFunction(dataTable, key, props.domainName);
     const apiGw = this.makeApiGateway(apiLambda);
+    this.makeLeaderboardFunction(dataTable);
+    this.makeStreamFunction(dataTable);
     const staticBucket = this.makeStaticContent();
 
     const certificate = Certificate.fromCertificateArn(this, 'CloudfrontCert', props.certificateArn);
@@ -46,6 +52,7 @@ export class YellowsStack extends Stack {
       timeToLiveAttribute: 'TimeToLive',
       encryption: TableEncryption.CUSTOMER_MANAGED,
       encryptionKey: key,
+      stream: StreamViewType.NEW_AND_OLD_IMAGES,
     });
     table.addGlobalSecondaryIndex({
       partitionKey: { name: 'SK', type: AttributeType.STRING },
@@ -57,6 +64,14 @@ export class YellowsStack extends Stack {
       sortKey: { name: 'IndexSortOrder', type: AttributeType.NUMBER },
       indexName: 'TypeIndexOrder',
     });
+    // Narrow copy of TypeIndexOrder for the leaderboard, used when USE_LEADERBOARD_INDEX=true
+    table.addGlobalSecondaryIndex({
+      partitionKey: { name: 'Type', type: AttributeType.STRING },
+      sortKey: { name: 'IndexSortOrder', type: AttributeType.NUMBER },
+      indexName: 'LeaderboardIndex',
+      projectionType: ProjectionType.INCLUDE,
+      nonKeyAttributes: ['NickName', 'FullName', 'EventCount', 'AchievementScore', '__PDB_DISCRIM'],
+    });
     return table;
   }
 
@@ -112,6 +127,7 @@ export class YellowsStack extends Stack {
         DDB_TABLE_NAME: dataTable.tableName,
         DOMAIN_NAME: domainName,
         KMS_KEY_ARN: key.keyArn,
+        STREAM_COUNTERS: 'true',
       },
       memorySize: 256,
       tracing: Tracing.ACTIVE,
@@ -119,11 +135,67 @@ export class YellowsStack extends Stack {
     dataTable.grantReadWriteData(apiLambda);
     discordSecret.grantRead(apiLambda);
     jwtSecret.grantRead(apiLambda);
+    // BatchGetSecretValue is authorised on '*', GetSecretValue on each secret still applies
+    apiLambda.addToRolePolicy(new PolicyStatement({
+      actions: ['secretsmanager:BatchGetSecretValue'],
+      resources: ['*'],
+    }));
     key.grantEncryptDecrypt(apiLambda);
 
     return apiLambda;
   }
 
+  private makeLeaderboardFunction(dataTable: ITable): IFunction {
+    const leaderboardLambda = new DockerImageFunction(this, 'LeaderboardFunction', {
+      code: DockerImageCode.fromImageAsset('./../backend/', {
+        cmd: ["yellows.leaderboard.lambda_handler"],
+      }),
+      timeout: Duration.minutes(5),
+      logRetention: RetentionDays.ONE_YEAR,
+      environment: {
+        POWERTOOLS_SERVICE_NAME: 'Yellows-Leaderboard',
+        POWERTOOLS_METRICS_NAMESPACE: 'Yellows',
+        DDB_TABLE_NAME: dataTable.tableName,
+      },
+      memorySize: 512,
+      tracing: Tracing.ACTIVE,
+    });
+    dataTable.grantReadWriteData(leaderboardLambda);
+
+    new Rule(this, 'LeaderboardSchedule', {
+      schedule: Schedule.rate(Duration.minutes(5)),
+      targets: [new LambdaFunction(leaderboardLambda)],
+    });
+    return leaderboardLambda;
+  }
+
+  private makeStreamFunction(dataTable: ITable): IFunction {
+    const streamLambda = new DockerImageFunction(this, 'StreamFunction', {
+      code: DockerImageCode.fromImageAsset('./../backend/', {
+        cmd: ["yellows.stream_handler.lambda_handler"],
+      }),
+      timeout: Duration.minutes(1),
+      logRetention: RetentionDays.ONE_YEAR,
+      environment: {
+        POWERTOOLS_SERVICE_NAME: 'Yellows-Stream',
+        POWERTOOLS_METRICS_NAMESPACE: 'Yellows',
+        DDB_TABLE_NAME: dataTable.tableName,
+        STREAM_COUNTERS: 'true',
+      },
+      memorySize: 256,
+      tracing: Tracing.ACTIVE,
+    });
+    dataTable.grantReadWriteData(streamLambda);
+    streamLambda.addEventSource(new DynamoEventSource(dataTable, {
+      startingPosition: StartingPosition.TRIM_HORIZON,
+      batchSize: 500,
+      maxBatchingWindow: Duration.seconds(5),
+      reportBatchItemFailures: true,
+      retryAttempts: 10,
+    }));
+    return streamLambda;
+  }
+
   private makeApiGateway(backendFunction: IFunction): RestApi {
     const accessLogGroup = new LogGroup(this, 'AccessLogGroup', {
       logGroupName: 'Yellows/ApiGateway/access.log',
@@ -131,6 +203,10 @@ export class YellowsStack extends Stack {
     });
     return new LambdaRestApi(this, 'ApiGateway', {
       handler: backendFunction,
+      // Compressed JSON comes back base64 encoded and is passed through as binary. API Gateway
+      // decides by the request's first Accept type, which responses.py checks before compressing.
+      // Must match BINARY_MEDIA_TYPES there.
+      binaryMediaTypes: ['application/json'],
       deployOptions: {
         accessLogDestination: new LogGroupLogDestination(accessLogGroup),
         accessLogFormat: AccessLogFormat.jsonWithStandardFields(),
@@ -172,12 +248,27 @@ export class YellowsStack extends Stack {
     const apiGatewayOriginRequestPolicy = new OriginRequestPolicy(this, 'CloudfrontApiGwOriginRequestPolicy', {
       headerBehavior: OriginRequestHeaderBehavior.allowList(
         'X-Niax-AHHHHH',
+        'If-None-Match',
       ),
       cookieBehavior: OriginRequestCookieBehavior.all(),
       queryStringBehavior: OriginRequestQueryStringBehavior.all(),
       originRequestPolicyName: 'ApiGatewayRequestPolicy',
     });
 
+    // Nothing is cached beyond what the API asks for, and it asks for nothing. The non-zero max TTL
+    // is what allows the policy to forward a normalised Accept-Encoding, so the Lambda can compress.
+    const apiGatewayCachePolicy = new CachePolicy(this, 'CloudfrontApiGwCachePolicy', {
+      minTtl: Duration.seconds(0),
+      defaultTtl: Duration.seconds(0),
+      maxTtl: Duration.seconds(1),
+      headerBehavior: CacheHeaderBehavior.allowList('Accept'),
+      cookieBehavior: CacheCookieBehavior.all(),
+      queryStringBehavior: CacheQueryStringBehavior.all(),
+      enableAcceptEncodingGzip: true,
+      enableAcceptEncodingBrotli: true,
+      cachePolicyName: 'ApiGatewayCachePolicy',
+    });
+
     const defaultBehavior = {
       viewerProtocolPolicy: ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
     };
@@ -199,7 +290,7 @@ export class YellowsStack extends Stack {
     cloudfrontDistro.addBehavior('api/*' , apiGwOrigin, {
       ...defaultBehavior,
       originRequestPolicy: apiGatewayOriginRequestPolicy,
-      cachePolicy: CachePolicy.CACHING_DISABLED,
+      cachePolicy: apiGatewayCachePolicy,
       allowedMethods: AllowedMethods.ALLOW_ALL,
       compress: false,
     });